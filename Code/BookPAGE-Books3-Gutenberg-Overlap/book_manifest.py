@@ -0,0 +1,182 @@
+"""
+    This file parses the BookPAGE book list (Dataset/books.txt, or a file of overlapped or non overlapped titles in the
+    same format) once into an indexed manifest, shared by overlap.py, overlapped_and_nonoverlapped_decade.py and
+    combine_decades.py. The file lists decade headers (e.g. "1950-1959"), each followed by the books of the decade,
+    one "Title by Author" per line. The manifest is cached per file and reparsed only when the file changes.
+"""
+
+import os  # Module for interacting with the file system
+import re  # Module for regular expression matching
+from collections import namedtuple, defaultdict  # Record type of a book and dictionaries of lists
+
+# Regular expression to match decade headers (e.g., "1990-1999"); hyphenated titles are not headers
+DECADE_PATTERN = re.compile(r"^\d{4}-\d{4}$")
+
+# A book of the manifest: its decade, title and author (None if the line has no author)
+Book = namedtuple("Book", ["decade", "title", "author"])
+
+# Manifests already parsed, keyed by path, with the modification time of the file they were parsed from
+_manifest_cache = {}
+
+
+def sanitize_title(title):
+    """
+    Removes any apostrophes in the title of the books, as the dataset JSON files do.
+
+    :param title: Book title.
+
+    :returns: str: sanitized book title.
+    """
+    return title.replace("'", "")
+
+
+def parse_book_line(line):
+    """
+    Split a book line into title and author.
+
+    :param line: A stripped line of the book list, e.g. "Two by Two by Nicholas Sparks".
+
+    :returns: tuple: The title and the author (None if the line has no author).
+    """
+    if " by " in line:
+        title, author = line.rsplit(" by ", 1)  # Split on the last " by ", titles may contain "by"
+    elif "\t" in line:
+        title, author = line.split("\t", 1)  # A few lines separate the author with a tab instead
+    else:
+        title, author = line, None
+    return title.strip(), author.strip() if author else None
+
+
+def join_content(titles, data_dict, missing="Content not found"):
+    """
+    Join book titles with their contents.
+
+    :param titles: A list of book titles.
+    :param data_dict: Dictionary with (sanitized) book titles as keys and their content as values.
+    :param missing: The content of the titles missing from data_dict.
+
+    :returns: list: A list of dictionaries with the book titles and their respective contents.
+    """
+    content = []
+    for title in titles:
+        key = title if title in data_dict else sanitize_title(title)  # Fall back on the sanitized title
+        content.append({"title": title, "content": data_dict.get(key, missing)})  # Look up every content once
+    return content
+
+
+class BookManifest:
+    """
+    The books of the book list, indexed by decade, title and author.
+    """
+
+    def __init__(self, books, decades=()):
+        """
+        :param books: A list of Book tuples, in the order of the file.
+        :param decades: The decade headers in the order of the file, so the decades without books are listed too.
+        """
+        self.books = books  # Every book in file order
+        self.by_decade = defaultdict(list)  # Books of every decade
+        for decade in decades:
+            self.by_decade[decade] = []
+        self.by_title = defaultdict(list)  # Books of every title and sanitized title
+        self.by_author = defaultdict(list)  # Books of every author
+        for book in books:
+            self.by_decade[book.decade].append(book)
+            self.by_title[book.title].append(book)
+            if sanitize_title(book.title) != book.title:
+                self.by_title[sanitize_title(book.title)].append(book)
+            if book.author:
+                self.by_author[book.author].append(book)
+
+    def __len__(self):
+        return len(self.books)
+
+    def decades(self):
+        """
+        :returns: list: The decades of the manifest in file order (e.g. ['1950-1959', '1960-1969', ...]).
+        """
+        return list(self.by_decade)
+
+    def titles(self, decade=None, sanitized=False):
+        """
+        Get the titles of the manifest.
+
+        :param decade: If given, only the titles of this decade.
+        :param sanitized: If True, the titles are sanitized with sanitize_title.
+
+        :returns: list: The titles in file order.
+        """
+        books = self.books if decade is None else self.by_decade.get(decade, [])
+        return [sanitize_title(book.title) if sanitized else book.title for book in books]
+
+    def titles_by_decade(self, sanitized=False):
+        """
+        Group the titles by decade.
+
+        :param sanitized: If True, the titles are sanitized with sanitize_title.
+
+        :returns: dict: A dictionary where each key is a decade (str) and its value is a list of book titles.
+        """
+        return {decade: self.titles(decade, sanitized) for decade in self.by_decade}
+
+    def find_title(self, title):
+        """
+        Look up the books with a title, as written in the file or sanitized.
+
+        :param title: The book title.
+
+        :returns: list: The matching Book tuples, empty if there is none.
+        """
+        return list(self.by_title.get(title, []))
+
+    def find_author(self, author):
+        """
+        Look up the books of an author.
+
+        :param author: The author, as written in the file.
+
+        :returns: list: The Book tuples of the author, empty if there is none.
+        """
+        return list(self.by_author.get(author, []))
+
+
+def parse_manifest(file_path):
+    """
+    Parse a book list into a manifest.
+
+    :param file_path: The path to the text file containing the decade headers and book lines.
+
+    :returns: BookManifest: The manifest of the file.
+    """
+    books = []  # Books in file order
+    decades = []  # Decade headers in file order
+    current_decade = None  # Variable to track the current decade
+    with open(file_path, 'r', encoding='utf-8') as file:  # Open the file for reading
+        for line in file:  # Iterate through each line in the file
+            line = line.strip()  # Remove leading/trailing whitespace
+            if not line:
+                continue
+            if DECADE_PATTERN.match(line):  # Check if the line is a decade header
+                current_decade = line  # Set the current decade
+                decades.append(current_decade)
+            elif current_decade:  # Book lines before the first decade header are ignored
+                title, author = parse_book_line(line)
+                books.append(Book(current_decade, title, author))
+    return BookManifest(books, decades)
+
+
+def load_manifest(file_path):
+    """
+    Get the manifest of a book list, parsing the file only the first time or when it has changed.
+
+    :param file_path: The path to the text file containing the decade headers and book lines.
+
+    :returns: BookManifest: The manifest of the file.
+    """
+    key = os.path.abspath(file_path)
+    mtime = os.path.getmtime(file_path)
+    cached = _manifest_cache.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, parse_manifest(file_path))
+        _manifest_cache[key] = cached
+    return cached[1]
@@ -0,0 +1,193 @@
+"""
+    This file provides a store of book texts for building the overlapped and non overlapped subsets, so they do not
+    load every book of a decade dataset to pick a few titles. Every text is appended once to a single blob file, keyed
+    by the SHA-256 hash of its content (the same text in two datasets is stored once), and an index records the
+    offset and length of every text and the content hash of every title of every dataset. Reading a book is a seek
+    and a read of its bytes only.
+
+    A dataset file (a JSON array of {"title", "content"} objects, or the JSON Lines bundle of Dataset_bundle.py with
+    one object per line) is imported the first time it is used and again only when its size or modification time
+    changes; otherwise it is not opened at all. Imports stream the file one book at a time, in both formats.
+"""
+
+import os  # Module for interacting with the file system
+import json  # Module for reading the datasets and saving the index
+import hashlib  # Module for hashing the book texts
+
+from book_manifest import sanitize_title  # Titles are stored sanitized, as the dataset lookups use them
+
+# File names of the blob file and the index in the store directory
+BLOB_FILE = "books.dat"
+INDEX_FILE = "index.json"
+# Number of characters read at a time from a JSON array dataset
+READ_SIZE = 1 << 20
+
+
+def iter_books(json_path):
+    """
+    Read the books of a dataset one at a time, without loading the whole file.
+
+    :param json_path: Path to the dataset, a JSON array or a JSON Lines file of objects with 'title' and 'content'
+                      keys. The format is recognized from the first character of the file.
+
+    :returns generator: A generator of the book objects, in file order.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path, 'r', encoding='utf-8') as file:
+        buffer = file.read(READ_SIZE).lstrip()
+        if not buffer.startswith('['):
+            # JSON Lines: one book per line
+            file.seek(0)
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        # JSON array: decode one element at a time from a buffer refilled from the file
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                book, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                more = file.read(READ_SIZE)
+                if not more:
+                    raise  # The file ends inside an element, or is not a JSON array
+                buffer += more  # The element continues past the buffer
+                continue
+            yield book
+            buffer = buffer[end:]
+
+
+class BookStore:
+    """
+    Content addressed store of book texts with an index of the titles of every imported dataset.
+    """
+
+    def __init__(self, store_dir):
+        """
+        :param store_dir: The directory of the store, created if it does not exist.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        self.blob_path = os.path.join(store_dir, BLOB_FILE)
+        self.index_path = os.path.join(store_dir, INDEX_FILE)
+        self.blobs = {}  # Offset and length of every text, keyed by content hash
+        self.sources = {}  # Size, modification time and title to content hash mapping of every dataset
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+            self.blobs, self.sources = index["blobs"], index["sources"]
+        # Texts appended after the last saved index are not referenced, so drop them by truncating the blob file
+        end = max((offset + length for offset, length in self.blobs.values()), default=0)
+        with open(self.blob_path, 'ab') as file:
+            file.truncate(end)
+
+    def _save_index(self):
+        # Write the index to a temporary file first, so an interrupted save leaves the old index intact
+        temporary_file = self.index_path + ".tmp"
+        with open(temporary_file, 'w', encoding='utf-8') as file:
+            json.dump({"blobs": self.blobs, "sources": self.sources}, file)
+        os.replace(temporary_file, self.index_path)
+
+    def add_text(self, content, blob_file):
+        """
+        Append a text to the blob file, unless a text with the same content is already stored.
+
+        :param content: The text of the book.
+        :param blob_file: The blob file, open for appending in binary mode.
+
+        :returns: str: The content hash of the text.
+        """
+        data = content.encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        if content_hash not in self.blobs:  # Store every distinct text once
+            blob_file.seek(0, os.SEEK_END)
+            self.blobs[content_hash] = [blob_file.tell(), len(data)]
+            blob_file.write(data)
+        return content_hash
+
+    def import_json(self, json_path, source):
+        """
+        Import the books of a dataset file, unless it was already imported and has not changed since. The books are
+        read and appended to the blob file one at a time.
+
+        :param json_path: Path to the dataset, a JSON array or a JSON Lines file of objects with 'title' and 'content'
+                          keys.
+        :param source: The name the dataset is stored under, e.g. 'dataset1'.
+
+        :returns: bool: True if the file was imported, False if the store was already up to date.
+        """
+        stat = os.stat(json_path)
+        imported = self.sources.get(source)
+        if imported is not None and imported["size"] == stat.st_size and imported["mtime"] == stat.st_mtime:
+            return False
+        titles = {}  # Content hash of every sanitized title of the dataset
+        with open(self.blob_path, 'ab') as blob_file:
+            for item in iter_books(json_path):
+                titles[sanitize_title(item['title'])] = self.add_text(item['content'], blob_file)
+        self.sources[source] = {"size": stat.st_size, "mtime": stat.st_mtime, "titles": titles}
+        self._save_index()
+        return True
+
+    def read(self, content_hash):
+        """
+        Read a text from the blob file.
+
+        :param content_hash: The content hash of the text.
+
+        :returns: str: The text.
+        """
+        offset, length = self.blobs[content_hash]
+        with open(self.blob_path, 'rb') as file:
+            file.seek(offset)
+            return file.read(length).decode('utf-8')
+
+    def source(self, source):
+        """
+        Get a lazy view of the books of a dataset.
+
+        :param source: The name the dataset was imported under.
+
+        :returns: SourceView: A dictionary-like view of the books by sanitized title, reading a text only when it is
+                              looked up.
+        """
+        return SourceView(self, self.sources.get(source, {}).get("titles", {}))
+
+
+class SourceView:
+    """
+    Dictionary-like view of the books of a dataset, keyed by sanitized title. Titles are checked against the index
+    only; the text of a book is read from the blob file when it is looked up with get or [].
+    """
+
+    def __init__(self, store, titles):
+        """
+        :param store: The BookStore the books are read from.
+        :param titles: The content hash of every sanitized title of the dataset.
+        """
+        self.store = store
+        self.titles = titles
+
+    def __contains__(self, title):
+        return title in self.titles
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __iter__(self):
+        return iter(self.titles)
+
+    def __getitem__(self, title):
+        return self.store.read(self.titles[title])
+
+    def get(self, title, default=None):
+        """
+        Read the text of a book.
+
+        :param title: The sanitized title of the book.
+        :param default: The value returned if the title is not in the dataset.
+
+        :returns: str: The text of the book, or default.
+        """
+        return self.store.read(self.titles[title]) if title in self.titles else default
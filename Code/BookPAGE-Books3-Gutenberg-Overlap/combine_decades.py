@@ -7,6 +7,8 @@
 import json
 import os
 
+from book_manifest import load_manifest
+
 def combine_json_files(file_prefix, decades, base_path):
     """
     Combines JSON files that have a common prefix and are differentiated by decades.
@@ -39,9 +41,10 @@ def save_combined_json(data, output_file):
         json.dump(data, file, indent=4, ensure_ascii=False)
     print(f"Data successfully saved to {output_file}")
 
-# Define the base path and decade ranges
+# Define the base path and read the decade ranges from the book list
 base_path = 'specify your base path'
-decades = ['1950-1959', '1960-1969', '1970-1979', '1980-1989', '1990-1999', '2000-2009', '2010-2019']
+books_file = 'path to Dataset/books.txt'
+decades = load_manifest(books_file).decades()
 
 # Combine and save overlapped titles into one JSON
 overlapped_data = combine_json_files('overlapped_', decades, base_path)
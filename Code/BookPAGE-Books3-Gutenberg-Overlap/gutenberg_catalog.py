@@ -0,0 +1,193 @@
+"""
+    This file builds a catalog of the Project Gutenberg books (ID, title, authors and languages) from the Gutenberg RDF
+    files, for overlap.py. Every RDF file is read with a streaming XML parser that only keeps the few elements needed,
+    instead of loading it into an RDF graph, and the files are shared out over a pool of worker processes. The catalog
+    is saved to a pickle file together with the modification time of every RDF file, so a later run loads it in
+    milliseconds and only parses again the RDF files that were added or changed since.
+"""
+
+import os  # Module for interacting with the file system
+import pickle  # Module for saving the catalog
+import argparse  # Module for the command line interface
+import xml.etree.ElementTree as ET  # Streaming XML parser
+from concurrent.futures import ProcessPoolExecutor  # Pool of worker processes parsing the RDF files
+from tqdm import tqdm  # Library for displaying progress bars
+
+# Version of the catalog file format, a catalog saved with another version is built again
+CATALOG_VERSION = 1
+# Number of RDF files sent to a worker process at a time
+CHUNK_SIZE = 256
+
+# Namespaces of the elements read from the RDF files
+RDF = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+PGTERMS = '{http://www.gutenberg.org/2009/pgterms/}'
+DCTERMS = '{http://purl.org/dc/terms/}'
+
+
+def parse_rdf_file(rdf_path):
+    """
+    Extract the ID, title, authors and languages of the books described in a Gutenberg RDF file.
+
+    :param rdf_path: The path to the RDF file.
+
+    :returns: list: A (ID, title, authors, languages) tuple for every ebook of the file, authors and languages being
+                    tuples of str. None if the file cannot be parsed.
+    """
+    books = []  # Books found in the file
+    book = None  # Fields of the ebook being read
+    path = []  # Tags of the elements enclosing the current element
+    try:
+        for event, element in ET.iterparse(rdf_path, events=('start', 'end')):
+            if event == 'start':
+                path.append(element.tag)
+                if element.tag == PGTERMS + 'ebook':  # Start of a book
+                    about = element.get(RDF + 'about', '')  # e.g. "ebooks/1342"
+                    book = {"id": about.rsplit('/', 1)[-1], "title": None, "authors": [], "languages": []}
+                continue
+            path.pop()
+            if book is not None:
+                parent = path[-1] if path else None
+                if element.tag == DCTERMS + 'title' and parent == PGTERMS + 'ebook' and book["title"] is None:
+                    book["title"] = (element.text or '').strip()  # Title of the book
+                elif element.tag == PGTERMS + 'name' and DCTERMS + 'creator' in path:
+                    book["authors"].append((element.text or '').strip())  # Name of an author
+                elif element.tag == RDF + 'value' and DCTERMS + 'language' in path:
+                    book["languages"].append((element.text or '').strip())  # Language code, e.g. "en"
+                elif element.tag == PGTERMS + 'ebook':  # End of the book
+                    if book["title"]:  # Keep only the books with a title
+                        books.append((book["id"], book["title"], tuple(book["authors"]), tuple(book["languages"])))
+                    book = None
+            if len(path) <= 2:
+                element.clear()  # Free the elements already read
+    except (ET.ParseError, OSError) as e:
+        print(f"Error parsing {rdf_path}: {e}")  # Skip unreadable files, they are parsed again on the next run
+        return None
+    return books
+
+
+def find_rdf_files(directory_path):
+    """
+    Find the RDF files in a directory and its subdirectories with their modification times.
+
+    :param directory_path: The path to the directory containing RDF files.
+
+    :returns: dict: The modification time in nanoseconds of every RDF file, keyed by its path relative to the directory.
+    """
+    rdf_files = {}  # Modification time of every RDF file
+    directories = [directory_path]  # Directories left to scan
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.name.endswith('.rdf'):
+                    rdf_files[os.path.relpath(entry.path, directory_path)] = entry.stat().st_mtime_ns
+    return rdf_files
+
+
+class GutenbergCatalog:
+    """
+    Catalog of the Gutenberg books, with the RDF file and modification time every book was read from.
+    """
+
+    def __init__(self, files=None):
+        """
+        :param files: A dictionary of (modification time, books) tuples keyed by the path of the RDF file, as returned
+                      by parse_rdf_file.
+        """
+        self.files = files or {}  # Modification time and books of every RDF file
+        # Index the books by ID for the lookups
+        self.books = {book[0]: book for _, books in self.files.values() for book in books}
+
+    def __len__(self):
+        return len(self.books)
+
+    def get(self, ebook_id):
+        """
+        Look up a book by its Gutenberg ID.
+
+        :param ebook_id: The Gutenberg ID of the book (str).
+
+        :returns: tuple: The (ID, title, authors, languages) tuple of the book, or None if it is not in the catalog.
+        """
+        return self.books.get(str(ebook_id))
+
+    def titles(self, language=None):
+        """
+        Get the titles of the books of the catalog.
+
+        :param language: If given, only the titles of the books in this language (e.g. "en").
+
+        :returns: set: A set of unique Gutenberg titles.
+        """
+        return {title for _, title, _, languages in self.books.values() if language is None or language in languages}
+
+    def save(self, catalog_file):
+        """
+        Save the catalog to a pickle file, written to a temporary file first so an interrupted save leaves the old
+        catalog intact.
+
+        :param catalog_file: The path to the catalog file.
+        """
+        temporary_file = catalog_file + '.tmp'
+        with open(temporary_file, 'wb') as file:
+            pickle.dump({"version": CATALOG_VERSION, "files": self.files}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, catalog_file)
+
+
+def load_catalog(catalog_file):
+    """
+    Load a saved catalog without checking the RDF files for changes.
+
+    :param catalog_file: The path to the catalog file.
+
+    :returns: GutenbergCatalog: The catalog, empty if the file does not exist or was saved by another version.
+    """
+    if not os.path.exists(catalog_file):
+        return GutenbergCatalog()
+    with open(catalog_file, 'rb') as file:
+        data = pickle.load(file)
+    if data.get("version") != CATALOG_VERSION:
+        return GutenbergCatalog()
+    return GutenbergCatalog(data["files"])
+
+
+def update_catalog(directory_path, catalog_file, num_workers=None):
+    """
+    Load the saved catalog and bring it up to date with the RDF files: the files that are new or whose modification
+    time changed are parsed in parallel, and the books of the deleted files are removed.
+
+    :param directory_path: The path to the directory containing RDF files.
+    :param catalog_file: The path to the catalog file, created if it does not exist.
+    :param num_workers: The number of worker processes, by default one per core.
+
+    :returns: GutenbergCatalog: The up to date catalog.
+    """
+    catalog = load_catalog(catalog_file)
+    rdf_files = find_rdf_files(directory_path)
+    files = {path: entry for path, entry in catalog.files.items() if path in rdf_files}  # Drop the deleted files
+    changed = [path for path, mtime in rdf_files.items() if path not in files or files[path][0] != mtime]
+    if not changed and len(files) == len(catalog.files):
+        return catalog  # Nothing to parse or remove, the saved catalog is up to date
+
+    if changed:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            parsed = executor.map(parse_rdf_file, [os.path.join(directory_path, path) for path in changed],
+                                  chunksize=CHUNK_SIZE)
+            for path, books in tqdm(zip(changed, parsed), total=len(changed), desc="Processing RDF Files"):
+                if books is not None:  # Files that could not be parsed are left out, so the next run retries them
+                    files[path] = (rdf_files[path], books)
+    catalog = GutenbergCatalog(files)
+    catalog.save(catalog_file)
+    return catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the catalog of the Gutenberg RDF files.")
+    parser.add_argument("rdf_directory", help="Directory containing the Gutenberg RDF files")
+    parser.add_argument("catalog_file", help="Path to the catalog file")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    gutenberg_catalog = update_catalog(args.rdf_directory, args.catalog_file, args.workers)
+    print(f"{len(gutenberg_catalog)} books in {len(gutenberg_catalog.files)} RDF files")
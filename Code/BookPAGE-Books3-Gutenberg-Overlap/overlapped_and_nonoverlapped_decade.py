@@ -8,15 +8,8 @@ import json
 import random
 import os
 
-def sanitize_title(title):
-    """
-    Removes any apostrophes in the title of the books
-
-    :param title: Book title.
-
-    :return string: sanitized book title.
-    """
-    return title.replace("'", "")
+from book_manifest import load_manifest, join_content
+from book_store import BookStore
 
 def load_titles(file_path):
     """
@@ -25,17 +18,7 @@ def load_titles(file_path):
     :param file_path: Path to the file containing book titles
     :return: A dictionary with decades as keys and a list of titles as values.
     """
-    with open(file_path, 'r', encoding='utf-8') as file:
-        titles = {}
-        current_decade = None
-        for line in file:
-            if line.strip() and '-' in line.strip():  # Check for decade line
-                current_decade = line.strip()
-                titles[current_decade] = []
-            elif line.strip():
-                sanitized_title = sanitize_title(line.split(" by ")[0].strip())
-                titles[current_decade].append(sanitized_title)
-    return titles
+    return load_manifest(file_path).titles_by_decade(sanitized=True)
 
 def select_titles(titles_by_decade, data_dict):
     """
@@ -56,17 +39,6 @@ def select_titles(titles_by_decade, data_dict):
             selected_titles[decade] = available_titles  # Or handle if not enough titles
     return selected_titles
 
-def load_json_data(json_path):
-    """
-    Loads data from a JSON file, with book titles as keys.
-
-    :param json_path: Path to the JSON file.
-    :return: Dictionary with sanitized titles as keys and their contents as values.
-    """
-    with open(json_path, 'r', encoding='utf-8') as file:
-        data = json.load(file)
-    return {sanitize_title(item['title']): item['content'] for item in data}
-
 def read_json_content(selected_titles, data_dict):
     """
     Extracts content for selected titles from the data dictionary.
@@ -75,11 +47,7 @@ def read_json_content(selected_titles, data_dict):
     :param data_dict: Dictionary with book titles and their content.
     :return: A list of dictionaries with selected book titles and their respective contents.
     """
-    content = []
-    for title in selected_titles:
-        book_content = data_dict.get(title, "Content not found")
-        content.append({"title": title, "content": book_content})
-    return content
+    return join_content(selected_titles, data_dict)
 
 def save_to_json(file_path, data):
     """
@@ -92,14 +60,16 @@ def save_to_json(file_path, data):
     with open(file_path, 'w', encoding='utf-8') as file:
         json.dump(data, file, indent=4, ensure_ascii=False)
 
-def process_books(overlapped_path, non_overlapped_path, base_json_path):
+def process_books(overlapped_path, non_overlapped_path, base_json_path, store_dir=None):
     """
     Processes books to separate overlapped and non-overlapped titles for each decade,
-    saving results to JSON files.
+    saving results to JSON files. The decade datasets are imported into a book store once,
+    so only the texts of the selected books are read.
 
     :param overlapped_path: Path to the file with overlapped titles.
     :param non_overlapped_path: Path to the file with non-overlapped titles.
     :param base_json_path: Base directory to save the JSON results.
+    :param store_dir: Directory of the book store, defaults to a 'book_store' directory in base_json_path.
     :return: A tuple containing two dictionaries, one with file paths of results and another with selected titles.
     """
     decade_to_index = {
@@ -110,12 +80,16 @@ def process_books(overlapped_path, non_overlapped_path, base_json_path):
     overlapped_titles = load_titles(overlapped_path)
     non_overlapped_titles = load_titles(non_overlapped_path)
 
+    store = BookStore(store_dir or os.path.join(base_json_path, 'book_store'))
     results = {}
     final_selected_titles = {}  # Dictionary to store final selected titles
 
     for decade, index in decade_to_index.items():
         json_path = os.path.join(base_json_path, f"dataset{index}_new.json")
-        data_dict = load_json_data(json_path)
+        if not os.path.exists(json_path):  # The JSON Lines bundle written by Dataset_bundle.py is read the same way
+            json_path = os.path.splitext(json_path)[0] + ".jsonl"
+        store.import_json(json_path, f"dataset{index}")  # Only reads the file if it changed since the last import
+        data_dict = store.source(f"dataset{index}")  # Lazy view, the texts are read when the titles are looked up
 
         selected_overlapped = select_titles({decade: overlapped_titles.get(decade, [])}, data_dict)
         selected_non_overlapped = select_titles({decade: non_overlapped_titles.get(decade, [])}, data_dict)
@@ -0,0 +1,228 @@
+"""
+    This file provides an index of book titles for matching BookPAGE titles against the Gutenberg catalog when they
+    are not written exactly the same way. Titles are normalized (case, accents, punctuation, subtitles and leading
+    articles) and looked up exactly first. Titles without a normalized exact match are compared to every indexed
+    title by the Jaccard similarity of their character trigrams, computed with an inverted index of the trigrams and
+    NumPy counting instead of a string comparison per pair of titles. A built index can be saved next to the
+    Gutenberg catalog and is loaded instead of built again as long as the titles it was built from are unchanged.
+"""
+
+import os  # Module for replacing the saved index
+import re  # Module for regular expression matching
+import pickle  # Module for saving the index
+import hashlib  # Module for the fingerprint of the indexed titles
+import unicodedata  # Module for removing accents
+import numpy as np  # Library for counting the shared trigrams of all titles at once
+from collections import defaultdict  # Dictionary with default values for the inverted index
+
+# Articles removed from the start of a title, so "The Cardinal" matches "Cardinal"
+LEADING_ARTICLES = ("the", "a", "an")
+# Characters after which the rest of a title is a subtitle (e.g. "Title: A Novel", "Title; or, Subtitle")
+SUBTITLE_SEPARATORS = re.compile(r"[:;\r\n(\[]| - | -- |—")
+APOSTROPHES = re.compile(r"['’]")  # Apostrophes, removed so "Don't" matches "Dont"
+PUNCTUATION = re.compile(r"[^\w\s]|_")  # Other punctuation, replaced with spaces
+# Minimum trigram Jaccard similarity of an approximate match
+DEFAULT_THRESHOLD = 0.8
+# Version of the index file format and of the normalization, an index saved with another version is built again
+TITLE_INDEX_VERSION = 1
+
+
+def normalize_title(title, keep_subtitle=False):
+    """
+    Normalize a book title so that titles differing only by case, accents, punctuation, subtitle or a leading article
+    are equal.
+
+    :param title: The book title.
+    :param keep_subtitle: If True, the subtitle is kept instead of being removed.
+
+    :returns: str: The normalized title (an empty string if nothing is left).
+    """
+    if not keep_subtitle:
+        main_title = SUBTITLE_SEPARATORS.split(title, maxsplit=1)[0]  # Remove the subtitle
+        title = main_title if main_title.strip() else title  # Keep titles that start with a separator
+    if not title.isascii():  # Most titles have no accents, so skip the character by character pass for them
+        title = unicodedata.normalize('NFKD', title)  # Split the accented characters into letter and accent
+        title = "".join(char for char in title if not unicodedata.combining(char))  # Remove the accents
+    title = title.casefold().replace("&", " and ")  # Ignore case and spell out ampersands
+    title = APOSTROPHES.sub("", title)  # Remove apostrophes
+    words = PUNCTUATION.sub(" ", title).split()  # Replace the other punctuation with spaces and split the words
+    if len(words) > 1 and words[0] in LEADING_ARTICLES:  # Remove a leading article
+        words = words[1:]
+    return " ".join(words)
+
+
+def title_trigrams(normalized_titles):
+    """
+    Get the distinct character trigrams of normalized titles, each padded so the first and last letters count as much
+    as the rest. Every trigram is encoded as one integer made of its three code points, so the trigrams of all the
+    titles are computed with NumPy array operations instead of a Python loop over every character.
+
+    :param normalized_titles: A list of titles normalized with normalize_title, none of them empty.
+
+    :returns: tuple: Two arrays of the same length, the position of the title in the list and the code of every
+                     distinct trigram of every title, sorted by title.
+    """
+    padded = [f"  {title} " for title in normalized_titles]  # Pad the titles so short titles still have trigrams
+    if not padded:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    chars = np.frombuffer("".join(padded).encode('utf-32-le'), dtype='<u4').astype(np.int64)  # Code points
+    lengths = np.array([len(title) for title in padded], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths  # Offset of the first character of every title
+    # Code points fit in 21 bits, so three of them fit in one 64 bit integer
+    codes = (chars[:-2] << 42) | (chars[1:-1] << 21) | chars[2:]
+    titles = np.repeat(np.arange(len(padded), dtype=np.int64), lengths)[:-2]  # Title of the first character
+    # Keep the trigrams that end inside the title they start in
+    valid = np.arange(len(codes)) - starts[titles] <= lengths[titles] - 3
+    titles, codes = titles[valid], codes[valid]
+    # Sort by title and code, then drop the repeated trigrams of a title
+    order = np.lexsort((codes, titles))
+    titles, codes = titles[order], codes[order]
+    distinct = np.ones(len(codes), dtype=bool)
+    distinct[1:] = (titles[1:] != titles[:-1]) | (codes[1:] != codes[:-1])
+    return titles[distinct], codes[distinct]
+
+
+class TitleIndex:
+    """
+    Index of book titles supporting normalized exact lookup and approximate lookup by trigram similarity.
+    """
+
+    def __init__(self, titles):
+        """
+        :param titles: An iterable of book titles to index, e.g. the set of Gutenberg titles.
+        """
+        self.exact = defaultdict(list)  # Original titles of every normalized title
+        for title in titles:
+            normalized = normalize_title(title)
+            if normalized:  # Skip titles with nothing left after normalization
+                self.exact[normalized].append(title)
+        self.keys = list(self.exact)  # Distinct normalized titles, indexed by position
+
+        # Build the inverted index as one array of title positions sorted by trigram, where the posting list of a
+        # trigram is a slice, so the lookups concatenate and count the posting lists without a Python loop
+        positions, codes = title_trigrams(self.keys)
+        self.trigram_counts = np.bincount(positions, minlength=len(self.keys))  # Number of trigrams of every title
+        # Sorted distinct trigram codes; the id of a trigram is its position in this array
+        self.trigram_codes, trigram_ids = np.unique(codes, return_inverse=True)
+        order = np.argsort(trigram_ids, kind='stable')
+        self.posting_positions = positions[order]  # Title positions grouped by trigram
+        self.posting_offsets = np.zeros(len(self.trigram_codes) + 1, dtype=np.int64)  # Start of every posting list
+        np.cumsum(np.bincount(trigram_ids, minlength=len(self.trigram_codes)), out=self.posting_offsets[1:])
+
+    def _postings(self, trigram_id):
+        # Positions of the normalized titles containing a trigram
+        return self.posting_positions[self.posting_offsets[trigram_id]:self.posting_offsets[trigram_id + 1]]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, title):
+        """
+        Look up the indexed titles that are equal to a title once normalized.
+
+        :param title: The book title to look up.
+
+        :returns: list: The original indexed titles matching the title, empty if there is none.
+        """
+        return list(self.exact.get(normalize_title(title), []))
+
+    def match(self, title, threshold=DEFAULT_THRESHOLD, limit=5):
+        """
+        Find the indexed titles most similar to a title. A normalized exact match scores 1.0, the other candidates
+        score the Jaccard similarity of their trigrams with the title.
+
+        :param title: The book title to match.
+        :param threshold: The minimum similarity of a candidate, between 0 and 1.
+        :param limit: The maximum number of candidates returned.
+
+        :returns: list: (indexed title, score) tuples of the best candidates, highest score first.
+        """
+        normalized = normalize_title(title)
+        if not normalized:
+            return []
+        if normalized in self.exact:  # A normalized exact match needs no approximate lookup
+            return [(indexed_title, 1.0) for indexed_title in self.exact[normalized]][:limit]
+
+        _, codes = title_trigrams([normalized])
+        # Find the ids of the trigrams of the title that are in the index
+        trigram_ids = np.searchsorted(self.trigram_codes, codes)
+        found = trigram_ids < len(self.trigram_codes)
+        trigram_ids = trigram_ids[found][self.trigram_codes[trigram_ids[found]] == codes[found]]
+        if not len(trigram_ids):
+            return []
+        # Count the trigrams the indexed titles share with the title in one pass over their posting lists, only for
+        # the titles sharing at least one, instead of scoring every indexed title
+        positions, shared = np.unique(np.concatenate([self._postings(trigram_id) for trigram_id in trigram_ids]),
+                                      return_counts=True)
+        union = self.trigram_counts[positions] + len(codes) - shared
+        scores = shared / union  # Jaccard similarity of the trigram sets
+        candidates = np.flatnonzero(scores >= threshold)
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')][:limit]
+
+        matches = []
+        for candidate in candidates:
+            for indexed_title in self.exact[self.keys[positions[candidate]]]:
+                matches.append((indexed_title, float(scores[candidate])))
+        return matches[:limit]
+
+    def best_match(self, title, threshold=DEFAULT_THRESHOLD):
+        """
+        Find the indexed title most similar to a title.
+
+        :param title: The book title to match.
+        :param threshold: The minimum similarity of the match, between 0 and 1.
+
+        :returns: tuple: The (indexed title, score) of the best match, or None if no title is similar enough.
+        """
+        matches = self.match(title, threshold, limit=1)
+        return matches[0] if matches else None
+
+    def save(self, index_file, fingerprint):
+        """
+        Save the index to a pickle file, written to a temporary file first so an interrupted save leaves the old
+        index intact.
+
+        :param index_file: The path to the index file.
+        :param fingerprint: The fingerprint of the indexed titles, see titles_fingerprint.
+        """
+        temporary_file = index_file + '.tmp'
+        with open(temporary_file, 'wb') as file:
+            pickle.dump({"version": TITLE_INDEX_VERSION, "fingerprint": fingerprint, "index": self}, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, index_file)
+
+
+def titles_fingerprint(titles):
+    """
+    Compute a fingerprint of a set of titles, the same whatever the order of the titles.
+
+    :param titles: An iterable of book titles.
+
+    :returns: str: The hexadecimal SHA-256 digest of the sorted titles.
+    """
+    digest = hashlib.sha256()
+    for title in sorted(titles):
+        digest.update(title.encode('utf-8', 'surrogatepass') + b'\0')
+    return digest.hexdigest()
+
+
+def load_title_index(titles, index_file='gutenberg_title_index.pkl'):
+    """
+    Load the index of a set of titles saved by an earlier run, or build it and save it if the saved index was built
+    from other titles, by another version or not at all.
+
+    :param titles: An iterable of book titles to index, e.g. the set of Gutenberg titles.
+    :param index_file: The path to the index file. Defaults to 'gutenberg_title_index.pkl'.
+
+    :returns: TitleIndex: The index of the titles.
+    """
+    titles = set(titles)
+    fingerprint = titles_fingerprint(titles)
+    if os.path.exists(index_file):
+        with open(index_file, 'rb') as file:
+            data = pickle.load(file)
+        if data.get("version") == TITLE_INDEX_VERSION and data.get("fingerprint") == fingerprint:
+            return data["index"]
+    title_index = TitleIndex(titles)
+    title_index.save(index_file, fingerprint)
+    return title_index
@@ -33,22 +33,39 @@ def convert_to_msg(entry):
     }
 
 
+# Function to lazily read the books of the dataset one at a time
+def iter_books(input_file):
+    """
+    Yields the books of the dataset one at a time. The JSON Lines output of Dataset_bundle.py is streamed line by
+    line, so only one book is in memory at a time; an older single JSON array file is still accepted, but it is
+    loaded in full.
+
+    :param input_file: The path to the dataset, either in JSON Lines (.jsonl) or JSON format.
+
+    :returns generator: A generator of dictionaries containing the 'title' and 'content' of a book.
+    """
+    with open(input_file, 'r', encoding='utf-8') as infile:
+        if not input_file.endswith('.jsonl'):
+            # Legacy format: one JSON array holding every book
+            yield from json.load(infile)
+            return
+        for line in infile:
+            if line.strip():
+                yield json.loads(line)
+
+
 # Function to load a JSON file, convert its entries, and save them in JSONL format
 def convert_dataset_to_jsonl(input_file, output_file):
     """
-    Reads the dataset from a JSON file, converts it into message format, and writes it to a JSONL file.
+    Reads the dataset one book at a time, converts it into message format, and writes it to a JSONL file.
 
-    :param input_file: The path to the input JSON file containing the dataset.
+    :param input_file: The path to the input dataset in JSON Lines (or legacy JSON) format.
     :param output_file: The path to the output JSONL file to save the converted data.
     """
-    # Open the input file and load the dataset from JSON
-    with open(input_file, 'r', encoding='utf-8') as infile:
-        dataset = json.load(infile)  # Read and parse the JSON file
-
     # Open the output file for writing the converted data in JSONL format
     with open(output_file, 'w') as outfile:
-        # Loop through each entry in the dataset
-        for entry in dataset:
+        # Loop through each entry in the dataset, reading it lazily from the input file
+        for entry in iter_books(input_file):
             # Convert the current entry to the message format
             json_line = convert_to_msg(entry)
             # Write the converted entry as a JSON object to the output file
@@ -56,12 +73,13 @@ def convert_dataset_to_jsonl(input_file, output_file):
             outfile.write('\n')  # Write a newline to separate each entry (JSONL format)
 
 
-# Define the input and output file paths
-input_file_path = 'path to input dataset in json'  # Path to the input dataset in JSON format
-output_file_path = 'path to output file'  # Path to save the converted dataset in JSONL format
+if __name__ == "__main__":
+    # Define the input and output file paths
+    input_file_path = 'path to input dataset in jsonl'  # Path to the input dataset written by Dataset_bundle.py
+    output_file_path = 'path to output file'  # Path to save the converted dataset in JSONL format
 
-# Call the function to convert the dataset and write it to the output file
-convert_dataset_to_jsonl(input_file_path, output_file_path)
+    # Call the function to convert the dataset and write it to the output file
+    convert_dataset_to_jsonl(input_file_path, output_file_path)
 
-# Print a success message when the conversion is complete
-print(f"Dataset successfully converted to JSON Lines format. Saved to: {output_file_path}")
+    # Print a success message when the conversion is complete
+    print(f"Dataset successfully converted to JSON Lines format. Saved to: {output_file_path}")
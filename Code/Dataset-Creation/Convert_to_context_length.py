@@ -1,103 +1,216 @@
 # STEP 2: convert the jsonl from the anyscale format to segmented instances.
 
+import re
 import json
+from functools import lru_cache
+
+# A word ending a sentence, optionally followed by closing quotes or brackets
+SENTENCE_END = re.compile(r"[.!?][\"'’”)\]]*$")
+
+
+# Function to build a token counter from any tokenizer's encode function
+def make_token_counter(encode, cache_size=1 << 16):
+    """
+    Builds a function counting the model tokens of a single word, for budgeting chunks in tokens instead of
+    characters. Words repeat a lot in books, so the counts are cached.
+
+    :param encode: A function turning text into a list of token ids, e.g. tiktoken.get_encoding("cl100k_base").encode
+                   or functools.partial(hf_tokenizer.encode, add_special_tokens=False).
+    :param cache_size: The number of distinct words whose token count is cached.
+
+    :returns function: A function mapping a word to its number of tokens, including its leading space.
+    """
+    @lru_cache(maxsize=cache_size)
+    def count_tokens(word):
+        # Most tokenizers merge the leading space into the word, so the space is counted with the word
+        return len(encode(" " + word))
+    return count_tokens
+
+
+# Function to find where a full chunk should be cut so that it ends on a sentence boundary
+def sentence_cut(words):
+    """
+    Finds the last sentence boundary in the second half of a chunk.
+
+    :param words: The words of the chunk.
+
+    :returns int: The number of words to keep in the chunk, or the full length if no boundary is found.
+    """
+    for i in range(len(words) - 1, len(words) // 2 - 1, -1):
+        if SENTENCE_END.search(words[i]):
+            return i + 1
+    return len(words)
+
+
+# Function to lazily split text into chunks of maximum length without skipping words
+def iter_chunks(text, max_length, count_units=len, separator_units=1, overlap=0, snap_to_sentence=False):
+    """
+    Splits a long text into smaller chunks, ensuring that no chunk exceeds the maximum length while keeping the
+    words intact. The length of the chunk being built is kept as a running total, so every word is only measured
+    once and the whole text is chunked in linear time.
+
+    :param text: The full text to be split into chunks.
+    :param max_length: The maximum length of each chunk, in the units returned by count_units.
+    :param count_units: A function giving the length of one word, len (characters) by default or a token counter
+                        from make_token_counter.
+    :param separator_units: The length of the separator between words, 1 for characters and 0 for tokens.
+    :param overlap: The number of words at the end of a chunk to repeat at the start of the next one.
+    :param snap_to_sentence: Whether to end chunks on the last sentence boundary in their second half.
+
+    :returns generator: A generator of text chunks, each chunk within the specified maximum length.
+    """
+    current_chunk = []  # List to accumulate words for the current chunk
+    costs = []  # Length of each word in current_chunk, including its separator
+    running_length = 0  # Length of current_chunk, kept up to date as words are added and removed
+
+    # Loop through each word in the text
+    for word in text.split():
+        cost = count_units(word)
+        # Check if adding the next word exceeds the maximum chunk length
+        if current_chunk and running_length + cost > max_length:
+            cut = sentence_cut(current_chunk) if snap_to_sentence else len(current_chunk)
+            yield " ".join(current_chunk[:cut])
+
+            # Carry the overlap and any words after the sentence boundary into the next chunk, but always move
+            # forward by at least half a chunk
+            start = max(cut - overlap, (cut + 1) // 2)
+            overlap_words = cut - start
+            current_chunk, costs = current_chunk[start:], costs[start:]
+            running_length = sum(costs)
+
+            # If the carried words leave no room for the next word, drop the overlap first, then flush the rest
+            while current_chunk and running_length + cost > max_length:
+                if overlap_words:
+                    running_length -= costs[0]
+                    current_chunk, costs = current_chunk[1:], costs[1:]
+                    overlap_words -= 1
+                else:
+                    yield " ".join(current_chunk)
+                    current_chunk, costs, running_length = [], [], 0
+
+        current_chunk.append(word)  # Add the word to the current chunk
+        costs.append(cost + separator_units)
+        running_length += cost + separator_units
+
+    # If there are any remaining words in current_chunk, add them as the last chunk
+    if current_chunk:
+        yield " ".join(current_chunk)
+
 
 # Function to split text into chunks of maximum length without skipping words
-def split_text_into_chunks(text, max_length):
+def split_text_into_chunks(text, max_length, **chunk_options):
     """
     Splits a long text into smaller chunks, ensuring that no chunk exceeds the
     maximum length while keeping the words intact.
 
     :param text: The full text to be split into chunks.
     :param max_length: The maximum character length of each chunk.
+    :param chunk_options: Optional token budget, overlap and sentence snapping settings, see iter_chunks.
 
     :returns list: A list of text chunks, each chunk within the specified maximum length.
     """
-    words = text.split()  # Split the text into words
-    chunks = []  # List to store text chunks
-    current_chunk = []  # List to accumulate words for the current chunk
+    return list(iter_chunks(text, max_length, **chunk_options))
 
-    # Loop through each word in the text
-    for word in words:
-        # Check if adding the next word exceeds the maximum chunk length
-        if sum(len(word) + 1 for word in current_chunk) + len(word) <= max_length:
-            current_chunk.append(word)  # Add the word to the current chunk
-        else:
-            # If the current chunk exceeds max_length, join the words into a chunk and append it
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [word]  # Start a new chunk with the current word
 
-    # If there are any remaining words in current_chunk, add them as the last chunk
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-
-    return chunks  # Return the list of chunks
-
-# Input and output file paths
-input_file_path = "path to input jsonl file"  # Path to the input JSONL file
-output_file_path = "path to output file"  # Path to the output segmented JSONL file
-
-# Maximum length of each chunk in characters
-max_chunk_length = 500  # Maximum chunk size
-
-# Prepare segmented dataset in JSONL format
-with open(input_file_path, "r", encoding="utf-8") as in_file, open(output_file_path, "w", encoding="utf-8") as out_file:
-    # Loop through each line in the input file
-    for line in in_file:
-        try:
-            # Load JSON object from the current line
-            instance = json.loads(line)
-        except json.JSONDecodeError as e:
-            # If there's an error decoding the JSON, print a message and skip the line
-            print(f"Error decoding JSON on line: {line}")
-            continue
-
-        # Check if the JSON object contains a "messages" field
-        if "messages" in instance:
-            messages = instance["messages"]
-            title = None  # Initialize title to None
-
-            # Extract title from user message content
-            for message in messages:
-                if message["role"] == "user":  # Check if the message role is "user"
-                    content = message["content"]
-                    # Locate the title within the user message by finding the quotes
-                    title_start = content.find("'") + 1
-                    title_end = content.rfind("'")
-                    if title_start != -1 and title_end != -1:
-                        title = content[title_start:title_end]  # Extract the title
-                    break  # Stop searching once the title is found
-
-            if title:
-                # Check if the last message in the messages list is from the assistant
-                if "assistant" in messages[-1]["role"]:
-                    content = messages[-1]["content"]  # Get the content of the assistant message
-
-                    # Split the content into chunks that do not exceed the max_chunk_length
-                    content_chunks = split_text_into_chunks(content, max_chunk_length)
-
-                    # Create new JSONL entries for each chunk with the consistent title
-                    for chunk in content_chunks:
-                        # Recreate the conversation structure for each chunk
-                        system_message = {
-                            "role": "system",
-                            "content": "You are a helpful assistant. Provide an answer to the following question."
-                        }
-                        user_message = {
-                            "role": "user",
-                            "content": f"Write an excerpt of the book '{title}' ."
-                        }
-                        assistant_message = {
-                            "role": "assistant",
-                            "content": chunk
-                        }
-                        # Bundle the messages into the correct format
-                        messages = [system_message, user_message, assistant_message]
-                        json_entry = {"messages": messages}
-                        # Write the new JSONL entry (one line per chunk)
-                        out_file.write(json.dumps(json_entry) + "\n")
-            else:
-                # If the title cannot be found in the user message, print a warning message
-                print("Title not found in user message content.")
-
-print("Segmentation completed. Segmented dataset saved to:", output_file_path)  # Output success message
+# Function to split one Anyscale format instance into one instance per chunk
+def chunk_instance(instance, max_length, **chunk_options):
+    """
+    Splits the assistant message of an instance into chunks and recreates the conversation for each chunk.
+
+    :param instance: A dictionary with a "messages" list in the system, user, and assistant format.
+    :param max_length: The maximum length of each chunk.
+    :param chunk_options: Optional token budget, overlap and sentence snapping settings, see iter_chunks.
+
+    :returns generator: A generator of instances, one per chunk of the assistant message.
+    """
+    # Check if the JSON object contains a "messages" field
+    if "messages" not in instance:
+        return
+    messages = instance["messages"]
+    title = None  # Initialize title to None
+
+    # Extract title from user message content
+    for message in messages:
+        if message["role"] == "user":  # Check if the message role is "user"
+            content = message["content"]
+            # Locate the title within the user message by finding the quotes
+            title_start = content.find("'") + 1
+            title_end = content.rfind("'")
+            if title_start != -1 and title_end != -1:
+                title = content[title_start:title_end]  # Extract the title
+            break  # Stop searching once the title is found
+
+    if not title:
+        # If the title cannot be found in the user message, print a warning message
+        print("Title not found in user message content.")
+        return
+
+    # Check if the last message in the messages list is from the assistant
+    if "assistant" not in messages[-1]["role"]:
+        return
+    content = messages[-1]["content"]  # Get the content of the assistant message
+
+    # Create new entries for each chunk with the consistent title
+    for chunk in iter_chunks(content, max_length, **chunk_options):
+        # Recreate the conversation structure for each chunk
+        system_message = {
+            "role": "system",
+            "content": "You are a helpful assistant. Provide an answer to the following question."
+        }
+        user_message = {
+            "role": "user",
+            "content": f"Write an excerpt of the book '{title}' ."
+        }
+        assistant_message = {
+            "role": "assistant",
+            "content": chunk
+        }
+        # Bundle the messages into the correct format
+        yield {"messages": [system_message, user_message, assistant_message]}
+
+
+# Function to stream a JSONL file through the chunker
+def segment_jsonl(input_file, output_file, max_length, **chunk_options):
+    """
+    Reads the Anyscale format dataset one line at a time and writes one line per chunk, so only one book is in
+    memory at a time.
+
+    :param input_file: Path to the input JSONL file.
+    :param output_file: Path to the output segmented JSONL file.
+    :param max_length: The maximum length of each chunk.
+    :param chunk_options: Optional token budget, overlap and sentence snapping settings, see iter_chunks.
+
+    :returns int: The number of chunks written.
+    """
+    chunks_written = 0
+    with open(input_file, "r", encoding="utf-8") as in_file, open(output_file, "w", encoding="utf-8") as out_file:
+        # Loop through each line in the input file
+        for line in in_file:
+            try:
+                # Load JSON object from the current line
+                instance = json.loads(line)
+            except json.JSONDecodeError:
+                # If there's an error decoding the JSON, print a message and skip the line
+                print(f"Error decoding JSON on line: {line}")
+                continue
+
+            for json_entry in chunk_instance(instance, max_length, **chunk_options):
+                # Write the new JSONL entry (one line per chunk)
+                out_file.write(json.dumps(json_entry) + "\n")
+                chunks_written += 1
+    return chunks_written
+
+
+if __name__ == "__main__":
+    # Input and output file paths
+    input_file_path = "path to input jsonl file"  # Path to the input JSONL file
+    output_file_path = "path to output file"  # Path to the output segmented JSONL file
+
+    # Maximum length of each chunk in characters
+    max_chunk_length = 500  # Maximum chunk size
+
+    # To budget in model tokens instead, pass count_units=make_token_counter(encode) and separator_units=0.
+    # overlap=<words> repeats words between chunks and snap_to_sentence=True ends chunks on sentence boundaries.
+    segment_jsonl(input_file_path, output_file_path, max_chunk_length)
+
+    print("Segmentation completed. Segmented dataset saved to:", output_file_path)  # Output success message
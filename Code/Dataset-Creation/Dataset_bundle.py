@@ -1,65 +1,225 @@
 """
-This file is used to concatenate all the pdf files into a dataset of json format. Run this before converting
-your files to the required formats.
+This file is used to concatenate all the pdf files into a dataset of JSON Lines format, with one book per line.
+Run this before converting your files to the required formats.
+
+The PDFs are extracted in parallel over a process pool. Every extracted book is checkpointed to a cache directory
+together with a manifest entry (path, size, mtime, hash), so a rerun only re-extracts PDFs that are new or changed.
+The pages of a book are separated by a form feed, so the page boundaries survive in the dataset (dedup.py strips the
+running headers and footers found there).
 """
 
 import os
 import json
+import hashlib
 import pdfplumber
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Separator of the pages of a book; it is whitespace, so the chunkers split words on it like on a newline
+PAGE_BREAK = '\f'
+# Version of the extracted text format, checkpoints written by another version are extracted again
+EXTRACTION_VERSION = 2
 
 
-# Function which goes through the entire content in the pdf files and adds it to a string and returns that string. 
+# Function which goes through the entire content in the pdf files and adds it to a string and returns that string.
 def text_from_pdf(path):
     """
     Extracts the text from all pages of a given PDF file.
 
     :param path: The file path to the PDF file.
 
-    :returns str: A string containing all the text extracted from the PDF.
+    :returns str: A string containing all the text extracted from the PDF, with a PAGE_BREAK between the pages.
     """
     with pdfplumber.open(path) as pdf:
-        string = ''
-        for page in pdf.pages:
-            string += page.extract_text()
-    return string
-
-
-# The directory of the pdf files
-pdf_directory = 'path to the folder with the pdf files'
-
-# final dataset that is of text format
-dataset = []
-
-# finding the number of files for output purposes
-num_files = len(os.listdir(pdf_directory))
-files_done = 0
-print("Total number of files is ",num_files)
-# looping through all the files in the directory and concatenating the text into the dataset in the form of "title" and "content"
-for file in os.listdir(pdf_directory):
-    # For output purposes
-    files_done += 1
-    print("Processing file "+str(files_done))
-
-    # Getting the path of the file
-    path = os.path.join(pdf_directory, file)
-    try:
-        # using the function to retrieve the text in one pdf
-        string = text_from_pdf(path)
-    except Exception as e:
-        print("Error processing file ",files_done)
-        continue
-
-    # Extracting the title of the book from the file name
-    title = os.path.splitext(file)[0]
-
-    # adding the book with its title to the final dataset
-    dataset.append({"title": title, "content": string})
-
-# Converting the dataset to json format and saving it
-# This source was used https://www.geeksforgeeks.org/convert-python-list-to-json/
-output_json_file = 'file path'
-with open(output_json_file, 'w') as json_file:
-    json.dump(dataset, json_file, indent=4)
-
-# for output purposes
-print("Dataset saved")
+        # Collect the page texts in a list and join them once, instead of growing a string page by page
+        pages = [page.extract_text() or '' for page in pdf.pages]
+    # Keep the page boundaries, which also keeps the last word of a page apart from the first word of the next
+    return PAGE_BREAK.join(pages)
+
+
+# Function to compute the content hash of a file without reading it into memory in one go
+def file_hash(path, block_size=1 << 20):
+    """
+    Computes the SHA-256 hash of a file, reading it in blocks.
+
+    :param path: The file path to hash.
+    :param block_size: Number of bytes read at a time.
+
+    :returns str: The hexadecimal SHA-256 digest of the file.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+# Function to load the checkpoint manifest of already extracted PDFs
+def load_manifest(manifest_path):
+    """
+    Loads the checkpoint manifest, which maps each PDF file name to its path, size, mtime, hash and cached text file.
+
+    :param manifest_path: Path to the manifest JSON file.
+
+    :returns dict: The manifest, or an empty dictionary if no manifest exists yet.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+# Function to save the checkpoint manifest
+def save_manifest(manifest, manifest_path):
+    """
+    Saves the checkpoint manifest atomically, so a crash while saving never leaves a broken manifest behind.
+
+    :param manifest: The manifest dictionary to save.
+    :param manifest_path: Path to the manifest JSON file.
+    """
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(temp_path, manifest_path)
+
+
+# Function to decide whether a PDF needs to be (re-)extracted
+def needs_extraction(path, entry, checkpoint_dir):
+    """
+    Checks a PDF against its manifest entry. Size and mtime are compared first; the hash is only computed when they
+    differ, so touching a file without changing it does not trigger a new extraction.
+
+    :param path: The file path to the PDF file.
+    :param entry: The manifest entry of the file, or None if the file has not been extracted before.
+    :param checkpoint_dir: Directory holding the cached text of every extracted PDF.
+
+    :returns bool: True if the PDF is new or changed, False if its cached text can be reused.
+    """
+    if entry is None or not os.path.exists(os.path.join(checkpoint_dir, entry['text_file'])):
+        return True
+    if entry.get('version') != EXTRACTION_VERSION:  # Extracted in an older text format
+        return True
+    stat = os.stat(path)
+    if stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']:
+        return False
+    if stat.st_size != entry['size']:
+        return True
+    # Same size but a different mtime, so only the content hash can tell whether the file changed
+    if file_hash(path) != entry['hash']:
+        return True
+    entry['mtime'] = stat.st_mtime
+    return False
+
+
+# Function run by every worker process: extract one PDF and checkpoint its text
+def extract_to_checkpoint(path, checkpoint_dir):
+    """
+    Extracts the text of a PDF and writes it to the checkpoint directory under the hash of the PDF.
+
+    :param path: The file path to the PDF file.
+    :param checkpoint_dir: Directory where the extracted text is cached.
+
+    :returns dict: The manifest entry for the PDF (path, size, mtime, hash, the cached text file and the version).
+    """
+    stat = os.stat(path)
+    digest = file_hash(path)
+    text_file = digest + '.txt'
+    text = text_from_pdf(path)
+    # Write to a temporary file first so an interrupted worker never leaves a half written checkpoint
+    temp_path = os.path.join(checkpoint_dir, text_file + '.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temp_path, os.path.join(checkpoint_dir, text_file))
+    return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime, "hash": digest, "text_file": text_file,
+            "version": EXTRACTION_VERSION}
+
+
+# Function to extract every PDF in a directory in parallel, skipping the ones already checkpointed
+def ingest_pdfs(pdf_directory, checkpoint_dir, num_workers=None):
+    """
+    Extracts the text of all PDFs in a directory over a process pool. Only PDFs that are new or changed since the
+    last run are extracted; the manifest is saved after every finished book so a crash loses at most the books in
+    flight.
+
+    :param pdf_directory: The directory of the pdf files.
+    :param checkpoint_dir: Directory for the cached texts and the manifest.
+    :param num_workers: Number of worker processes, defaults to the number of CPU cores.
+
+    :returns dict: The manifest, mapping each PDF file name to its entry.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    manifest_path = os.path.join(checkpoint_dir, 'manifest.json')
+    manifest = load_manifest(manifest_path)
+
+    files = sorted(os.listdir(pdf_directory))
+    # Forget the books that were removed from the directory since the last run
+    for file in set(manifest) - set(files):
+        del manifest[file]
+
+    pending = [file for file in files
+               if needs_extraction(os.path.join(pdf_directory, file), manifest.get(file), checkpoint_dir)]
+    print("Total number of files is ", len(files))
+    print("Files to extract: ", len(pending), ", reused from checkpoint: ", len(files) - len(pending))
+    save_manifest(manifest, manifest_path)
+
+    files_done = 0
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(extract_to_checkpoint, os.path.join(pdf_directory, file), checkpoint_dir): file
+                   for file in pending}
+        for future in as_completed(futures):
+            file = futures[future]
+            # For output purposes
+            files_done += 1
+            try:
+                manifest[file] = future.result()
+            except Exception as e:
+                print("Error processing file ", file, ": ", e)
+                # Drop any stale entry so the book is not written with the text of an older version
+                manifest.pop(file, None)
+                continue
+            print("Processed file " + str(files_done) + " of " + str(len(pending)) + ": " + file)
+            save_manifest(manifest, manifest_path)
+
+    return manifest
+
+
+# Function to write the extracted books to a JSONL file, one book per line
+def write_dataset_jsonl(manifest, checkpoint_dir, output_file):
+    """
+    Streams the checkpointed books into a JSON Lines file with one {"title", "content"} record per line. Only one
+    book is held in memory at a time, no matter how large the corpus is.
+
+    :param manifest: The manifest returned by ingest_pdfs.
+    :param checkpoint_dir: Directory holding the cached text of every extracted PDF.
+    :param output_file: Path to the output JSONL file.
+
+    :returns int: The number of books written.
+    """
+    books_written = 0
+    with open(output_file, 'w', encoding='utf-8') as outfile:
+        # Write the books in the order of the files in the directory
+        for file in sorted(manifest):
+            with open(os.path.join(checkpoint_dir, manifest[file]['text_file']), 'r', encoding='utf-8') as text_file:
+                string = text_file.read()
+
+            # Extracting the title of the book from the file name
+            title = os.path.splitext(file)[0]
+
+            # adding the book with its title to the dataset as one JSON line
+            outfile.write(json.dumps({"title": title, "content": string}) + '\n')
+            books_written += 1
+    return books_written
+
+
+if __name__ == "__main__":
+    # The directory of the pdf files
+    pdf_directory = 'path to the folder with the pdf files'
+    # The directory where extracted texts and the manifest are checkpointed
+    checkpoint_dir = 'path to the checkpoint folder'
+    # The dataset is saved in JSON Lines format, one book per line
+    output_jsonl_file = 'file path'
+
+    manifest = ingest_pdfs(pdf_directory, checkpoint_dir)
+    num_books = write_dataset_jsonl(manifest, checkpoint_dir, output_jsonl_file)
+
+    # for output purposes
+    print("Dataset saved with", num_books, "books")
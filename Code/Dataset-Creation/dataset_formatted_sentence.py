@@ -65,30 +65,31 @@ def process_dataset(dataset):
     return dataset
 
 
-# Input and output file paths
-input_file = 'path to input jsonl file'  # Path to the input JSON Lines file
-output_file = 'path to output file'  # Path to the output JSON Lines file
-
-# Read input dataset from JSON Lines file
-try:
-    with jsonlines.open(input_file, 'r') as reader:
-        dataset = list(reader)  # Read all entries from the JSON Lines file
-except FileNotFoundError:
-    # Handle the case when the input file is not found
-    print(f"Error: Input file '{input_file}' not found.")
-    exit(1)
-
-# Process each entry in the dataset
-modified_datasets = []
-for data in dataset:
-    modified_data = process_dataset(data)  # Modify the dataset entry
-    modified_datasets.append(modified_data)  # Append the modified dataset to the list
-
-# Write modified datasets to the output JSON Lines file
-try:
-    with jsonlines.open(output_file, 'w') as writer:
-        writer.write_all(modified_datasets)  # Write all modified datasets to the output file
-    print(f"Modified dataset saved to '{output_file}' in JSON Lines format.")  # Success message
-except Exception as e:
-    # Handle any errors that occur while saving the file
-    print(f"Error occurred while saving the modified dataset: {e}")
+if __name__ == "__main__":
+    # Input and output file paths
+    input_file = 'path to input jsonl file'  # Path to the input JSON Lines file
+    output_file = 'path to output file'  # Path to the output JSON Lines file
+
+    # Read input dataset from JSON Lines file
+    try:
+        with jsonlines.open(input_file, 'r') as reader:
+            dataset = list(reader)  # Read all entries from the JSON Lines file
+    except FileNotFoundError:
+        # Handle the case when the input file is not found
+        print(f"Error: Input file '{input_file}' not found.")
+        exit(1)
+
+    # Process each entry in the dataset
+    modified_datasets = []
+    for data in dataset:
+        modified_data = process_dataset(data)  # Modify the dataset entry
+        modified_datasets.append(modified_data)  # Append the modified dataset to the list
+
+    # Write modified datasets to the output JSON Lines file
+    try:
+        with jsonlines.open(output_file, 'w') as writer:
+            writer.write_all(modified_datasets)  # Write all modified datasets to the output file
+        print(f"Modified dataset saved to '{output_file}' in JSON Lines format.")  # Success message
+    except Exception as e:
+        # Handle any errors that occur while saving the file
+        print(f"Error occurred while saving the modified dataset: {e}")
@@ -0,0 +1,196 @@
+"""
+Runs the whole dataset preparation in a single pass over the book bundle written by Dataset_bundle.py.
+
+The transforms of Convert_anyscaleformat.py (STEP 1), Convert_to_context_length.py (STEP 2),
+dataset_formatted_sentence.py (STEP 3) and gemini_dataset.py are chained as streaming stages, so every book is
+parsed once and every resulting instance is serialized once per output. The Anyscale and Gemini datasets are
+written side by side in the same pass. With --dedup, the repeated headers, footers and page numbers are stripped
+from the books and the near-duplicate books and chunks are dropped (see dedup.py).
+
+Example:
+    python dataset_pipeline.py books.jsonl --anyscale-output anyscale.jsonl --gemini-output gemini.jsonl
+    python dataset_pipeline.py books.jsonl --anyscale-output anyscale.jsonl --dedup
+"""
+
+import json
+import argparse
+
+from Convert_anyscaleformat import iter_books, convert_to_msg
+from Convert_to_context_length import chunk_instance
+from dataset_formatted_sentence import process_dataset
+from gemini_dataset import remap_roles
+from dedup import BoilerplateStripper, dedup_books, dedup_chunks
+
+
+# Stage removing the boilerplate lines (headers, footers, page numbers) from the books
+def strip_boilerplate_stage(stripper):
+    """
+    Builds a stage removing the boilerplate lines from the content of every book.
+
+    :param stripper: A BoilerplateStripper fitted on the books of the bundle.
+
+    :returns function: The stage, mapping an iterable of books to a generator of stripped books.
+    """
+    def stage(records):
+        for entry in records:
+            yield {**entry, 'content': stripper.strip(entry['content'])}
+    return stage
+
+
+# Stage dropping the near-duplicate books
+def dedup_books_stage(threshold):
+    """
+    Builds a stage dropping the books that are near-duplicates of an earlier book.
+
+    :param threshold: The minimum estimated Jaccard similarity of two near-duplicate books.
+
+    :returns function: The stage, mapping an iterable of books to a generator of the books kept.
+    """
+    def stage(records):
+        return dedup_books(records, threshold)
+    return stage
+
+
+# Stage dropping the near-duplicate chunks
+def dedup_chunks_stage(max_distance, threshold):
+    """
+    Builds a stage dropping the chunks whose assistant message is a near-duplicate of an earlier chunk.
+
+    :param max_distance: The maximum number of differing SimHash bits of two near-duplicate chunks.
+    :param threshold: The minimum Jaccard similarity of the shingles of two near-duplicate chunks.
+
+    :returns function: The stage, mapping an iterable of instances to a generator of the instances kept.
+    """
+    def stage(records):
+        return dedup_chunks(records, lambda instance: instance['messages'][-1]['content'], max_distance,
+                            threshold)
+    return stage
+
+
+# Stage for STEP 1: books in the 'title' and 'content' format to the system, user, and assistant format
+def format_messages_stage(records):
+    """
+    Converts every book into the 'system', 'user', and 'assistant' format.
+
+    :param records: An iterable of dictionaries containing the 'title' and 'content' of a book.
+
+    :returns generator: A generator of instances in the message format.
+    """
+    for entry in records:
+        yield convert_to_msg(entry)
+
+
+# Stage for STEP 2: one instance per chunk of the book
+def chunk_stage(max_length, **chunk_options):
+    """
+    Builds a stage splitting every instance into chunks of at most max_length.
+
+    :param max_length: The maximum length of each chunk.
+    :param chunk_options: Optional token budget, overlap and sentence snapping settings, see
+                          Convert_to_context_length.iter_chunks.
+
+    :returns function: The stage, mapping an iterable of instances to a generator of chunked instances.
+    """
+    def stage(records):
+        for instance in records:
+            yield from chunk_instance(instance, max_length, **chunk_options)
+    return stage
+
+
+# Stage for STEP 3: the sentence completion format
+def sentence_prefix_stage(records):
+    """
+    Moves the first words of every assistant message into a "Complete the sentence" user prompt.
+
+    :param records: An iterable of instances in the message format.
+
+    :returns generator: A generator of instances in the sentence completion format.
+    """
+    for instance in records:
+        yield process_dataset(instance)
+
+
+# Function to chain the stages into one streaming pipeline
+def build_pipeline(stages):
+    """
+    Composes the stages so that records flow through all of them one at a time.
+
+    :param stages: A list of stages, each mapping an iterable of records to an iterable of records.
+
+    :returns function: The pipeline, mapping the input records to the output records.
+    """
+    def pipeline(records):
+        for stage in stages:
+            records = stage(records)
+        return records
+    return pipeline
+
+
+# Function to run the pipeline and write every output in the same pass
+def run_pipeline(input_file, pipeline, outputs):
+    """
+    Reads the book bundle lazily, runs it through the pipeline and writes every resulting instance to each output.
+
+    :param input_file: The path to the book bundle written by Dataset_bundle.py.
+    :param pipeline: The pipeline returned by build_pipeline.
+    :param outputs: A dictionary mapping each output file path to a function converting an instance to the format
+                    of that output.
+
+    :returns int: The number of instances written to each output.
+    """
+    files = {path: open(path, 'w', encoding='utf-8') for path in outputs}
+    instances_written = 0
+    try:
+        for instance in pipeline(iter_books(input_file)):
+            for path, convert in outputs.items():
+                files[path].write(json.dumps(convert(instance)) + '\n')
+            instances_written += 1
+    finally:
+        for file in files.values():
+            file.close()
+    return instances_written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare the fine-tuning datasets in a single pass.")
+    parser.add_argument("input_file", help="Book bundle written by Dataset_bundle.py")
+    parser.add_argument("--anyscale-output", help="Path of the dataset in the Anyscale format")
+    parser.add_argument("--gemini-output", help="Path of the dataset in the Gemini format")
+    parser.add_argument("--max-length", type=int, default=500, help="Maximum chunk length in characters")
+    parser.add_argument("--overlap", type=int, default=0, help="Number of words repeated between chunks")
+    parser.add_argument("--snap-to-sentence", action="store_true", help="End chunks on sentence boundaries")
+    parser.add_argument("--no-sentence-format", action="store_true",
+                        help="Keep the excerpt format instead of the sentence completion format (STEP 3)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Strip boilerplate lines and drop near-duplicate books and chunks")
+    parser.add_argument("--book-threshold", type=float, default=0.8,
+                        help="Minimum shingle similarity of two near-duplicate books")
+    parser.add_argument("--chunk-max-distance", type=int, default=3,
+                        help="Maximum number of differing SimHash bits of two near-duplicate chunks")
+    parser.add_argument("--chunk-threshold", type=float, default=0.8,
+                        help="Minimum estimated shingle similarity of two near-duplicate chunks")
+    args = parser.parse_args()
+
+    # The output formats to write, each with the conversion applied to an instance before writing it
+    outputs = {}
+    if args.anyscale_output:
+        outputs[args.anyscale_output] = lambda instance: instance
+    if args.gemini_output:
+        outputs[args.gemini_output] = remap_roles
+    if not outputs:
+        parser.error("at least one of --anyscale-output and --gemini-output is required")
+
+    stages = []
+    if args.dedup:
+        # The boilerplate lines are the ones repeated across the corpus, so count them in a first pass over the bundle
+        stripper = BoilerplateStripper().fit(iter_books(args.input_file))
+        stages += [strip_boilerplate_stage(stripper), dedup_books_stage(args.book_threshold)]
+    stages += [format_messages_stage,
+               chunk_stage(args.max_length, overlap=args.overlap, snap_to_sentence=args.snap_to_sentence)]
+    if args.dedup:
+        stages.append(dedup_chunks_stage(args.chunk_max_distance, args.chunk_threshold))
+    if not args.no_sentence_format:
+        stages.append(sentence_prefix_stage)
+
+    num_instances = run_pipeline(args.input_file, build_pipeline(stages), outputs)
+    print(f"Wrote {num_instances} instances to: {', '.join(outputs)}")
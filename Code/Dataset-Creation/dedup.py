@@ -0,0 +1,512 @@
+"""
+Removes boilerplate and near-duplicate text from the book bundle written by Dataset_bundle.py, before it is turned into
+fine-tuning instances by dataset_pipeline.py. Three filters run in linear time over the corpus:
+
+- Boilerplate lines: the pages of a book are separated by form feeds (see Dataset_bundle.py), and only the first and
+  last lines of a page are considered as page numbers and running headers or footers. A page edge line is a header
+  or footer when it repeats (with its page number ignored) on a share of the pages of the book. Copyright lines and
+  publisher lines found in many different books are only removed from the front and back matter.
+- Near-duplicate books (the same book scanned twice under different file names): every book gets a MinHash signature
+  of its word shingles, and LSH banding only compares books that share a band, so the corpus is never compared pair
+  by pair. A book whose estimated Jaccard similarity with an earlier book reaches the threshold is dropped.
+- Near-duplicate chunks: every chunk gets a 64 bit SimHash of its word shingles, split into bands so that two
+  fingerprints within the maximum Hamming distance always share a band. A chunk close to an earlier chunk is only
+  dropped once the Jaccard similarity of their shingles confirms it, as unrelated chunks can get close fingerprints.
+  The similarity is estimated from a short MinHash signature kept for every chunk, not from the shingles themselves.
+
+Example:
+    python dedup.py books.jsonl deduplicated_books.jsonl
+"""
+
+import re
+import json
+import math
+import zlib
+import argparse
+import numpy as np
+from collections import Counter
+
+from Dataset_bundle import PAGE_BREAK
+from Convert_anyscaleformat import iter_books
+
+# Lines that are only a page number, e.g. "12", "- 12 -" or "Page 12"
+PAGE_NUMBER = re.compile(r"^\W*(page\s*)?\d+\W*$", re.IGNORECASE)
+# Lines that are only a roman numeral, e.g. "xiv". They are page numbers of the front matter as often as chapter
+# headings ("IV"), so they are only stripped when the pages around them are numbered in sequence
+ROMAN_NUMERAL = re.compile(r"^\W*(page\s*)?([mdclxvi]+)\W*$", re.IGNORECASE)
+ROMAN_DIGITS = [(1000, "m"), (900, "cm"), (500, "d"), (400, "cd"), (100, "c"), (90, "xc"), (50, "l"), (40, "xl"),
+                (10, "x"), (9, "ix"), (5, "v"), (4, "iv"), (1, "i")]
+# Number of pages between two roman page numbers of a sequence, so a blank page without a number is skipped
+ROMAN_PAGE_GAP = 2
+# Lines of copyright pages
+COPYRIGHT_LINE = re.compile(r"copyright|©|all rights reserved|\bisbn\b|library of congress"
+                            r"|printed in the united states|no part of this (book|publication) may be", re.IGNORECASE)
+# Digits, ignored when comparing lines so that running headers with different page numbers are the same line
+DIGITS = re.compile(r"\d+")
+# Headings that open a chapter or a part (e.g. "Chapter 12", "PART II"); they differ only by their number, so they are
+# never taken for headers or publisher lines
+SECTION_HEADING = re.compile(r"^\W*(chapter|part|book|section|volume|act|scene)\W+(\d+|[ivxlc]+|[a-z]+)\W*$",
+                             re.IGNORECASE)
+
+# Number of hash functions of the MinHash signatures, and the number of LSH bands they are split into
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 16
+# Number of hash functions of the signatures confirming near-duplicate chunks, 128 bytes per chunk kept
+CHUNK_PERMUTATIONS = 32
+# Number of words of the shingles hashed by MinHash
+SHINGLE_SIZE = 5
+# Number of shingles hashed at a time, so the (permutations x shingles) array stays small
+SHINGLE_BATCH_SIZE = 8192
+# Modulus of the MinHash permutations, the Mersenne prime 2^31 - 1
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+# Function to normalize a line for counting its repetitions
+def line_key(line):
+    """
+    :param line: A line of a book.
+
+    :returns str: The line in lower case, with its digits replaced and its whitespace collapsed.
+    """
+    return " ".join(DIGITS.sub("#", line.casefold()).split())
+
+
+# Function to read the value of a roman numeral
+def roman_value(numeral):
+    """
+    :param numeral: A roman numeral, in any case.
+
+    :returns int: The value of the numeral, or None if it is not written the standard way (e.g. "iiv" or "mid").
+    """
+    numeral = numeral.casefold()
+    value, rest = 0, numeral
+    for digit_value, digits in ROMAN_DIGITS:
+        while rest.startswith(digits):
+            value += digit_value
+            rest = rest[len(digits):]
+    # Writing the value back out tells the standard numerals apart from the other strings of roman letters
+    written = ""
+    remainder = value
+    for digit_value, digits in ROMAN_DIGITS:
+        count, remainder = divmod(remainder, digit_value)
+        written += digits * count
+    return value if not rest and written == numeral else None
+
+
+# Function to hash a line for counting the books it appears in
+def line_hash(key):
+    """
+    :param key: The key of the line returned by line_key.
+
+    :returns int: The CRC32 of the key.
+    """
+    return zlib.crc32(key.encode('utf-8'))
+
+
+class BoilerplateStripper:
+    """
+    Removes page numbers, running headers and footers, copyright lines and publisher lines from book texts, whose
+    pages are separated by PAGE_BREAK. The body of a page is never stripped: only its edge lines, and the lines of the
+    front and back matter.
+    """
+
+    def __init__(self, min_repeats=3, min_page_fraction=0.2, min_books=5, edge_lines=2, matter_pages=3,
+                 matter_lines=100, max_line_length=100):
+        """
+        :param min_repeats: The minimum number of pages a header or footer is repeated on.
+        :param min_page_fraction: The minimum share of the pages of the book a header or footer is repeated on, so
+                                  the threshold grows with the length of the book.
+        :param min_books: A front or back matter line of at least two words found in at least this many books is
+                          boilerplate (e.g. a publisher line), once fit has counted them.
+        :param edge_lines: The number of non-empty lines at the top and at the bottom of a page that can be page
+                           numbers, headers or footers.
+        :param matter_pages: The number of pages at the start and at the end of a book that are front and back
+                             matter.
+        :param matter_lines: The number of lines at the start and at the end of a book without page breaks that are
+                             front and back matter.
+        :param max_line_length: Longer lines are never treated as headers, footers or publisher lines.
+        """
+        self.min_repeats = min_repeats
+        self.min_page_fraction = min_page_fraction
+        self.min_books = min_books
+        self.edge_lines = edge_lines
+        self.matter_pages = matter_pages
+        self.matter_lines = matter_lines
+        self.max_line_length = max_line_length
+        self.corpus_lines = set()  # Hashes of the front and back matter lines found in at least min_books books
+
+    def _edges(self, lines):
+        # Positions of the first and last edge_lines non-empty lines of a page
+        filled = [position for position, line in enumerate(lines) if line.strip()]
+        return set(filled[:self.edge_lines] + filled[-self.edge_lines:])
+
+    def _roman_page_numbers(self, pages):
+        # Positions (page number, line position) of the roman numerals that are page numbers: a numeral at the top or
+        # at the bottom of a page is one when a nearby page has the numeral following on from it at the same edge
+        numerals = {}
+        for number, lines in enumerate(pages):
+            filled = [position for position, line in enumerate(lines) if line.strip()]
+            for edge, positions in (("top", filled[:self.edge_lines]), ("bottom", filled[-self.edge_lines:])):
+                for position in positions:
+                    match = ROMAN_NUMERAL.match(lines[position].strip())
+                    value = roman_value(match.group(2)) if match else None
+                    if value is not None:
+                        numerals.setdefault((number, edge), []).append((value, position))
+        page_numbers = set()
+        for (number, edge), entries in numerals.items():
+            for value, position in entries:
+                if any(other_value == value + offset
+                       for offset in range(-ROMAN_PAGE_GAP, ROMAN_PAGE_GAP + 1) if offset
+                       for other_value, _ in numerals.get((number + offset, edge), ())):
+                    page_numbers.add((number, position))
+        return page_numbers
+
+    def _matter(self, pages):
+        # Positions of the front and back matter lines of every page
+        if len(pages) == 1:  # No page breaks, so the matter is counted in lines
+            count = len(pages[0])
+            return [set(range(min(self.matter_lines, count))) | set(range(max(count - self.matter_lines, 0), count))]
+        return [set(range(len(lines))) if number < self.matter_pages or number >= len(pages) - self.matter_pages
+                else set() for number, lines in enumerate(pages)]
+
+    def _corpus_keys(self, pages, matter):
+        # The keys of the front and back matter lines that could be publisher lines
+        keys = set()
+        for lines, positions in zip(pages, matter):
+            for position in positions:
+                stripped = lines[position].strip()
+                if (len(stripped) <= self.max_line_length and len(stripped.split()) >= 2
+                        and not SECTION_HEADING.match(stripped)):
+                    keys.add(line_key(stripped))
+        return keys
+
+    def fit(self, books):
+        """
+        Counts in how many books every front and back matter line appears, to strip the lines shared by many books.
+        Only a hash of every line is kept, so the memory used does not grow with the length of the lines.
+
+        :param books: An iterable of dictionaries containing the 'title' and 'content' of a book.
+
+        :returns BoilerplateStripper: The stripper itself.
+        """
+        book_counts = Counter()
+        for book in books:
+            pages = [page.split('\n') for page in book['content'].split(PAGE_BREAK)]
+            book_counts.update(line_hash(key) for key in self._corpus_keys(pages, self._matter(pages)))
+        self.corpus_lines = {key_hash for key_hash, count in book_counts.items() if count >= self.min_books}
+        return self
+
+    def strip(self, text):
+        """
+        Removes the boilerplate lines of a book.
+
+        :param text: The text of the book, with its pages separated by PAGE_BREAK.
+
+        :returns str: The text without its boilerplate lines, with its pages still separated by PAGE_BREAK.
+        """
+        pages = [page.split('\n') for page in text.split(PAGE_BREAK)]
+        edges = [self._edges(lines) for lines in pages]
+        matter = self._matter(pages)
+        roman_page_numbers = self._roman_page_numbers(pages)
+
+        # Count on how many pages every edge line appears, so a header repeated on a page counts once
+        repeats = Counter()
+        for lines, positions in zip(pages, edges):
+            repeats.update({line_key(lines[position].strip()) for position in positions
+                            if len(lines[position].strip()) <= self.max_line_length})
+        min_repeats = max(self.min_repeats, math.ceil(self.min_page_fraction * len(pages)))
+
+        kept_pages = []
+        for number, (lines, page_edges, page_matter) in enumerate(zip(pages, edges, matter)):
+            kept = []
+            for position, line in enumerate(lines):
+                stripped = line.strip()
+                if position in page_edges:
+                    if PAGE_NUMBER.match(stripped) or (number, position) in roman_page_numbers:
+                        continue
+                    if (len(stripped) <= self.max_line_length and not SECTION_HEADING.match(stripped)
+                            and repeats[line_key(stripped)] >= min_repeats):
+                        continue
+                if position in page_matter and stripped:
+                    if COPYRIGHT_LINE.search(stripped):
+                        continue
+                    if len(stripped) <= self.max_line_length and line_hash(line_key(stripped)) in self.corpus_lines:
+                        continue
+                kept.append(line)
+            kept_pages.append('\n'.join(kept))
+        return PAGE_BREAK.join(kept_pages)
+
+
+# Function to hash every word of a text to a 32 bit integer
+def word_hashes(text):
+    """
+    :param text: The text.
+
+    :returns np.ndarray: The CRC32 of every word of the text, lowercased, as uint64.
+    """
+    return np.array([zlib.crc32(word.encode('utf-8')) for word in text.casefold().split()], dtype=np.uint64)
+
+
+# Function to hash the word shingles of a text
+def shingle_hashes(text, shingle_size=SHINGLE_SIZE):
+    """
+    Hashes every run of shingle_size consecutive words of a text, with vectorized operations.
+
+    :param text: The text.
+    :param shingle_size: The number of words of a shingle.
+
+    :returns np.ndarray: The distinct 31 bit hashes of the shingles of the text (of the whole text if it is shorter
+                         than a shingle).
+    """
+    words = word_hashes(text)
+    if len(words) == 0:
+        return words
+    size = min(shingle_size, len(words))
+    # Polynomial rolling hash of the words of every shingle, modulo the Mersenne prime
+    shingles = np.zeros(len(words) - size + 1, dtype=np.uint64)
+    for offset in range(size):
+        shingles = (shingles * np.uint64(1000003) + words[offset:len(words) - size + 1 + offset]) % MERSENNE_PRIME
+    return np.unique(shingles)
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures, with one random permutation (a * x + b mod p) per hash function.
+    """
+
+    def __init__(self, num_permutations=NUM_PERMUTATIONS, seed=1):
+        """
+        :param num_permutations: The number of hash functions, i.e. the length of the signatures.
+        :param seed: Seed of the permutations, every signature compared must use the same seed.
+        """
+        rng = np.random.default_rng(seed)
+        # With a, b and x below 2^31, a * x + b fits in 64 bits
+        self.a = rng.integers(1, MERSENNE_PRIME, num_permutations, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, MERSENNE_PRIME, num_permutations, dtype=np.uint64)[:, None]
+
+    def signature(self, shingles):
+        """
+        :param shingles: The shingle hashes returned by shingle_hashes.
+
+        :returns np.ndarray: The MinHash signature of the shingles, all MERSENNE_PRIME if there are none.
+        """
+        signature = np.full(len(self.a), MERSENNE_PRIME, dtype=np.uint64)
+        for start in range(0, len(shingles), SHINGLE_BATCH_SIZE):
+            batch = shingles[None, start:start + SHINGLE_BATCH_SIZE]
+            np.minimum(signature, ((self.a * batch + self.b) % MERSENNE_PRIME).min(axis=1), out=signature)
+        return signature
+
+
+class MinHashLSH:
+    """
+    Finds near-duplicate documents by banding their MinHash signatures: documents are only compared when all the
+    rows of one of their bands are equal.
+    """
+
+    def __init__(self, num_bands=NUM_BANDS, threshold=0.8):
+        """
+        :param num_bands: The number of bands the signatures are split into.
+        :param threshold: The minimum estimated Jaccard similarity of two near-duplicates.
+        """
+        self.num_bands = num_bands
+        self.threshold = threshold
+        self.buckets = [{} for _ in range(num_bands)]  # Documents of every band value, one dictionary per band
+        self.signatures = []  # Signature of every document added
+        self.keys = []  # Key of every document added
+
+    def query(self, signature):
+        """
+        :param signature: A MinHash signature.
+
+        :returns tuple: The key and estimated similarity of the most similar document added, or None if no document
+                        reaches the threshold.
+        """
+        candidates = set()
+        for band, rows in enumerate(np.array_split(signature, self.num_bands)):
+            candidates.update(self.buckets[band].get(rows.tobytes(), ()))
+        best = None
+        for document in candidates:
+            similarity = float(np.mean(self.signatures[document] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (self.keys[document], similarity)
+        return best
+
+    def add(self, key, signature):
+        """
+        :param key: The key of the document, returned by query when it is a near-duplicate of a later document.
+        :param signature: The MinHash signature of the document.
+        """
+        document = len(self.signatures)
+        self.signatures.append(signature)
+        self.keys.append(key)
+        for band, rows in enumerate(np.array_split(signature, self.num_bands)):
+            self.buckets[band].setdefault(rows.tobytes(), []).append(document)
+
+
+# Function to compute the SimHash fingerprint of the shingles of a text
+def simhash(shingles):
+    """
+    Computes the 64 bit SimHash of a set of shingles: every bit is set if most shingles have it set in their hash.
+    Fingerprinting the distinct shingles instead of the word counts keeps frequent words like "the" and "of" from
+    deciding the bits, which would give unrelated texts nearly the same fingerprint.
+
+    :param shingles: The shingle hashes returned by shingle_hashes.
+
+    :returns int: The fingerprint.
+    """
+    if len(shingles) == 0:
+        return 0
+    # Spread every 31 bit shingle hash over 64 bits with the SplitMix64 finalizer, as a (shingles x 64) matrix of bits
+    hashes = shingles + np.uint64(0x9E3779B97F4A7C15)
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    hashes ^= hashes >> np.uint64(31)
+    bits = np.unpackbits(hashes.astype('>u8').view(np.uint8).reshape(-1, 8), axis=1)
+    fingerprint = np.packbits(bits.sum(axis=0) * 2 > len(shingles))
+    return int.from_bytes(fingerprint.tobytes(), 'big')
+
+
+class SimHashIndex:
+    """
+    Finds near-duplicate texts by the Hamming distance of their SimHash fingerprints, confirmed by the Jaccard
+    similarity of their shingles. The fingerprints are split into max_distance + 1 bands, so two fingerprints within
+    max_distance bits of each other have at least one equal band and only fingerprints sharing a band are compared.
+    Only the fingerprint and a short MinHash signature of every text are kept, the similarity being estimated from the
+    signatures, so the memory used does not grow with the length of the texts.
+    """
+
+    def __init__(self, max_distance=3, threshold=0.8, num_permutations=CHUNK_PERMUTATIONS):
+        """
+        :param max_distance: The maximum number of differing bits of two near-duplicates.
+        :param threshold: The minimum estimated Jaccard similarity of the shingles of two near-duplicates.
+        :param num_permutations: The length of the MinHash signature kept for every text.
+        """
+        self.max_distance = max_distance
+        self.threshold = threshold
+        self.hasher = MinHasher(num_permutations)
+        self.num_permutations = num_permutations
+        self.num_bands = max_distance + 1
+        # Bit offsets and masks of the bands
+        bounds = [64 * band // self.num_bands for band in range(self.num_bands + 1)]
+        self.bands = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self.buckets = [{} for _ in range(self.num_bands)]  # Texts of every band value, one dictionary per band
+        self.fingerprints = []  # Fingerprint of every text added
+        # MinHash signatures of the texts added, one after the other as uint32 (the values fit in 31 bits)
+        self.signatures = bytearray()
+
+    def _band_values(self, fingerprint):
+        return [(fingerprint >> start) & mask for start, mask in self.bands]
+
+    def _signature(self, text):
+        # A copy of the signature, so no view keeps the byte array from growing
+        size = 4 * self.num_permutations
+        return np.frombuffer(self.signatures[size * text:size * (text + 1)], dtype=np.uint32)
+
+    def query(self, fingerprint, shingles):
+        """
+        :param fingerprint: The SimHash fingerprint of the shingles.
+        :param shingles: The shingle hashes returned by shingle_hashes.
+
+        :returns bool: True if a text within max_distance bits and with an estimated shingle similarity of at least
+                       threshold was added.
+        """
+        signature = None
+        checked = set()
+        for band, value in enumerate(self._band_values(fingerprint)):
+            for text in self.buckets[band].get(value, ()):
+                if text in checked:
+                    continue
+                checked.add(text)
+                if bin(fingerprint ^ self.fingerprints[text]).count('1') > self.max_distance:
+                    continue
+                if signature is None:  # Only texts with a close fingerprint need their signature
+                    signature = self.hasher.signature(shingles).astype(np.uint32)
+                if np.mean(self._signature(text) == signature) >= self.threshold:
+                    return True
+        return False
+
+    def add(self, fingerprint, shingles):
+        """
+        :param fingerprint: The SimHash fingerprint of the shingles.
+        :param shingles: The shingle hashes returned by shingle_hashes.
+        """
+        text = len(self.fingerprints)
+        self.fingerprints.append(fingerprint)
+        self.signatures += self.hasher.signature(shingles).astype(np.uint32).tobytes()
+        for band, value in enumerate(self._band_values(fingerprint)):
+            self.buckets[band].setdefault(value, []).append(text)
+
+
+# Function to drop the near-duplicate books of a stream of books
+def dedup_books(books, threshold=0.8, report=None):
+    """
+    Yields the books that are not near-duplicates of an earlier book.
+
+    :param books: An iterable of dictionaries containing the 'title' and 'content' of a book.
+    :param threshold: The minimum estimated Jaccard similarity of the shingles of two near-duplicate books.
+    :param report: Optional list the (dropped title, kept title, similarity) of every dropped book is appended to.
+
+    :returns generator: A generator of the books kept.
+    """
+    hasher = MinHasher()
+    index = MinHashLSH(threshold=threshold)
+    for book in books:
+        shingles = shingle_hashes(book['content'])
+        if len(shingles) == 0:
+            yield book  # Nothing to compare an empty book on
+            continue
+        signature = hasher.signature(shingles)
+        duplicate = index.query(signature)
+        if duplicate is not None:
+            if report is not None:
+                report.append((book['title'], duplicate[0], duplicate[1]))
+            continue
+        index.add(book['title'], signature)
+        yield book
+
+
+# Function to drop the near-duplicate chunks of a stream of texts
+def dedup_chunks(records, get_text, max_distance=3, threshold=0.8, report=None):
+    """
+    Yields the records whose text is not a near-duplicate of the text of an earlier record.
+
+    :param records: An iterable of records, e.g. chunked instances.
+    :param get_text: A function returning the text of a record.
+    :param max_distance: The maximum number of differing SimHash bits of two near-duplicate texts.
+    :param threshold: The minimum estimated Jaccard similarity of the shingles of two near-duplicate texts.
+    :param report: Optional list every dropped record is appended to.
+
+    :returns generator: A generator of the records kept.
+    """
+    index = SimHashIndex(max_distance, threshold)
+    for record in records:
+        shingles = shingle_hashes(get_text(record))
+        fingerprint = simhash(shingles)
+        if index.query(fingerprint, shingles):
+            if report is not None:
+                report.append(record)
+            continue
+        index.add(fingerprint, shingles)
+        yield record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Strip boilerplate and drop near-duplicate books from a bundle.")
+    parser.add_argument("input_file", help="Book bundle written by Dataset_bundle.py")
+    parser.add_argument("output_file", help="Path of the deduplicated book bundle")
+    parser.add_argument("--book-threshold", type=float, default=0.8,
+                        help="Minimum estimated Jaccard similarity of near-duplicate books")
+    args = parser.parse_args()
+
+    stripper = BoilerplateStripper().fit(iter_books(args.input_file))
+    stripped_books = ({"title": book['title'], "content": stripper.strip(book['content'])}
+                      for book in iter_books(args.input_file))
+    dropped = []
+    num_books = 0
+    with open(args.output_file, 'w', encoding='utf-8') as outfile:
+        for book in dedup_books(stripped_books, args.book_threshold, dropped):
+            outfile.write(json.dumps(book) + '\n')
+            num_books += 1
+    for title, kept_title, similarity in dropped:
+        print(f"Dropped '{title}', a near-duplicate of '{kept_title}' ({similarity:.2f})")
+    print(f"Kept {num_books} books, dropped {len(dropped)} near-duplicates")
@@ -3,6 +3,20 @@
 import json
 
 
+def remap_roles(data):
+    """
+    Returns a copy of a dataset entry with the 'role' of every message changed from 'assistant' to 'model'.
+
+    :param data: A dataset entry containing a list of messages with 'role' and 'content'.
+
+    :returns dict: The entry in the Gemini format. The input entry is left unchanged.
+    """
+    # Build new message dictionaries so the same entry can also be written in the Anyscale format
+    messages = [{**message, 'role': 'model'} if message['role'] == 'assistant' else message
+                for message in data['messages']]
+    return {**data, 'messages': messages}
+
+
 def replace_role_in_jsonl(input_file, output_file):
     """
     Reads a JSONL file line by line, replacing the 'role' from 'assistant' to 'model'
@@ -16,19 +30,17 @@ def replace_role_in_jsonl(input_file, output_file):
         # Loop through each line in the input file
         for line in infile:
             data = json.loads(line)  # Parse the JSON object from the current line
-            # Iterate through the messages in the 'messages' field of the JSON object
-            for message in data['messages']:
-                # If the 'role' is 'assistant', change it to 'model'
-                if message['role'] == 'assistant':
-                    message['role'] = 'model'
+            # Change the 'role' of the messages from 'assistant' to 'model'
+            data = remap_roles(data)
             # Write the modified JSON object back to the output file in JSONL format
             outfile.write(json.dumps(data) + '\n')
 
 
-# Define the input and output file paths
-input_file = 'path to jsonl file'  # Path to the original JSONL dataset
-output_file = 'path to output file'  # Path to save the modified dataset
+if __name__ == "__main__":
+    # Define the input and output file paths
+    input_file = 'path to jsonl file'  # Path to the original JSONL dataset
+    output_file = 'path to output file'  # Path to save the modified dataset
 
-# Call the function to process the dataset and replace 'assistant' roles with 'model'
-replace_role_in_jsonl(input_file, output_file)
+    # Call the function to process the dataset and replace 'assistant' roles with 'model'
+    replace_role_in_jsonl(input_file, output_file)
 
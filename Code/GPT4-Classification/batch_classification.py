@@ -0,0 +1,113 @@
+"""
+    This file classifies several model responses with a single GPT4 request. The numbered statements are sent
+    together with one copy of the system prompt, and GPT4 answers with a JSON array holding one classification per
+    statement. Statements missing from the answer, or classified outside the allowed classes, are classified again
+    one at a time with the single response classifier of the calling script.
+"""
+
+import re
+import json
+
+# Matches the JSON array in an answer, also when GPT4 wraps it in a code block or adds a sentence around it
+JSON_ARRAY_PATTERN = re.compile(r"\[.*\]", re.DOTALL)
+
+
+# Function to build the user prompt of one batch
+def build_batch_prompt(statements, question, categories):
+    """
+    Builds the user prompt asking GPT4 to classify every statement of a batch.
+
+    :param statements: The statements to classify, each one built from a model response.
+    :param question: The question asked about every statement.
+    :param categories: The classes GPT4 may answer with.
+
+    :returns str: The user prompt.
+    """
+    numbered = "\n".join(f"{number}. {statement}" for number, statement in enumerate(statements, start=1))
+    classes = ", ".join(f"'{category}'" for category in categories)
+    return (f"Consider each of the following numbered statements separately. Based on each statement, {question}\n\n"
+            f"{numbered}\n\n"
+            f"Respond only with a JSON array containing one object per statement, in the form "
+            f"[{{\"id\": <statement number>, \"classification\": \"<class>\"}}], where the class is one of: {classes}.")
+
+
+# Function to parse the per statement classifications out of the answer to a batch
+def parse_batch_response(content, num_statements, categories):
+    """
+    Parses the JSON array answered by GPT4.
+
+    :param content: The text of the answer.
+    :param num_statements: The number of statements in the batch.
+    :param categories: The classes GPT4 may answer with.
+
+    :returns dict: The classification of every statement that was answered with an allowed class, keyed by the
+                   index of the statement in the batch (starting at 0).
+    """
+    match = JSON_ARRAY_PATTERN.search(content)
+    if not match:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    allowed = {category.lower() for category in categories}
+    classifications = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        number, classification = item.get("id"), item.get("classification")
+        if not isinstance(number, int) or not isinstance(classification, str):
+            continue
+        classification = classification.strip().strip("'\"").lower()
+        if 1 <= number <= num_statements and classification in allowed:
+            classifications[number - 1] = classification
+    return classifications
+
+
+# Function to classify a list of responses in batches
+def classify_batch(client, system_prompt, statements, question, categories, responses, classify_single,
+                   batch_size=10, model="gpt-4"):
+    """
+    Classifies the responses batch_size at a time, falling back to one request per response for every response
+    the batch answer did not classify.
+
+    :param client: The openai.OpenAI client.
+    :param system_prompt: The system prompt of the classification task, sent once per batch.
+    :param statements: The statement built from each response, in the same order as responses.
+    :param question: The question asked about every statement.
+    :param categories: The classes GPT4 may answer with.
+    :param responses: The model responses to classify.
+    :param classify_single: The single response classifier, returning a (classification, error) tuple.
+    :param batch_size: The number of responses classified with one request, 1 to use classify_single only.
+    :param model: The GPT4 model to use.
+
+    :returns list: A (classification, error) tuple for every response, in the same order as responses.
+    """
+    if batch_size <= 1:
+        return [classify_single(response) for response in responses]
+
+    results = []
+    for start in range(0, len(responses), batch_size):
+        batch_statements = statements[start:start + batch_size]
+        batch_responses = responses[start:start + batch_size]
+        classifications = {}
+        try:
+            chat_response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": build_batch_prompt(batch_statements, question, categories)}
+                ]
+            )
+            classifications = parse_batch_response(chat_response.choices[0].message.content,
+                                                    len(batch_statements), categories)
+        except Exception as e:
+            print(f"Error classifying batch starting at response {start + 1}, classifying one at a time: {e}")
+
+        for index, response in enumerate(batch_responses):
+            if index in classifications:
+                results.append((classifications[index], None))
+            else:
+                # The batch answer left this response out or could not be parsed, so ask about it on its own
+                results.append(classify_single(response))
+    return results
@@ -0,0 +1,199 @@
+"""
+    This file runs the GPT4 classification as an offline batch job instead of an interactive loop. The classification
+    requests for a response file are written to a batch request file in the JSONL format of the OpenAI Batch API,
+    one request per line with its custom_id. The file can then either be uploaded to the Batch API, or executed here
+    against any OpenAI-compatible endpoint (including a local server) with a pool of workers. Either way the results
+    land in a batch output file in the same format, and are joined back to the responses by custom_id. The custom_id
+    is a hash of the request body, so an output file reused for another response file, decade or axis never joins
+    its results to the wrong responses.
+
+    The local runner is resumable: requests already answered in the output file are skipped, so an interrupted run
+    is continued by running it again.
+
+    Example of running a batch request file from the command line:
+        python batch_requests.py requests.jsonl results.jsonl --base-url http://localhost:8000/v1 --workers 16
+"""
+
+import os
+import sys
+import json
+import uuid
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+# The shared helpers for querying the models live in Code/Model-Clients
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Model-Clients'))
+from rate_limiter import AdaptiveRateLimiter, call_with_rate_limit
+
+# Endpoint every request of a batch file is sent to
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+
+# Function to write the classification requests to a batch request file
+def write_batch_file(messages_list, batch_file, model="gpt-4"):
+    """
+    Writes one chat completion request per list of messages, in the OpenAI Batch API format.
+
+    :param messages_list: The messages of each request, in the order of the responses they classify.
+    :param batch_file: Path to the batch request file to write.
+    :param model: The GPT4 model to use.
+
+    :returns list: The custom_id of each request, in the same order as messages_list.
+    """
+    custom_ids = []
+    occurrences = {}  # Number of earlier requests with the same body, as custom_ids must be unique within a file
+    with open(batch_file, 'w', encoding='utf-8') as file:
+        for messages in messages_list:
+            body = {"model": model, "messages": messages}
+            # The custom_id is a hash of the request body, which is how the results are joined back; it does not
+            # depend on the position of the response, so stale results of another request file never match it
+            body_hash = hashlib.sha256(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+            occurrence = occurrences.get(body_hash, 0)
+            occurrences[body_hash] = occurrence + 1
+            custom_id = f"response-{body_hash}-{occurrence}"
+            request = {"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": body}
+            file.write(json.dumps(request) + '\n')
+            custom_ids.append(custom_id)
+    return custom_ids
+
+
+# Function to load the results of a batch output file
+def load_batch_results(output_file):
+    """
+    Loads a batch output file, written by run_batch_file or downloaded from the Batch API.
+
+    :param output_file: Path to the batch output file.
+
+    :returns dict: For every custom_id, a tuple of the answer text (str or None) and an error message (str or None).
+                   When a request appears several times (e.g. a failed attempt and its retry), a successful
+                   result wins over errors.
+    """
+    results = {}
+    if not os.path.exists(output_file):
+        return results
+    with open(output_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            custom_id = record["custom_id"]
+            response = record.get("response")
+            if response and response.get("status_code") == 200:
+                results[custom_id] = (response["body"]["choices"][0]["message"]["content"], None)
+            elif results.get(custom_id, (None, None))[0] is None:
+                error = record.get("error") or (response or {}).get("body")
+                results[custom_id] = (None, json.dumps(error))
+    return results
+
+
+# Function to send one request of a batch file
+def run_request(client, rate_limiter, request):
+    """
+    Sends one request of a batch file and wraps the answer in the Batch API output format.
+
+    :param client: The openai.OpenAI client of the endpoint.
+    :param rate_limiter: The AdaptiveRateLimiter of the endpoint.
+    :param request: One line of the batch request file.
+
+    :returns dict: One line of the batch output file.
+    """
+    record = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": None,
+              "error": None}
+    try:
+        chat_response = call_with_rate_limit(lambda: client.chat.completions.create(**request["body"]),
+                                             rate_limiter)
+        record["response"] = {"status_code": 200, "request_id": chat_response.id,
+                              "body": chat_response.model_dump()}
+    except Exception as e:
+        # Record the error so that the request is retried the next time the file is run
+        record["error"] = {"code": type(e).__name__, "message": str(e)}
+    return record
+
+
+# Function to execute a batch request file against an OpenAI-compatible endpoint
+def run_batch_file(client, batch_file, output_file, num_workers=8, rate_limiter=None):
+    """
+    Sends every request of the batch file that is not answered in the output file yet, num_workers at a time, and
+    appends each result to the output file as soon as it arrives.
+
+    :param client: The openai.OpenAI client of the endpoint.
+    :param batch_file: Path to the batch request file.
+    :param output_file: Path to the batch output file, appended to.
+    :param num_workers: The number of requests in flight.
+    :param rate_limiter: The AdaptiveRateLimiter of the endpoint, by default one starting at num_workers requests
+                         per second.
+
+    :returns tuple: The number of requests sent and the number of them that failed.
+    """
+    if rate_limiter is None:
+        rate_limiter = AdaptiveRateLimiter(rate=num_workers, burst=num_workers)
+    done = {custom_id for custom_id, (content, _) in load_batch_results(output_file).items() if content is not None}
+    with open(batch_file, 'r', encoding='utf-8') as file:
+        requests = [json.loads(line) for line in file if line.strip()]
+    pending = [request for request in requests if request["custom_id"] not in done]
+    print(f"{len(requests) - len(pending)} of {len(requests)} requests already answered, sending {len(pending)}")
+
+    failed = 0
+    write_lock = threading.Lock()
+    with open(output_file, 'a', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(run_request, client, rate_limiter, request) for request in pending]
+        for count, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            if record["error"] is not None:
+                failed += 1
+                print(f"Error processing request {record['custom_id']}: {record['error']['message']}")
+            with write_lock:
+                out.write(json.dumps(record) + '\n')
+                # Flush every result so an interrupted run loses nothing
+                out.flush()
+            if count % 100 == 0:
+                print(f"Answered {count} of {len(pending)} requests")
+    return len(pending), failed
+
+
+# Function to classify responses through a batch request file
+def classify_offline(client, responses, build_messages, parse_classification, batch_file, output_file,
+                     num_workers=8, model="gpt-4", run_locally=True):
+    """
+    Writes the classification request of every response to the batch request file, runs the file unless it is run
+    elsewhere, and joins the results back to the responses.
+
+    :param client: The openai.OpenAI client of the endpoint.
+    :param responses: The model responses to classify.
+    :param build_messages: Function building the chat messages classifying one response.
+    :param parse_classification: Function extracting the classification from the answer text.
+    :param batch_file: Path to the batch request file.
+    :param output_file: Path to the batch output file.
+    :param num_workers: The number of requests in flight when the file is run locally.
+    :param model: The GPT4 model to use.
+    :param run_locally: If False, only the output file is read, e.g. after it was downloaded from the Batch API.
+
+    :returns list: A (classification, error) tuple for every response, in the same order as responses.
+    """
+    custom_ids = write_batch_file([build_messages(response) for response in responses], batch_file, model)
+    if run_locally:
+        run_batch_file(client, batch_file, output_file, num_workers)
+    results = load_batch_results(output_file)
+    classifications = []
+    for custom_id in custom_ids:
+        content, error = results.get(custom_id, (None, f"No result for {custom_id} in {output_file}"))
+        classifications.append((parse_classification(content), None) if content is not None else (None, error))
+    return classifications
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a batch request file against an OpenAI-compatible endpoint.")
+    parser.add_argument("batch_file", help="Batch request file written by write_batch_file")
+    parser.add_argument("output_file", help="Batch output file, appended to and resumed from")
+    parser.add_argument("--base-url", default=None, help="Base URL of the endpoint, the OpenAI API by default")
+    parser.add_argument("--workers", type=int, default=8, help="Number of requests in flight")
+    args = parser.parse_args()
+
+    # Local servers usually accept any API key
+    batch_client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY', 'none'), base_url=args.base_url)
+    num_sent, num_failed = run_batch_file(batch_client, args.batch_file, args.output_file, args.workers)
+    print(f"Sent {num_sent} requests, {num_failed} failed; rerun to retry the failed requests")
@@ -0,0 +1,212 @@
+"""
+This file computes the associations between groups of words and attribute words in a GloVe model, as in
+queryGlove.py, with NumPy matrix operations instead of a Python loop over every pair of words. The norms of the
+embedding matrix are computed once and the rows of the queried words are L2-normalized, so the cosine similarities
+between two sets of words are a single matrix multiply, and many word sets are looked up and multiplied together. The
+embedding matrix itself is never copied, so a memory mapped matrix (see embedding_store.py) stays shared in the page
+cache.
+
+It also runs WEAT tests (Caliskan et al., 2017): the effect size of the differential association of two sets of
+target words with two sets of attribute words, and its p-value from a permutation test where the permutations are
+drawn and scored as batched NumPy arrays.
+
+Example:
+    engine = AssociationEngine.from_model(load_embeddings('path to exported embeddings'))
+    engine.associations({"male": male_words, "female": female_words}, {"homemaker": homemaker_words})
+    engine.weat(male_words, female_words, career_words, family_words)
+"""
+
+import numpy as np
+
+# Number of permutations scored per NumPy batch, so the permutation matrix stays small in memory
+PERMUTATION_BATCH_SIZE = 10000
+# Number of rows of the embedding matrix read at a time when computing the norms
+NORM_BATCH_SIZE = 65536
+
+
+class AssociationEngine:
+    """
+    Embedding matrix of a GloVe model and its row norms, with batched similarity, association and WEAT computations.
+    """
+
+    def __init__(self, word_vectors, dictionary, norms=None):
+        """
+        :param word_vectors: The embedding matrix, one row per word, e.g. a memory mapped array.
+        :param dictionary: A mapping from every word to its row in the embedding matrix.
+        :param norms: The L2 norm of every row of the embedding matrix, computed if not given.
+        """
+        self.dictionary = dictionary
+        self.word_vectors = word_vectors
+        if norms is None:
+            # Read the matrix in batches, so a float16 or memory mapped matrix is never converted as a whole
+            norms = np.concatenate([np.zeros(0, dtype=np.float32)] + [
+                np.linalg.norm(np.asarray(word_vectors[start:start + NORM_BATCH_SIZE], dtype=np.float32), axis=1)
+                for start in range(0, len(word_vectors), NORM_BATCH_SIZE)])
+        # Words with a zero vector keep a zero vector, so their similarity to every word is 0
+        self.norms = np.where(np.asarray(norms, dtype=np.float32) == 0, 1, norms).astype(np.float32)
+
+    def vectors(self, rows):
+        """
+        Reads rows of the embedding matrix, L2-normalized.
+
+        :param rows: The rows, e.g. as returned by indices.
+
+        :returns np.ndarray: The normalized float32 vectors, one row per given row.
+        """
+        return np.asarray(self.word_vectors[rows], dtype=np.float32) / self.norms[rows, None]
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Creates the engine of a GloVe model.
+
+        :param model: A model with word_vectors and dictionary attributes, e.g. a glove.Glove model or the
+                      embeddings returned by embedding_store.load_embeddings (whose saved norms are used).
+
+        :returns AssociationEngine: The engine of the model.
+        """
+        return cls(model.word_vectors, model.dictionary, getattr(model, 'norms', None))
+
+    def indices(self, words):
+        """
+        Looks up the rows of the words in the embedding matrix, skipping the words missing from the vocabulary.
+
+        :param words: List of words.
+
+        :returns np.ndarray: The row of every word found in the vocabulary.
+        """
+        return np.array([self.dictionary[word] for word in words if word in self.dictionary], dtype=np.int64)
+
+    def similarities(self, words, attribute_words):
+        """
+        Computes the cosine similarity of every word with every attribute word.
+
+        :param words: List of words.
+        :param attribute_words: List of attribute words.
+
+        :returns np.ndarray: Matrix of similarities, one row per word and one column per attribute word found in the
+                             vocabulary.
+        """
+        return self.vectors(self.indices(words)) @ self.vectors(self.indices(attribute_words)).T
+
+    def association(self, group_words, attribute_words):
+        """
+        Computes the mean cosine similarity between the words of a group and the attribute words, as
+        compute_association in queryGlove.py.
+
+        :param group_words: List of words of the group.
+        :param attribute_words: List of attribute words.
+
+        :returns float: The mean similarity, nan if no word of either list is in the vocabulary.
+        """
+        block = self.similarities(group_words, attribute_words)
+        return float(block.mean()) if block.size else float('nan')
+
+    def associations(self, groups, attributes):
+        """
+        Computes the association of every group with every attribute set, with a single matrix multiply between all
+        the group words and all the attribute words.
+
+        :param groups: A mapping from every group name to its list of words.
+        :param attributes: A mapping from every attribute set name to its list of words.
+
+        :returns dict: The association of every group with every attribute set, keyed by group name and then by
+                       attribute set name (nan where a set has no word in the vocabulary).
+        """
+        group_rows = {name: self.indices(words) for name, words in groups.items()}
+        attribute_rows = {name: self.indices(words) for name, words in attributes.items()}
+        all_group_rows = np.concatenate([np.zeros(0, dtype=np.int64)] + list(group_rows.values()))
+        all_attribute_rows = np.concatenate([np.zeros(0, dtype=np.int64)] + list(attribute_rows.values()))
+        similarity = self.vectors(all_group_rows) @ self.vectors(all_attribute_rows).T
+
+        # Every group and attribute set is a contiguous block of rows and columns of the similarity matrix
+        group_bounds = np.cumsum([0] + [len(rows) for rows in group_rows.values()])
+        attribute_bounds = np.cumsum([0] + [len(rows) for rows in attribute_rows.values()])
+        results = {}
+        for g, group in enumerate(group_rows):
+            results[group] = {}
+            for a, attribute in enumerate(attribute_rows):
+                block = similarity[group_bounds[g]:group_bounds[g + 1], attribute_bounds[a]:attribute_bounds[a + 1]]
+                results[group][attribute] = float(block.mean()) if block.size else float('nan')
+        return results
+
+    def _differential_associations(self, target_rows, attribute_a_rows, attribute_b_rows):
+        # s(w, A, B) of every target word: its mean similarity with A minus its mean similarity with B
+        targets = self.vectors(target_rows)
+        return ((targets @ self.vectors(attribute_a_rows).T).mean(axis=1)
+                - (targets @ self.vectors(attribute_b_rows).T).mean(axis=1))
+
+    def weat(self, target_x, target_y, attribute_a, attribute_b, num_permutations=10000, seed=None):
+        """
+        Runs a WEAT test of whether the target words X are more associated with the attribute words A (and the
+        target words Y with B) than the other way around.
+
+        :param target_x: List of target words X.
+        :param target_y: List of target words Y.
+        :param attribute_a: List of attribute words A.
+        :param attribute_b: List of attribute words B.
+        :param num_permutations: The number of random partitions of X and Y scored by the permutation test, 0 to skip
+                                 the test.
+        :param seed: Seed of the random partitions, for reproducible p-values.
+
+        :returns dict: The effect size, the test statistic and the one-sided p-value (None if the test is skipped),
+                       or None if a word set has no word in the vocabulary.
+        """
+        rows_x, rows_y = self.indices(target_x), self.indices(target_y)
+        rows_a, rows_b = self.indices(attribute_a), self.indices(attribute_b)
+        if min(len(rows_x), len(rows_y), len(rows_a), len(rows_b)) == 0:
+            return None
+
+        scores = self._differential_associations(np.concatenate([rows_x, rows_y]), rows_a, rows_b).astype(np.float64)
+        scores_x, scores_y = scores[:len(rows_x)], scores[len(rows_x):]
+        statistic = scores_x.sum() - scores_y.sum()
+        deviation = scores.std(ddof=1)
+        effect_size = (scores_x.mean() - scores_y.mean()) / deviation if deviation > 0 else 0.0
+
+        p_value = None
+        if num_permutations > 0:
+            p_value = permutation_p_value(scores, len(rows_x), statistic, num_permutations, seed)
+        return {"effect_size": float(effect_size), "statistic": float(statistic), "p_value": p_value}
+
+    def weat_many(self, tests, num_permutations=10000, seed=None):
+        """
+        Runs several WEAT tests.
+
+        :param tests: A mapping from every test name to its (X, Y, A, B) tuple of word lists.
+        :param num_permutations: The number of random partitions scored by every permutation test.
+        :param seed: Seed of the random partitions.
+
+        :returns dict: The result of weat for every test name.
+        """
+        rng = np.random.default_rng(seed)
+        return {name: self.weat(*word_sets, num_permutations=num_permutations, seed=rng)
+                for name, word_sets in tests.items()}
+
+
+# Function to compute the p-value of a WEAT test statistic with batched random permutations
+def permutation_p_value(scores, size_x, statistic, num_permutations=10000, seed=None):
+    """
+    Computes the one-sided p-value of a WEAT test statistic: the fraction of random partitions of the target words
+    into sets of the sizes of X and Y whose statistic is at least the observed one.
+
+    :param scores: The differential association s(w, A, B) of every target word, X first and then Y.
+    :param size_x: The number of words of X.
+    :param statistic: The observed statistic, the sum of the scores of X minus the sum of the scores of Y.
+    :param num_permutations: The number of random partitions.
+    :param seed: Seed or numpy Generator of the random partitions.
+
+    :returns float: The p-value, counting the observed partition so that it is never 0.
+    """
+    rng = np.random.default_rng(seed)
+    total = scores.sum()
+    # Allow for floating point error when comparing a permutation with the observed partition
+    threshold = statistic - 1e-12 * max(1.0, abs(statistic))
+    exceeding = 0
+    for start in range(0, num_permutations, PERMUTATION_BATCH_SIZE):
+        count = min(PERMUTATION_BATCH_SIZE, num_permutations - start)
+        # Every row of a random matrix argsorted is a random permutation; its first size_x entries form the new X
+        permutations = np.argsort(rng.random((count, len(scores))), axis=1)[:, :size_x]
+        sums_x = scores[permutations].sum(axis=1)
+        # The statistic of a partition is sum(X) - sum(Y) = 2 * sum(X) - sum(X and Y)
+        exceeding += int(np.count_nonzero(2 * sums_x - total >= threshold))
+    return (exceeding + 1) / (num_permutations + 1)
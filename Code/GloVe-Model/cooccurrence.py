@@ -0,0 +1,264 @@
+"""
+This file builds the co-occurrence matrix that trainGlove.py trains the GloVe model on, without loading the corpus
+into memory. The corpus (one sentence per line) is split into byte ranges that worker processes read lazily, line
+by line. A first pass counts the vocabulary, and a second pass accumulates the windowed co-occurrence counts of every
+byte range in a sparse matrix, written to disk as a shard. The shards are then summed one at a time into a single
+sparse matrix saved as a .npz file, next to a .vocab file listing the words in the order of their ids.
+
+The matrix is the one glove.Corpus.fit builds: word ids are given in the order of first appearance in the corpus,
+windows do not cross sentences, a pair of words at distance d adds 1/d, and only the upper triangle is stored, so it
+can be passed to Glove.fit as is.
+
+Example:
+    python cooccurrence.py "path to preprocessed dataset" "path to co-occurrence matrix" --window 15 --workers 4
+"""
+
+import os
+import shutil
+import argparse
+import numpy as np
+import scipy.sparse as sp
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of tokens a worker collects before adding their co-occurrences to its shard
+CHUNK_TOKENS = 1_000_000
+# Number of byte ranges per worker, so that a slow range does not leave the other workers idle
+SHARDS_PER_WORKER = 4
+# The vocabulary of the current worker process, set by _init_worker
+_worker_dictionary = None
+
+
+# Function to split the corpus into byte ranges
+def split_byte_ranges(corpus_file, num_shards):
+    """
+    Splits the corpus into byte ranges of about the same size. A line belongs to the range in which it starts.
+
+    :param corpus_file: Path to the corpus, one sentence per line.
+    :param num_shards: The number of ranges.
+
+    :returns list: The (start, end) byte offsets of every non-empty range.
+    """
+    size = os.path.getsize(corpus_file)
+    bounds = sorted({size * i // max(num_shards, 1) for i in range(max(num_shards, 1))} | {size})
+    return [(start, end) for start, end in zip(bounds, bounds[1:])]
+
+
+# Function to read the sentences of a byte range lazily
+def iter_sentences(corpus_file, start, end):
+    """
+    Reads the sentences that start in a byte range of the corpus, tokenized as trainGlove.py does.
+
+    :param corpus_file: Path to the corpus, one sentence per line.
+    :param start: The offset of the first byte of the range.
+    :param end: The offset after the last byte of the range.
+
+    :returns generator: A generator of the list of tokens of every sentence.
+    """
+    with open(corpus_file, 'rb') as file:
+        if start > 0:
+            # Skip the end of the line started in the previous range
+            file.seek(start - 1)
+            file.readline()
+        while file.tell() < end:
+            line = file.readline()
+            if not line:
+                break
+            yield line.decode('utf-8').strip().lower().split()
+
+
+# Function to count the words of a byte range in a worker process
+def _count_words(corpus_file, start, end):
+    # Counter keeps the words in the order of their first appearance, which gives the word ids
+    counts = Counter()
+    for tokens in iter_sentences(corpus_file, start, end):
+        counts.update(tokens)
+    return counts
+
+
+# Function to build the vocabulary of the corpus
+def build_vocabulary(corpus_file, byte_ranges, executor, min_count=1):
+    """
+    Counts the words of the corpus in parallel and gives them ids in the order of their first appearance.
+
+    :param corpus_file: Path to the corpus, one sentence per line.
+    :param byte_ranges: The byte ranges returned by split_byte_ranges.
+    :param executor: The process pool the ranges are counted in.
+    :param min_count: The minimum number of occurrences of a word to be kept in the vocabulary.
+
+    :returns dict: The id of every word kept.
+    """
+    counts = Counter()
+    # Merge in the order of the ranges, so that the first appearances stay in corpus order
+    futures = [executor.submit(_count_words, corpus_file, start, end) for start, end in byte_ranges]
+    for future in futures:
+        counts.update(future.result())
+    dictionary = {}
+    for word, count in counts.items():
+        if count >= min_count:
+            dictionary[word] = len(dictionary)
+    return dictionary
+
+
+# Function to set the vocabulary once in every worker process
+def _init_worker(dictionary):
+    global _worker_dictionary
+    _worker_dictionary = dictionary
+
+
+# Function to count the co-occurrences of a chunk of sentences
+def count_cooccurrences(word_ids, window, vocabulary_size):
+    """
+    Counts the windowed co-occurrences of a chunk of sentences with vectorized operations.
+
+    :param word_ids: The word ids of the sentences, concatenated with at least window ids of -1 between two
+                     sentences (-1 also marks the words missing from the vocabulary).
+    :param window: The context window size.
+    :param vocabulary_size: The number of words of the vocabulary.
+
+    :returns scipy.sparse.csr_matrix: The upper triangular co-occurrence matrix of the chunk.
+    """
+    rows, cols, weights = [], [], []
+    for distance in range(1, min(window, len(word_ids) - 1) + 1):
+        first, second = word_ids[:-distance], word_ids[distance:]
+        # Pairs with a missing word or the same word twice are not counted, as in glove.Corpus.fit
+        keep = (first >= 0) & (second >= 0) & (first != second)
+        first, second = first[keep], second[keep]
+        rows.append(np.minimum(first, second))
+        cols.append(np.maximum(first, second))
+        weights.append(np.full(len(first), 1.0 / distance))
+    if not rows:
+        return sp.csr_matrix((vocabulary_size, vocabulary_size))
+    # Converting to CSR sums the weights of the duplicate pairs
+    return sp.coo_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(vocabulary_size, vocabulary_size)).tocsr()
+
+
+# Function to build the co-occurrence shard of a byte range in a worker process
+def _build_shard(corpus_file, start, end, window, shard_file):
+    dictionary = _worker_dictionary
+    vocabulary_size = len(dictionary)
+    shard = sp.csr_matrix((vocabulary_size, vocabulary_size))
+    separator = [-1] * window
+    buffer = []
+    for tokens in iter_sentences(corpus_file, start, end):
+        buffer.extend(dictionary.get(token, -1) for token in tokens)
+        buffer.extend(separator)  # Keeps the windows from crossing into the next sentence
+        if len(buffer) >= CHUNK_TOKENS:
+            shard = shard + count_cooccurrences(np.array(buffer, dtype=np.int64), window, vocabulary_size)
+            buffer = []
+    if buffer:
+        shard = shard + count_cooccurrences(np.array(buffer, dtype=np.int64), window, vocabulary_size)
+    sp.save_npz(shard_file, shard)
+    return shard_file
+
+
+# Function to build the co-occurrence matrix of the corpus
+def build_cooccurrence(corpus_file, output_file, window=15, num_workers=None, min_count=1):
+    """
+    Builds the co-occurrence matrix of the corpus in parallel shards and saves it to disk.
+
+    :param corpus_file: Path to the corpus, one sentence per line.
+    :param output_file: Path to the .npz file of the matrix; the vocabulary is saved next to it as a .vocab file.
+    :param window: The context window size.
+    :param num_workers: The number of worker processes, by default one per core.
+    :param min_count: The minimum number of occurrences of a word to be kept in the vocabulary.
+
+    :returns tuple: The upper triangular co-occurrence matrix (scipy.sparse.coo_matrix) and the id of every word.
+    """
+    num_workers = num_workers or os.cpu_count()
+    byte_ranges = split_byte_ranges(corpus_file, num_workers * SHARDS_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        dictionary = build_vocabulary(corpus_file, byte_ranges, executor, min_count)
+    print(f"Vocabulary size: {len(dictionary)}")
+
+    shards_dir = output_file + ".shards"
+    os.makedirs(shards_dir, exist_ok=True)
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                 initargs=(dictionary,)) as executor:
+            futures = [executor.submit(_build_shard, corpus_file, start, end, window,
+                                       os.path.join(shards_dir, f"shard-{i}.npz"))
+                       for i, (start, end) in enumerate(byte_ranges)]
+            # Sum the shards as they are written, so only one shard is loaded at a time
+            matrix = sp.csr_matrix((len(dictionary), len(dictionary)))
+            for future in futures:
+                shard_file = future.result()
+                matrix = matrix + sp.load_npz(shard_file)
+                os.remove(shard_file)
+    finally:
+        shutil.rmtree(shards_dir, ignore_errors=True)
+
+    matrix = matrix.tocoo()
+    save_cooccurrence(output_file, matrix, dictionary)
+    return matrix, dictionary
+
+
+# Function to save a co-occurrence matrix and its vocabulary
+def save_cooccurrence(output_file, matrix, dictionary):
+    """
+    Saves a co-occurrence matrix to a .npz file and its vocabulary to a .vocab file, one word per line in the order
+    of the ids. Both are written to temporary files first and the .npz file is put in place last, so an interrupted
+    save never leaves a matrix without its vocabulary.
+
+    :param output_file: Path to the .npz file of the matrix.
+    :param matrix: The co-occurrence matrix.
+    :param dictionary: The id of every word.
+    """
+    output_file = _npz_path(output_file)
+    with open(vocabulary_file(output_file) + '.tmp', 'w', encoding='utf-8') as file:
+        for word in sorted(dictionary, key=dictionary.get):
+            file.write(word + '\n')
+    with open(output_file + '.tmp', 'wb') as file:  # Saved to a file object, so no .npz extension is added
+        sp.save_npz(file, matrix)
+    os.replace(vocabulary_file(output_file) + '.tmp', vocabulary_file(output_file))
+    os.replace(output_file + '.tmp', output_file)
+
+
+# Function to add the extension that scipy.sparse.save_npz adds to the path of the matrix
+def _npz_path(output_file):
+    return output_file if output_file.endswith(".npz") else output_file + ".npz"
+
+
+# Function to get the path of the vocabulary file of a co-occurrence matrix
+def vocabulary_file(output_file):
+    return os.path.splitext(_npz_path(output_file))[0] + ".vocab"
+
+
+# Function to check whether a co-occurrence matrix was saved completely
+def cooccurrence_exists(output_file):
+    """
+    :param output_file: Path to the .npz file of the matrix.
+
+    :returns bool: True if both the matrix and its vocabulary exist.
+    """
+    return os.path.exists(_npz_path(output_file)) and os.path.exists(vocabulary_file(output_file))
+
+
+# Function to load a co-occurrence matrix saved by build_cooccurrence
+def load_cooccurrence(output_file):
+    """
+    Loads a co-occurrence matrix and its vocabulary.
+
+    :param output_file: Path to the .npz file of the matrix.
+
+    :returns tuple: The co-occurrence matrix (scipy.sparse.coo_matrix) and the id of every word.
+    """
+    matrix = sp.load_npz(_npz_path(output_file)).tocoo()
+    with open(vocabulary_file(output_file), 'r', encoding='utf-8') as file:
+        dictionary = {line.rstrip('\n'): i for i, line in enumerate(file)}
+    return matrix, dictionary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the GloVe co-occurrence matrix of a corpus.")
+    parser.add_argument("corpus_file", help="Preprocessed dataset, one sentence per line")
+    parser.add_argument("output_file", help="Path to the .npz file of the co-occurrence matrix")
+    parser.add_argument("--window", type=int, default=15, help="Context window size")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--min-count", type=int, default=1, help="Minimum number of occurrences of a word")
+    args = parser.parse_args()
+
+    matrix, dictionary = build_cooccurrence(args.corpus_file, args.output_file, args.window, args.workers,
+                                            args.min_count)
+    print(f"Co-occurrence matrix shape: {matrix.shape}, {matrix.nnz} non-zero entries")
@@ -0,0 +1,229 @@
+"""
+This file aligns the GloVe models of several decades in a common space and measures how much every word moved
+between decades (its semantic drift), for the whole shared vocabulary at once.
+
+The models are restricted to the words they all share, their vectors are L2-normalized, and every decade is rotated
+onto the previous one with orthogonal Procrustes (Hamilton et al., 2016): the rotation R minimizing |X R - Y| is
+U V^T from the SVD of X^T Y. The rotations between all pairs of consecutive decades are solved as one batched SVD
+and chained, so every decade ends up in the space of the first one. Rotations preserve the cosine similarities
+inside a decade, so associations (see association.py) are unchanged by the alignment.
+
+The drift of a word between two decades is the cosine distance between its aligned vectors. The aligned matrices are
+cached to a .npz file, together with a fingerprint of the models, and reused while the models do not change. The
+fingerprint of an exported model is the path, size and modification time of its files, so a cache hit reads no
+vectors at all.
+
+Example:
+    python drift.py "path to 1950s embeddings" "path to 1960s embeddings" "path to 1970s embeddings" \
+        --names 1950s 1960s 1970s --cache "path to alignment cache" --top 20
+"""
+
+import os
+import hashlib
+import argparse
+import numpy as np
+
+from association import AssociationEngine
+from embedding_store import embedding_files
+
+
+# Function to find the words that every model has
+def shared_vocabulary(models):
+    """
+    :param models: List of models with word_vectors and dictionary attributes.
+
+    :returns list: The words in the vocabulary of every model, in the order of the rows of the first model.
+    """
+    first = models[0].dictionary
+    shared = set(first).intersection(*(model.dictionary for model in models[1:]))
+    return sorted(shared, key=first.get)
+
+
+# Function to read the normalized vectors of the shared vocabulary of every model
+def normalized_matrices(models, words):
+    """
+    :param models: List of models with word_vectors and dictionary attributes.
+    :param words: The shared vocabulary.
+
+    :returns np.ndarray: Array of shape (models, words, dimensions) of the L2-normalized float32 vectors.
+    """
+    matrices = []
+    for model in models:
+        rows = np.array([model.dictionary[word] for word in words], dtype=np.int64)
+        matrix = np.asarray(model.word_vectors[rows], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrices.append(matrix / np.where(norms == 0, 1, norms))
+    return np.stack(matrices)
+
+
+# Function to align every model onto the previous one
+def procrustes_align(matrices):
+    """
+    Rotates every matrix onto the previous one with orthogonal Procrustes and chains the rotations, so every matrix
+    ends up in the space of the first. The rotations of all consecutive pairs are solved with one batched SVD.
+
+    :param matrices: Array of shape (models, words, dimensions) of normalized vectors, one matrix per decade in
+                     chronological order.
+
+    :returns np.ndarray: The aligned matrices, of the same shape.
+    """
+    if len(matrices) < 2:
+        return matrices.copy()
+    # Cross-covariance X_i^T Y_i of every decade i with the previous one, as one batched matrix multiply
+    covariances = np.matmul(matrices[1:].transpose(0, 2, 1), matrices[:-1])
+    u, _, vt = np.linalg.svd(covariances)
+    rotations = np.matmul(u, vt)
+    # Chain the rotations: decade i goes to decade i-1 with R_i, so to the first decade with R_i R_i-1 ... R_1
+    aligned = np.empty_like(matrices)
+    aligned[0] = matrices[0]
+    total_rotation = np.eye(matrices.shape[2], dtype=matrices.dtype)
+    for i, rotation in enumerate(rotations, start=1):
+        total_rotation = rotation @ total_rotation
+        aligned[i] = matrices[i] @ total_rotation
+    return aligned
+
+
+# Function to fingerprint the models being aligned without reading their vectors
+def _fingerprint(names, words, models):
+    digest = hashlib.sha256()
+    digest.update("\n".join(names).encode('utf-8') + b"\0" + "\n".join(words).encode('utf-8'))
+    for model in models:
+        prefix = getattr(model, "prefix", None)
+        if prefix is not None:
+            # An exported model (see embedding_store.py) is identified by its files
+            for path in embedding_files(prefix):
+                if os.path.exists(path):
+                    stat = os.stat(path)
+                    digest.update(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode('utf-8'))
+        else:
+            # A model in memory (e.g. a glove.Glove model) has no files, so its vectors are hashed
+            digest.update(np.ascontiguousarray(model.word_vectors).tobytes())
+    return digest.hexdigest()
+
+
+class DecadeAlignment:
+    """
+    Vectors of the shared vocabulary of several decade models, aligned in the space of the first decade.
+    """
+
+    def __init__(self, names, words, aligned):
+        """
+        :param names: The names of the decades, in chronological order.
+        :param words: The shared vocabulary.
+        :param aligned: Array of shape (decades, words, dimensions) of the aligned normalized vectors.
+        """
+        self.names = list(names)
+        self.words = list(words)
+        self.dictionary = {word: i for i, word in enumerate(self.words)}
+        self.aligned = aligned
+
+    def indices(self, words):
+        """
+        :param words: List of words.
+
+        :returns np.ndarray: The row of every word found in the shared vocabulary.
+        """
+        return np.array([self.dictionary[word] for word in words if word in self.dictionary], dtype=np.int64)
+
+    def drift(self, words=None):
+        """
+        Computes the cosine distance between the aligned vectors of every word in consecutive decades and between
+        the first and the last decade.
+
+        :param words: List of words, by default the whole shared vocabulary.
+
+        :returns dict: "words", the words measured; "consecutive", an array of shape (decades - 1, words) of the
+                       drift between every decade and the next; "total", the drift from the first to the last decade.
+        """
+        rows = np.arange(len(self.words)) if words is None else self.indices(words)
+        vectors = self.aligned[:, rows]
+        # The rows are normalized, so the cosine similarity is the row-wise dot product
+        consecutive = 1 - np.einsum('kwd,kwd->kw', vectors[1:], vectors[:-1])
+        total = 1 - np.einsum('wd,wd->w', vectors[-1], vectors[0])
+        return {"words": [self.words[row] for row in rows], "consecutive": consecutive, "total": total}
+
+    def most_changed(self, count=20, start=None, end=None):
+        """
+        Ranks the words by their drift between two decades.
+
+        :param count: The number of words returned.
+        :param start: The name of the earlier decade, by default the first.
+        :param end: The name of the later decade, by default the last.
+
+        :returns list: The (word, drift) pairs of the words that moved the most, largest drift first.
+        """
+        first = self.aligned[self.names.index(start) if start is not None else 0]
+        last = self.aligned[self.names.index(end) if end is not None else -1]
+        drifts = 1 - np.einsum('wd,wd->w', last, first)
+        count = min(count, len(drifts))
+        top = np.argpartition(-drifts, count - 1)[:count] if count else np.zeros(0, dtype=np.int64)
+        top = top[np.argsort(-drifts[top])]
+        return [(self.words[row], float(drifts[row])) for row in top]
+
+    def association_trend(self, groups, attributes):
+        """
+        Computes the association of every group with every attribute set in every decade (see
+        association.AssociationEngine.associations), on the shared vocabulary.
+
+        :param groups: A mapping from every group name to its list of words.
+        :param attributes: A mapping from every attribute set name to its list of words.
+
+        :returns dict: The associations of every decade, keyed by decade name.
+        """
+        norms = np.ones(len(self.words), dtype=np.float32)
+        return {name: AssociationEngine(self.aligned[i], self.dictionary, norms).associations(groups, attributes)
+                for i, name in enumerate(self.names)}
+
+    def save(self, cache_file, fingerprint):
+        """
+        Saves the alignment to a .npz file.
+
+        :param cache_file: Path to the cache file.
+        :param fingerprint: The fingerprint of the models the alignment was computed from.
+        """
+        temporary_file = cache_file + ".tmp.npz"
+        np.savez(temporary_file, names=np.array(self.names), words=np.array(self.words), aligned=self.aligned,
+                 fingerprint=np.array(fingerprint))
+        os.replace(temporary_file, cache_file)
+
+
+# Function to align the models of several decades, reusing the cached alignment if the models did not change
+def align_decades(models, names=None, cache_file=None):
+    """
+    Aligns the models of several decades on their shared vocabulary.
+
+    :param models: List of models with word_vectors and dictionary attributes (e.g. the embeddings returned by
+                   embedding_store.load_embeddings), in chronological order.
+    :param names: The names of the decades, by default their positions.
+    :param cache_file: Path to the .npz cache of the alignment, None to not cache it.
+
+    :returns DecadeAlignment: The aligned vectors.
+    """
+    names = [str(name) for name in (names or range(len(models)))]
+    words = shared_vocabulary(models)
+    # The fingerprint is checked before any vector is read, so a cache hit only costs reading the vocabularies
+    fingerprint = _fingerprint(names, words, models)
+    if cache_file is not None and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if str(cached["fingerprint"]) == fingerprint:
+                return DecadeAlignment(names, words, cached["aligned"])
+    alignment = DecadeAlignment(names, words, procrustes_align(normalized_matrices(models, words)))
+    if cache_file is not None:
+        alignment.save(cache_file, fingerprint)
+    return alignment
+
+
+if __name__ == "__main__":
+    from embedding_store import load_embeddings
+
+    parser = argparse.ArgumentParser(description="Align decade GloVe models and list the words that drifted most.")
+    parser.add_argument("prefixes", nargs="+", help="Exported embeddings of every decade, in chronological order")
+    parser.add_argument("--names", nargs="+", default=None, help="Names of the decades")
+    parser.add_argument("--cache", default=None, help="Path to the .npz cache of the alignment")
+    parser.add_argument("--top", type=int, default=20, help="Number of words listed")
+    args = parser.parse_args()
+
+    decade_alignment = align_decades([load_embeddings(prefix) for prefix in args.prefixes], args.names, args.cache)
+    print(f"{len(decade_alignment.words)} words shared by {len(decade_alignment.names)} decades")
+    for word, word_drift in decade_alignment.most_changed(args.top):
+        print(f"{word}: {word_drift:.4f}")
@@ -0,0 +1,134 @@
+"""
+This file exports the word vectors of a trained GloVe model to a raw .npy matrix with a separate vocabulary file,
+so that queryGlove.py and association.py can load a model without unpickling it. The matrix is memory mapped on
+load: loading only reads the vocabulary, the vectors are paged in when a query reads them, and processes loading the
+same model share its pages through the page cache. Several decade models can therefore be compared side by side for
+the cost of reading their vocabularies.
+
+An export with the prefix 'path to embeddings' writes three files:
+    path to embeddings.npy        The word vectors, one row per word, float32 or float16
+    path to embeddings.norms.npy  The float32 L2 norm of every row, used by association.AssociationEngine
+    path to embeddings.vocab      The words, one per line in the order of their rows
+
+Example:
+    python embedding_store.py "path to glove model" "path to embeddings" --dtype float16
+"""
+
+import os
+import argparse
+import numpy as np
+
+# Data types the word vectors can be exported as
+EXPORT_DTYPES = ("float32", "float16")
+
+
+# Function to get the paths of the files of an export
+def embedding_files(prefix):
+    """
+    :param prefix: The path prefix of the export.
+
+    :returns tuple: The paths of the vectors, norms and vocabulary files.
+    """
+    return prefix + ".npy", prefix + ".norms.npy", prefix + ".vocab"
+
+
+# Function to write an array to a .npy file, through a temporary file so an interrupted export leaves no partial file
+def _save_array(path, array):
+    temporary_file = path + ".tmp"
+    with open(temporary_file, 'wb') as file:
+        np.save(file, array)
+    os.replace(temporary_file, path)
+
+
+# Function to export the word vectors of a model
+def export_embeddings(model, prefix, dtype="float32"):
+    """
+    Exports the word vectors and the vocabulary of a model.
+
+    :param model: A model with word_vectors and dictionary attributes, e.g. a glove.Glove model.
+    :param prefix: The path prefix of the exported files.
+    :param dtype: The data type of the exported vectors, float32 or float16 (half the size, about 3 significant
+                  digits).
+    """
+    if dtype not in EXPORT_DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype}, expected one of {EXPORT_DTYPES}")
+    vectors_file, norms_file, vocabulary_file = embedding_files(prefix)
+    vectors = np.ascontiguousarray(model.word_vectors, dtype=dtype)
+    # The norms are computed from the exported vectors, so that the normalized float16 vectors have unit length
+    norms = np.linalg.norm(vectors.astype(np.float32), axis=1).astype(np.float32)
+    words = sorted(model.dictionary, key=model.dictionary.get)
+    if [model.dictionary[word] for word in words] != list(range(len(vectors))):
+        raise ValueError("The dictionary of the model does not map its words to the rows 0 to n-1")
+
+    _save_array(vectors_file, vectors)
+    _save_array(norms_file, norms)
+    temporary_file = vocabulary_file + ".tmp"
+    with open(temporary_file, 'w', encoding='utf-8') as file:
+        for word in words:
+            file.write(word + '\n')
+    os.replace(temporary_file, vocabulary_file)
+
+
+class Embeddings:
+    """
+    Word vectors of an exported model, memory mapped. Like a glove.Glove model, it has word_vectors, dictionary and
+    inverse_dictionary attributes.
+    """
+
+    def __init__(self, prefix):
+        """
+        :param prefix: The path prefix the model was exported with.
+        """
+        vectors_file, norms_file, vocabulary_file = embedding_files(prefix)
+        self.prefix = prefix
+        # Read only memory maps: nothing is read until a row is accessed, and the pages are shared between processes
+        self.word_vectors = np.load(vectors_file, mmap_mode='r')
+        self.norms = np.load(norms_file, mmap_mode='r') if os.path.exists(norms_file) else None
+        with open(vocabulary_file, 'r', encoding='utf-8') as file:
+            self.inverse_dictionary = file.read().split('\n')[:-1]
+        self.dictionary = {word: i for i, word in enumerate(self.inverse_dictionary)}
+        if len(self.dictionary) != len(self.word_vectors):
+            raise ValueError(f"{vocabulary_file} has {len(self.dictionary)} words for {len(self.word_vectors)} vectors")
+
+    def __contains__(self, word):
+        return word in self.dictionary
+
+    def __len__(self):
+        return len(self.inverse_dictionary)
+
+    def vector(self, word):
+        """
+        Looks up the vector of a word.
+
+        :param word: The word.
+
+        :returns np.ndarray: The float32 vector of the word, or None if it is not in the vocabulary.
+        """
+        row = self.dictionary.get(word)
+        return None if row is None else np.asarray(self.word_vectors[row], dtype=np.float32)
+
+
+# Function to load an exported model
+def load_embeddings(prefix):
+    """
+    Memory maps the word vectors of an exported model and reads its vocabulary.
+
+    :param prefix: The path prefix the model was exported with.
+
+    :returns Embeddings: The word vectors and vocabulary of the model.
+    """
+    return Embeddings(prefix)
+
+
+if __name__ == "__main__":
+    from glove import Glove
+
+    parser = argparse.ArgumentParser(description="Export the word vectors of a GloVe model for memory mapped loading.")
+    parser.add_argument("model_file", help="GloVe model saved by trainGlove.py")
+    parser.add_argument("prefix", help="Path prefix of the exported files")
+    parser.add_argument("--dtype", choices=EXPORT_DTYPES, default="float32", help="Data type of the exported vectors")
+    args = parser.parse_args()
+
+    glove_model = Glove.load(args.model_file)
+    export_embeddings(glove_model, args.prefix, args.dtype)
+    print(f"Exported {len(glove_model.dictionary)} words to {', '.join(embedding_files(args.prefix))}")
@@ -1,31 +1,26 @@
-from scipy.spatial.distance import cosine
-import numpy as np
-from glove import Corpus, Glove
 from nltk.tokenize import word_tokenize
 
+from association import AssociationEngine
+from embedding_store import load_embeddings
+
 # Define the words for the groups and role set, examples are provided below for the role of homemaker
 male_words = ["man", "father", "brother"]
 female_words = ["woman", "mother", "sister"]
 non_binary_words = ["they", "them", "partner"]
 homemaker_words = ["homemaker", "family", "caregiver", "cooking"]
 
-glove_model = Glove.load('path to glove model')
-# Get vectors for words in each group and homemaker set
-def get_vectors(words, model):
-    return [model.word_vectors[model.dictionary[word]] for word in words if word in model.dictionary]
-
-male_vectors = get_vectors(male_words, glove_model)
-female_vectors = get_vectors(female_words, glove_model)
-non_binary_vectors = get_vectors(non_binary_words, glove_model)
-homemaker_vectors = get_vectors(homemaker_words, glove_model)
-
-# Compute the association score for each group
-def compute_association(group_vectors, attribute_vectors):
-    return np.mean([1 - cosine(w, a) for w in group_vectors for a in attribute_vectors])
+# Memory map the word vectors exported with embedding_store.py instead of unpickling the whole model
+glove_model = load_embeddings('path to exported embeddings')
+# Normalize the embedding matrix once, so every association below is a matrix multiply
+engine = AssociationEngine.from_model(glove_model)
 
-male_association = compute_association(male_vectors, homemaker_vectors)
-female_association = compute_association(female_vectors, homemaker_vectors)
-non_binary_association = compute_association(non_binary_vectors, homemaker_vectors)
+# Compute the association score of every group with the homemaker set in a single batch
+associations = engine.associations(
+    {"male": male_words, "female": female_words, "non_binary": non_binary_words},
+    {"homemaker": homemaker_words})
+male_association = associations["male"]["homemaker"]
+female_association = associations["female"]["homemaker"]
+non_binary_association = associations["non_binary"]["homemaker"]
 
 print("Male association with homemaker:", male_association)
 print("Female association with homemaker:", female_association)
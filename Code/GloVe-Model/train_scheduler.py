@@ -0,0 +1,248 @@
+"""
+This file trains a set of GloVe models (e.g. one per decade, plus the overlap and non-overlap variants) from a
+manifest, in one command. It runs in two phases:
+
+1. The co-occurrence matrix of every distinct (corpus, window, min_count) is built once with cooccurrence.py, which
+   uses every core, and cached under the hash of its inputs. Models trained on the same corpus with different
+   parameters share the matrix, and a rerun does not tokenize an unchanged corpus again.
+2. The models are trained as parallel jobs packed onto the cores: every job uses its number of training threads, and
+   the next job starts as soon as enough cores are free, the largest matrices first.
+
+Every model is saved with a metadata JSON file next to it, holding the hash of its inputs, and its vectors are
+exported next to it for memory mapped loading (see embedding_store.py). A rerun skips the models whose corpus
+and parameters have not changed.
+
+The manifest is a JSON file such as:
+    {
+        "work_dir": "path to training work directory",
+        "defaults": {"window": 15, "no_components": 100, "learning_rate": 0.05, "epochs": 50, "threads": 4},
+        "models": [
+            {"name": "1950s", "corpus": "path to 1950s preprocessed dataset", "output": "path to 1950s model"},
+            {"name": "1950s overlap", "corpus": "path to 1950s overlap dataset", "output": "path to model"}
+        ]
+    }
+
+Example:
+    python train_scheduler.py "path to manifest" --cores 16
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from glove import Glove
+
+from cooccurrence import build_cooccurrence, load_cooccurrence, cooccurrence_exists
+from embedding_store import export_embeddings
+
+# Training parameters of a model that the manifest does not set
+DEFAULT_PARAMETERS = {"window": 15, "min_count": 1, "no_components": 100, "learning_rate": 0.05, "epochs": 50,
+                      "threads": 4, "export_dtype": "float32"}
+# Parameters that determine the co-occurrence matrix, the others only determine the training
+COOCCURRENCE_PARAMETERS = ("window", "min_count")
+# Size of the blocks read when hashing a corpus
+HASH_BLOCK_SIZE = 1 << 20
+
+
+# Function to hash a corpus, reusing the hash of an unchanged file
+def corpus_hash(corpus_file, hash_cache):
+    """
+    Computes the SHA-256 hash of a corpus. Hashes are cached by path, size and modification time, so an unchanged
+    corpus is not read again.
+
+    :param corpus_file: Path to the corpus.
+    :param hash_cache: Dictionary of the cached hashes, updated in place.
+
+    :returns str: The hexadecimal hash of the corpus.
+    """
+    stat = os.stat(corpus_file)
+    key = os.path.abspath(corpus_file)
+    cached = hash_cache.get(key)
+    if cached is not None and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+        return cached["hash"]
+    digest = hashlib.sha256()
+    with open(corpus_file, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    hash_cache[key] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": digest.hexdigest()}
+    return hash_cache[key]["hash"]
+
+
+# Function to hash a JSON serializable value
+def _json_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Function to read the models of a manifest
+def load_manifest(manifest_file):
+    """
+    Reads a manifest and fills in the default parameters of every model.
+
+    :param manifest_file: Path to the manifest JSON file.
+
+    :returns tuple: The work directory and the list of models, each a dictionary with its name, corpus, output and
+                    parameters.
+    """
+    with open(manifest_file, 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+    defaults = {**DEFAULT_PARAMETERS, **manifest.get("defaults", {})}
+    models = []
+    for entry in manifest["models"]:
+        parameters = {key: entry.get(key, value) for key, value in defaults.items()}
+        models.append({"name": entry["name"], "corpus": entry["corpus"], "output": entry["output"],
+                       "parameters": parameters})
+    return manifest.get("work_dir", os.path.splitext(manifest_file)[0] + "-work"), models
+
+
+# Function to get the path of the metadata file of a model
+def metadata_file(model_file):
+    return model_file + ".json"
+
+
+# Function to check whether a model is already trained on its current inputs
+def is_up_to_date(model, input_hash):
+    """
+    :param model: The model entry of the manifest.
+    :param input_hash: The hash of the current inputs of the model.
+
+    :returns bool: True if the model file exists and its metadata was saved with the same inputs.
+    """
+    if not os.path.exists(model["output"]) or not os.path.exists(metadata_file(model["output"])):
+        return False
+    with open(metadata_file(model["output"]), 'r', encoding='utf-8') as file:
+        return json.load(file).get("input_hash") == input_hash
+
+
+# Function to train and save a model in a worker process
+def train_model(model, cooccurrence_file, input_hash):
+    """
+    Trains a GloVe model on a cached co-occurrence matrix and saves it with its metadata.
+
+    :param model: The model entry of the manifest.
+    :param cooccurrence_file: Path to the co-occurrence matrix of the corpus of the model.
+    :param input_hash: The hash of the inputs of the model, saved in its metadata.
+
+    :returns dict: The metadata of the model.
+    """
+    parameters = model["parameters"]
+    start = time.time()
+    matrix, dictionary = load_cooccurrence(cooccurrence_file)
+    glove = Glove(no_components=parameters["no_components"], learning_rate=parameters["learning_rate"])
+    glove.fit(matrix, epochs=parameters["epochs"], no_threads=parameters["threads"], verbose=False)
+    glove.add_dictionary(dictionary)
+    output_dir = os.path.dirname(model["output"])
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    glove.save(model["output"])
+    # Export the vectors next to the model, so they can be memory mapped instead of unpickled
+    export_embeddings(glove, model["output"], parameters["export_dtype"])
+
+    metadata = {"name": model["name"], "corpus": model["corpus"], "parameters": parameters,
+                "input_hash": input_hash, "vocabulary_size": len(dictionary), "cooccurrences": int(matrix.nnz),
+                "training_seconds": round(time.time() - start, 1),
+                "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    # Written last, so a model interrupted while saving is trained again on the next run
+    with open(metadata_file(model["output"]), 'w', encoding='utf-8') as file:
+        json.dump(metadata, file, indent=2)
+    return metadata
+
+
+# Function to run the training jobs packed onto the cores
+def run_training_jobs(jobs, cores):
+    """
+    Runs the training jobs in parallel, starting a job whenever enough cores are free for its threads. Jobs are
+    started largest first, so the long jobs do not end up running alone at the end.
+
+    :param jobs: List of (model, cooccurrence_file, input_hash, size) tuples, size being the cost used to order the
+                 jobs.
+    :param cores: The number of cores available.
+
+    :returns list: The metadata of every model trained.
+    """
+    pending = sorted(jobs, key=lambda job: job[3], reverse=True)
+    running = {}
+    trained = []
+    free_cores = cores
+    with ProcessPoolExecutor(max_workers=max(len(jobs), 1)) as executor:
+        while pending or running:
+            # Start the largest pending job that fits on the free cores, or any job if nothing is running
+            started = True
+            while pending and started:
+                started = False
+                for position, job in enumerate(pending):
+                    threads = min(job[0]["parameters"]["threads"], cores)
+                    if threads <= free_cores or not running:
+                        pending.pop(position)
+                        print(f"Training {job[0]['name']} on {threads} threads...")
+                        running[executor.submit(train_model, job[0], job[1], job[2])] = (job[0], threads)
+                        free_cores -= threads
+                        started = True
+                        break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                model, threads = running.pop(future)
+                free_cores += threads
+                try:
+                    trained.append(future.result())
+                    print(f"Saved {model['name']} to {model['output']}")
+                except Exception as e:
+                    print(f"Error training {model['name']}: {str(e)}")  # The model is trained again on the next run
+    return trained
+
+
+# Function to train every model of a manifest
+def train_all(manifest_file, cores=None, force=False):
+    """
+    Builds the co-occurrence matrices and trains the models of a manifest, skipping the models that are up to date.
+
+    :param manifest_file: Path to the manifest JSON file.
+    :param cores: The number of cores to use, by default every core.
+    :param force: If True, every model is trained again.
+
+    :returns list: The metadata of every model trained.
+    """
+    cores = cores or os.cpu_count()
+    work_dir, models = load_manifest(manifest_file)
+    cooccurrence_dir = os.path.join(work_dir, "cooccurrence")
+    os.makedirs(cooccurrence_dir, exist_ok=True)
+    hash_cache_file = os.path.join(work_dir, "corpus_hashes.json")
+    hash_cache = {}
+    if os.path.exists(hash_cache_file):
+        with open(hash_cache_file, 'r', encoding='utf-8') as file:
+            hash_cache = json.load(file)
+
+    jobs = []
+    for model in models:
+        parameters = model["parameters"]
+        # The matrix depends on the corpus and the co-occurrence parameters, the model also on the training ones
+        matrix_inputs = [corpus_hash(model["corpus"], hash_cache)] + [parameters[key] for key in
+                                                                      COOCCURRENCE_PARAMETERS]
+        cooccurrence_file = os.path.join(cooccurrence_dir, _json_hash(matrix_inputs)[:16] + ".npz")
+        input_hash = _json_hash({"matrix": matrix_inputs, "parameters": {
+            key: value for key, value in parameters.items() if key != "threads"}})
+        if not force and is_up_to_date(model, input_hash):
+            print(f"Skipping {model['name']}, its inputs have not changed")
+            continue
+        if not cooccurrence_exists(cooccurrence_file):  # A build interrupted before saving both files is redone
+            print(f"Building the co-occurrence matrix of {model['corpus']}...")
+            build_cooccurrence(model["corpus"], cooccurrence_file, window=parameters["window"], num_workers=cores,
+                               min_count=parameters["min_count"])
+        jobs.append((model, cooccurrence_file, input_hash, os.path.getsize(cooccurrence_file)))
+
+    with open(hash_cache_file, 'w', encoding='utf-8') as file:
+        json.dump(hash_cache, file)
+    return run_training_jobs(jobs, cores)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the GloVe models of a manifest.")
+    parser.add_argument("manifest_file", help="JSON manifest of the models to train")
+    parser.add_argument("--cores", type=int, default=None, help="Number of cores to use, by default every core")
+    parser.add_argument("--force", action="store_true", help="Train every model again")
+    args = parser.parse_args()
+
+    trained_models = train_all(args.manifest_file, args.cores, args.force)
+    print(f"Trained {len(trained_models)} models")
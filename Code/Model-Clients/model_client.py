@@ -0,0 +1,424 @@
+"""
+    This file provides the client layer shared by the scripts that query the models. There is one backend per
+    provider, created once and reused for every request of the process: the OpenAI-compatible backend (Anyscale,
+    OpenAI or a local server) keeps a pool of keep-alive HTTP connections, the Vertex AI backend initializes Vertex AI
+    once and keeps one GenerativeModel handle per model, and the mock backend answers locally without any network,
+    for dry runs of the scripts.
+
+    Several samples of the same prompt are requested with the multi-completion parameter of the provider (n for
+    OpenAI-compatible endpoints, candidate_count for Gemini), in chunks of at most max_samples_per_request samples.
+    With max_samples_per_request=1, or when the provider answers with fewer samples than asked, the samples are
+    requested with parallel single requests instead. A provider rejecting the parameter with an error (e.g. a Gemini
+    model answering 400 to candidate_count>1) sets max_samples_per_request of its backend to 1 and the samples are
+    requested one at a time from then on.
+
+    The provider is chosen by the script, and can be overridden with the MODEL_PROVIDER environment variable
+    (e.g. MODEL_PROVIDER=mock to run a script without querying any model).
+"""
+
+import os
+import time
+import asyncio
+import inspect
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from rate_limiter import call_with_rate_limit
+
+# The text of a completion and the number of tokens (prompt and completion) it used, None if the provider did not say
+Completion = namedtuple("Completion", ["text", "total_tokens"])
+# The texts of the samples returned by one request and the number of tokens the request used
+Samples = namedtuple("Samples", ["texts", "total_tokens"])
+
+
+# Function to build the chat messages of a completion request
+def _messages(system_prompt, prompt):
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+class OpenAIBackend:
+    """
+    Backend for OpenAI-compatible endpoints. The synchronous and the asynchronous client each keep a pool of
+    keep-alive connections, shared by every request sent through the backend.
+    """
+
+    def __init__(self, base_url=None, api_key=None, timeout=600.0, max_samples_per_request=16):
+        """
+        :param base_url: The API endpoint, None for the OpenAI API.
+        :param api_key: The API key used for authentication.
+        :param timeout: The request timeout in seconds.
+        :param max_samples_per_request: The largest n sent in one request, 1 for endpoints that do not support n.
+        """
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_samples_per_request = max_samples_per_request
+        # The client pools its connections, so creating it once is what keeps them alive between requests
+        self.client = openai.OpenAI(base_url=base_url, api_key=api_key, timeout=timeout)
+        self._async_client = None
+
+    @property
+    def async_client(self):
+        """
+        The asynchronous client of the endpoint, created on first use.
+        """
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(base_url=self.base_url, api_key=self.api_key,
+                                                    timeout=self.timeout)
+        return self._async_client
+
+    @staticmethod
+    def _request(model, system_prompt, prompt, generation_config, n):
+        request = dict(generation_config, model=model, messages=_messages(system_prompt, prompt))
+        # Only send n when it is needed, some endpoints reject the parameter altogether
+        if n > 1:
+            request["n"] = n
+        return request
+
+    @staticmethod
+    def _samples(response):
+        return Samples([choice.message.content for choice in response.choices],
+                       response.usage.total_tokens if response.usage is not None else None)
+
+    def complete(self, model, system_prompt, prompt, generation_config):
+        """
+        Sends the system prompt and the prompt to the model.
+
+        :param model: The model to use for generation.
+        :param system_prompt: The system prompt, or an empty string for none.
+        :param prompt: The user prompt.
+        :param generation_config: The sampling parameters of the request, e.g. {"max_tokens": 100}.
+
+        :returns Completion: The generated text and the tokens used.
+        """
+        samples = self.complete_n(model, system_prompt, prompt, generation_config, 1)
+        return Completion(samples.texts[0], samples.total_tokens)
+
+    async def complete_async(self, model, system_prompt, prompt, generation_config):
+        """
+        Asynchronous version of complete.
+
+        :returns Completion: The generated text and the tokens used.
+        """
+        samples = await self.complete_n_async(model, system_prompt, prompt, generation_config, 1)
+        return Completion(samples.texts[0], samples.total_tokens)
+
+    def complete_n(self, model, system_prompt, prompt, generation_config, n):
+        """
+        Requests n samples of the prompt with a single request.
+
+        :param model: The model to use for generation.
+        :param system_prompt: The system prompt, or an empty string for none.
+        :param prompt: The user prompt.
+        :param generation_config: The sampling parameters of every sample, e.g. {"max_tokens": 100}.
+        :param n: The number of samples, at most max_samples_per_request.
+
+        :returns Samples: The texts returned (possibly fewer than n) and the tokens used by the request.
+        """
+        return self._samples(self.client.chat.completions.create(
+            **self._request(model, system_prompt, prompt, generation_config, n)))
+
+    async def complete_n_async(self, model, system_prompt, prompt, generation_config, n):
+        """
+        Asynchronous version of complete_n.
+
+        :returns Samples: The texts returned (possibly fewer than n) and the tokens used by the request.
+        """
+        return self._samples(await self.async_client.chat.completions.create(
+            **self._request(model, system_prompt, prompt, generation_config, n)))
+
+
+class VertexBackend:
+    """
+    Backend for Gemini on Vertex AI. Vertex AI is initialized once, and every model handle is created once and reused.
+    """
+
+    def __init__(self, project=None, location=None, max_samples_per_request=1):
+        """
+        :param project: The Google Cloud project id.
+        :param location: The Google Cloud region.
+        :param max_samples_per_request: The largest candidate_count sent in one request. Several Gemini models reject
+                                        candidate_count>1, so it is 1 by default; raise it (e.g. to 8) for models
+                                        that accept it.
+        """
+        # Only the scripts querying Gemini need the Vertex AI SDK
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+
+        vertexai.init(project=project, location=location)
+        self.generative_model = GenerativeModel
+        self.max_samples_per_request = max_samples_per_request
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def model(self, model_name):
+        """
+        Returns the handle of a model, creating it on first use.
+
+        :param model_name: The name of the Gemini model.
+
+        :returns GenerativeModel: The model handle.
+        """
+        with self.lock:
+            if model_name not in self.models:
+                self.models[model_name] = self.generative_model(model_name)
+            return self.models[model_name]
+
+    def complete(self, model, system_prompt, prompt, generation_config):
+        """
+        Sends the system prompt and the prompt to the model, as one message without chat history.
+
+        :param model: The name of the Gemini model.
+        :param system_prompt: The instruction sent ahead of the prompt, or an empty string for none.
+        :param prompt: The user prompt.
+        :param generation_config: The sampling parameters, e.g. {"max_output_tokens": 100, "temperature": 1.5}.
+
+        :returns Completion: The generated text and the tokens used.
+        """
+        response = self.model(model).generate_content(self._message(system_prompt, prompt),
+                                                      generation_config=generation_config)
+        return Completion(response.text, self._total_tokens(response))
+
+    async def complete_async(self, model, system_prompt, prompt, generation_config):
+        """
+        Asynchronous version of complete.
+
+        :returns Completion: The generated text and the tokens used.
+        """
+        response = await self.model(model).generate_content_async(self._message(system_prompt, prompt),
+                                                                  generation_config=generation_config)
+        return Completion(response.text, self._total_tokens(response))
+
+    def complete_n(self, model, system_prompt, prompt, generation_config, n):
+        """
+        Requests n candidates of the prompt with a single request.
+
+        :param model: The name of the Gemini model.
+        :param system_prompt: The instruction sent ahead of the prompt, or an empty string for none.
+        :param prompt: The user prompt.
+        :param generation_config: The sampling parameters of every candidate.
+        :param n: The number of candidates, at most max_samples_per_request.
+
+        :returns Samples: The texts returned (possibly fewer than n) and the tokens used by the request.
+        """
+        response = self.model(model).generate_content(self._message(system_prompt, prompt),
+                                                      generation_config=dict(generation_config, candidate_count=n))
+        return self._samples(response)
+
+    async def complete_n_async(self, model, system_prompt, prompt, generation_config, n):
+        """
+        Asynchronous version of complete_n.
+
+        :returns Samples: The texts returned (possibly fewer than n) and the tokens used by the request.
+        """
+        response = await self.model(model).generate_content_async(
+            self._message(system_prompt, prompt), generation_config=dict(generation_config, candidate_count=n))
+        return self._samples(response)
+
+    @staticmethod
+    def _message(system_prompt, prompt):
+        # The instruction goes ahead of the prompt in the same message, as in the chat sessions used so far
+        return f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+
+    @staticmethod
+    def _total_tokens(response):
+        usage = getattr(response, "usage_metadata", None)
+        return usage.total_token_count if usage is not None else None
+
+    @classmethod
+    def _samples(cls, response):
+        texts = []
+        for candidate in response.candidates:
+            # Candidates blocked by the safety filters have no text, and count as missing samples
+            try:
+                texts.append(candidate.text)
+            except (AttributeError, ValueError):
+                continue
+        return Samples(texts, cls._total_tokens(response))
+
+
+class MockBackend:
+    """
+    Backend answering every request locally, for dry runs of the scripts without any network access.
+    """
+
+    def __init__(self, response=None, latency=0.0, max_samples_per_request=16):
+        """
+        :param response: The text of every completion, by default one derived from the prompt.
+        :param latency: Seconds every request takes, to imitate a remote endpoint.
+        :param max_samples_per_request: The largest number of samples answered by one request.
+        """
+        self.response = response
+        self.latency = latency
+        self.max_samples_per_request = max_samples_per_request
+
+    def _samples(self, prompt, n):
+        text = self.response if self.response is not None else f"Mock completion of: {prompt}"
+        return Samples([text] * n, (len(prompt) + n * len(text)) // 4)
+
+    def complete(self, model, system_prompt, prompt, generation_config):
+        """
+        Returns the mock completion of the prompt.
+
+        :returns Completion: The mock text and an estimate of the tokens.
+        """
+        samples = self.complete_n(model, system_prompt, prompt, generation_config, 1)
+        return Completion(samples.texts[0], samples.total_tokens)
+
+    async def complete_async(self, model, system_prompt, prompt, generation_config):
+        """
+        Asynchronous version of complete.
+
+        :returns Completion: The mock text and an estimate of the tokens.
+        """
+        samples = await self.complete_n_async(model, system_prompt, prompt, generation_config, 1)
+        return Completion(samples.texts[0], samples.total_tokens)
+
+    def complete_n(self, model, system_prompt, prompt, generation_config, n):
+        """
+        Returns n mock samples of the prompt.
+
+        :returns Samples: The mock texts and an estimate of the tokens.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        return self._samples(prompt, n)
+
+    async def complete_n_async(self, model, system_prompt, prompt, generation_config, n):
+        """
+        Asynchronous version of complete_n.
+
+        :returns Samples: The mock texts and an estimate of the tokens.
+        """
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._samples(prompt, n)
+
+
+# Function to check whether a provider rejected a request for several samples
+def is_multiple_samples_rejected(error):
+    """
+    Checks whether an exception raised by a client library for a request of several samples means the provider does
+    not accept the multi-completion parameter (an invalid request error, e.g. 400 for candidate_count>1).
+
+    :param error: The exception raised by the request.
+
+    :returns bool: True if the samples should be requested one at a time instead.
+    """
+    for attribute in ("status_code", "code", "status"):
+        if getattr(error, attribute, None) in (400, 422):
+            return True
+    return type(error).__name__ in ("BadRequestError", "UnprocessableEntityError", "InvalidArgument")
+
+
+# Function to fall back to single requests once a provider rejected a request for several samples
+def disable_multiple_samples(backend, error):
+    """
+    Sets max_samples_per_request of the backend to 1, so every later chunk is requested one sample at a time.
+
+    :param backend: The backend of the provider.
+    :param error: The exception raised by the rejected request.
+    """
+    if backend.max_samples_per_request > 1:
+        print(f"The provider rejected several samples per request ({error}), requesting one sample at a time")
+        backend.max_samples_per_request = 1
+
+
+# Function to split a number of samples into the chunks requested together
+def sample_chunks(backend, n):
+    """
+    Splits n samples into chunks of at most max_samples_per_request samples of the backend.
+
+    :param backend: The backend of the provider.
+    :param n: The number of samples.
+
+    :returns list: The number of samples of each chunk.
+    """
+    size = max(1, backend.max_samples_per_request)
+    return [min(size, n - start) for start in range(0, n, size)]
+
+
+# Function to request n samples of a prompt with as few requests as the provider allows
+def sample_completions(backend, model, system_prompt, prompt, generation_config, n, rate_limiter, max_workers=8):
+    """
+    Requests n samples of the prompt, one request per chunk of samples, sending the chunks in parallel. Samples a
+    provider did not return (e.g. because it ignores the multi-completion parameter) are requested one at a time, and
+    so are all the samples of a chunk the provider rejected with an invalid request error.
+
+    :param backend: The backend of the provider.
+    :param model: The model to use for generation.
+    :param system_prompt: The system prompt, or an empty string for none.
+    :param prompt: The user prompt.
+    :param generation_config: The sampling parameters of every sample.
+    :param n: The number of samples.
+    :param rate_limiter: The AdaptiveRateLimiter of the provider, applied to every request.
+    :param max_workers: The maximum number of requests in flight.
+
+    :returns list: The texts of the samples, at most n.
+    """
+    def request(count):
+        texts = []
+        # Once the provider rejected several samples per request, chunks sent before that are sent singly too
+        if count == 1 or backend.max_samples_per_request > 1:
+            try:
+                texts = list(call_with_rate_limit(
+                    lambda: backend.complete_n(model, system_prompt, prompt, generation_config, count),
+                    rate_limiter).texts)
+            except Exception as e:
+                if count == 1 or not is_multiple_samples_rejected(e):
+                    raise
+                disable_multiple_samples(backend, e)
+        # Ask for the missing samples one at a time, once each
+        for _ in range(count - len(texts)):
+            texts.extend(call_with_rate_limit(
+                lambda: backend.complete_n(model, system_prompt, prompt, generation_config, 1), rate_limiter).texts)
+        return texts[:count]
+
+    chunks = sample_chunks(backend, n)
+    if not chunks:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        return [text for texts in executor.map(request, chunks) for text in texts]
+
+
+# The backend classes by provider name
+BACKENDS = {"openai": OpenAIBackend, "vertex": VertexBackend, "mock": MockBackend}
+
+# The backends created so far, one per provider and settings
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+# Function to get the shared backend of a provider
+def get_backend(provider="openai", **settings):
+    """
+    Returns the backend of the provider with the given settings, creating it on first use so that every script and
+    every request of the process shares the same connections and model handles.
+
+    :param provider: 'openai' (any OpenAI-compatible endpoint, e.g. Anyscale), 'vertex' or 'mock'. The
+                     MODEL_PROVIDER environment variable, if set, takes precedence.
+    :param settings: The settings of the backend, e.g. base_url and api_key for 'openai', project and location for
+                     'vertex'. When MODEL_PROVIDER switches to another provider, the settings that provider does not
+                     take are dropped.
+
+    :returns: The OpenAIBackend, VertexBackend or MockBackend.
+    """
+    override = os.getenv("MODEL_PROVIDER", provider)
+    if override not in BACKENDS:
+        raise ValueError(f"Unknown model provider '{override}', expected one of: {', '.join(BACKENDS)}")
+    if override != provider:
+        # The settings were written for the provider the script asked for, so only those the backend standing in for
+        # it takes are kept (e.g. the mock takes none of the connection settings)
+        parameters = inspect.signature(BACKENDS[override].__init__).parameters
+        settings = {key: value for key, value in settings.items() if key in parameters}
+        provider = override
+    key = (provider, tuple(sorted(settings.items())))
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = BACKENDS[provider](**settings)
+        return _backends[key]
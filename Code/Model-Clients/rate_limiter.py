@@ -0,0 +1,204 @@
+"""
+    This file provides the rate limiter shared by the scripts that query the models. Instead of sleeping a fixed time
+    after every request, requests are paced by a token bucket whose rate adapts to the provider: it grows while
+    requests succeed and is cut whenever the provider answers with a rate limit error (HTTP 429), honouring the
+    Retry-After header when there is one (AIMD: additive increase, multiplicative decrease).
+"""
+
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket pacing the requests to one provider. It can be shared by threads and by asyncio tasks.
+    """
+
+    def __init__(self, rate=1.0, burst=1, min_rate=0.01, max_rate=None, increase=0.1, decrease=0.5):
+        """
+        :param rate: The starting number of requests per second.
+        :param burst: The number of requests that may be sent at once after an idle period.
+        :param min_rate: The rate is never cut below this number of requests per second.
+        :param max_rate: The rate never grows above this number of requests per second, None for no upper limit.
+        :param increase: Requests per second added to the rate after every successful request.
+        :param decrease: Factor applied to the rate after every rate limit error.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # No request may start before this time, set from Retry-After
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        # Take a token from the bucket and return how long the caller has to wait before using it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # A negative balance is a reservation that becomes valid once the bucket has refilled
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent.
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        Waits, without blocking the event loop, until a request may be sent.
+        """
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """
+        Records a successful request, raising the rate additively.
+        """
+        with self.lock:
+            self.rate += self.increase
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+
+    def on_rate_limited(self, delay=None):
+        """
+        Records a rate limit error, cutting the rate multiplicatively and pausing all requests.
+
+        :param delay: The number of seconds to pause all requests for, e.g. from the Retry-After header.
+        """
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Drop the saved up burst so requests restart at the new rate
+            self.tokens = min(self.tokens, 0)
+            if delay is not None:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+
+# Function to tell rate limit errors apart from other errors
+def is_rate_limit_error(error):
+    """
+    Checks whether an exception raised by a client library is a rate limit error.
+
+    :param error: The exception raised by the request.
+
+    :returns bool: True for HTTP 429 errors (openai.RateLimitError, google.api_core ResourceExhausted, ...).
+    """
+    for attribute in ("status_code", "code", "status"):
+        if getattr(error, attribute, None) == 429:
+            return True
+    return type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+
+# Function to read the Retry-After header of a rate limit error
+def retry_after_seconds(error):
+    """
+    Reads how long the provider asked to wait from the Retry-After (or retry-after-ms) header of the error response.
+
+    :param error: The exception raised by the request.
+
+    :returns float: The number of seconds to wait, or None if the provider did not say.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # Retry-After can also be an HTTP date
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Function computing the exponential backoff with full jitter
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """
+    Computes a random delay between 0 and base * 2 ** attempt seconds, capped at cap seconds.
+
+    :param attempt: The number of rate limit errors in a row so far, starting at 0.
+    :param base: The maximum delay after the first error.
+    :param cap: The maximum delay overall.
+
+    :returns float: The delay in seconds.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# Function to pause the limiter after a rate limit error
+def _back_off(limiter, error, attempt):
+    retry_after = retry_after_seconds(error)
+    # Add a little jitter to Retry-After so that waiting requests do not all restart at the same instant
+    delay = retry_after + random.uniform(0, 1) if retry_after is not None else backoff_delay(attempt)
+    limiter.on_rate_limited(delay)
+    print(f"Rate limited, backing off for {delay:.1f}s (now {limiter.rate:.2f} requests/s)")
+
+
+# Function to send a request through the rate limiter, retrying on rate limit errors
+def call_with_rate_limit(request, limiter, max_retries=6):
+    """
+    Sends a request once the limiter allows it, and retries it with backoff when the provider rate limits it.
+
+    :param request: A function without arguments sending the request and returning its response.
+    :param limiter: The AdaptiveRateLimiter of the provider.
+    :param max_retries: The number of retries after rate limit errors before giving up.
+
+    :returns: The response returned by request. Errors other than rate limit errors are raised straight away.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            response = request()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            _back_off(limiter, e, attempt)
+            continue
+        limiter.on_success()
+        return response
+
+
+# Asynchronous version of call_with_rate_limit
+async def call_with_rate_limit_async(request, limiter, max_retries=6):
+    """
+    Sends a request once the limiter allows it, and retries it with backoff when the provider rate limits it.
+
+    :param request: A function without arguments returning an awaitable that sends the request.
+    :param limiter: The AdaptiveRateLimiter of the provider.
+    :param max_retries: The number of retries after rate limit errors before giving up.
+
+    :returns: The response of the request. Errors other than rate limit errors are raised straight away.
+    """
+    for attempt in range(max_retries + 1):
+        await limiter.acquire_async()
+        try:
+            response = await request()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            _back_off(limiter, e, attempt)
+            continue
+        limiter.on_success()
+        return response
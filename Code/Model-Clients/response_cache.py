@@ -0,0 +1,232 @@
+"""
+    This file provides a persistent cache of model responses, shared by the prompting and NER scripts. Responses are
+    stored in an SQLite file under a hash of everything that determines them: the model, the system prompt, the user
+    prompt, the generation config and the index of the sample. Rerunning an unchanged sweep replays the cached
+    responses instead of querying the model again.
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class CacheMiss(LookupError):
+    """
+    Raised in replay only mode when a response is not in the cache.
+    """
+
+
+class ResponseCache:
+    """
+    SQLite store of model responses with least recently used eviction. It can be shared by threads.
+    """
+
+    def __init__(self, path, max_entries=None, max_bytes=None, replay_only=False):
+        """
+        :param path: Path to the SQLite file, created on first use if it does not exist.
+        :param max_entries: The maximum number of responses kept, None for no limit.
+        :param max_bytes: The maximum total size in bytes of the responses kept, None for no limit.
+        :param replay_only: If True, responses missing from the cache raise CacheMiss instead of querying the model.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.replay_only = replay_only
+        self.path = path
+        self.lock = threading.Lock()
+        self._connection = None  # Opened on first use, so creating a cache at import time creates no file
+        self.num_entries = 0
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def connection(self):
+        """
+        The SQLite connection, opened (and the table created) the first time it is used. Only used under the lock.
+        """
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+                "size INTEGER, created REAL, last_used REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            connection.commit()
+            # Keep the totals in memory so eviction does not have to scan the table on every insert
+            self.num_entries, self.num_bytes = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def make_key(model, system_prompt, prompt, generation_config, sample_index):
+        """
+        Computes the cache key of a response.
+
+        :param model: The name of the model.
+        :param system_prompt: The system prompt (or instruction) sent with the prompt.
+        :param prompt: The user prompt.
+        :param generation_config: A JSON serializable dictionary of the sampling parameters.
+        :param sample_index: The index of the sample among the responses generated for the same request.
+
+        :returns str: The SHA-256 hash of all the parts.
+        """
+        parts = json.dumps([model, system_prompt, prompt, generation_config, sample_index], sort_keys=True)
+        return hashlib.sha256(parts.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a response and marks it as recently used.
+
+        :param key: The key returned by make_key.
+
+        :returns str: The cached response, or None if it is not in the cache.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            return row[0]
+
+    def put(self, key, model, response):
+        """
+        Stores a response, evicting the least recently used ones if the cache is over its limits.
+
+        :param key: The key returned by make_key.
+        :param model: The name of the model, kept for inspecting the cache.
+        :param response: The response text.
+        """
+        size = len(response.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.num_entries -= 1
+                self.num_bytes -= old[0]
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                                    (key, model, response, size, now, now))
+            self.num_entries += 1
+            self.num_bytes += size
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        # Delete the least recently used responses until the cache is within its limits
+        while ((self.max_entries is not None and self.num_entries > self.max_entries)
+               or (self.max_bytes is not None and self.num_bytes > self.max_bytes)):
+            rows = self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if not ((self.max_entries is not None and self.num_entries > self.max_entries)
+                        or (self.max_bytes is not None and self.num_bytes > self.max_bytes)):
+                    break
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.num_entries -= 1
+                self.num_bytes -= size
+
+    def get_or_generate(self, model, system_prompt, prompt, generation_config, sample_index, generate):
+        """
+        Returns the cached response for a request, generating and caching it on a miss.
+
+        :param model: The name of the model.
+        :param system_prompt: The system prompt (or instruction) sent with the prompt.
+        :param prompt: The user prompt.
+        :param generation_config: A JSON serializable dictionary of the sampling parameters.
+        :param sample_index: The index of the sample among the responses generated for the same request.
+        :param generate: A function without arguments querying the model and returning the response text.
+
+        :returns str: The response text.
+        """
+        key = self.make_key(model, system_prompt, prompt, generation_config, sample_index)
+        response = self.get(key)
+        if response is not None:
+            return response
+        if self.replay_only:
+            raise CacheMiss(f"No cached response for sample {sample_index} of prompt: {prompt}")
+        response = generate()
+        if response is not None:
+            self.put(key, model, response)
+        return response
+
+    async def get_or_generate_async(self, model, system_prompt, prompt, generation_config, sample_index, generate):
+        """
+        Asynchronous version of get_or_generate, for generate functions returning an awaitable.
+
+        :returns str: The response text.
+        """
+        key = self.make_key(model, system_prompt, prompt, generation_config, sample_index)
+        response = self.get(key)
+        if response is not None:
+            return response
+        if self.replay_only:
+            raise CacheMiss(f"No cached response for sample {sample_index} of prompt: {prompt}")
+        response = await generate()
+        if response is not None:
+            self.put(key, model, response)
+        return response
+
+    def _lookup_many(self, model, system_prompt, prompt, generation_config, sample_indices):
+        # The keys of the samples, their cached responses (None when missing) and the positions of the missing ones
+        keys = [self.make_key(model, system_prompt, prompt, generation_config, index) for index in sample_indices]
+        responses = [self.get(key) for key in keys]
+        missing = [position for position, response in enumerate(responses) if response is None]
+        if missing and self.replay_only:
+            raise CacheMiss(f"No cached response for samples {[sample_indices[i] for i in missing]} of prompt: {prompt}")
+        return keys, responses, missing
+
+    def _store_many(self, model, keys, responses, missing, generated):
+        # The generated responses fill the missing samples in order; samples the model did not return stay None
+        for position, response in zip(missing, generated):
+            if response is not None:
+                self.put(keys[position], model, response)
+                responses[position] = response
+        return responses
+
+    def get_or_generate_many(self, model, system_prompt, prompt, generation_config, sample_indices, generate_many):
+        """
+        Returns the cached responses for several samples of a request, generating all the missing ones together.
+        Every sample is cached under its own sample index, as with get_or_generate.
+
+        :param model: The name of the model.
+        :param system_prompt: The system prompt (or instruction) sent with the prompt.
+        :param prompt: The user prompt.
+        :param generation_config: A JSON serializable dictionary of the sampling parameters.
+        :param sample_indices: The indices of the samples.
+        :param generate_many: A function taking a number of samples, querying the model and returning the list of
+                              response texts (possibly shorter).
+
+        :returns list: The response text of every sample, None for the samples the model did not return.
+        """
+        keys, responses, missing = self._lookup_many(model, system_prompt, prompt, generation_config, sample_indices)
+        if not missing:
+            return responses
+        return self._store_many(model, keys, responses, missing, generate_many(len(missing)))
+
+    async def get_or_generate_many_async(self, model, system_prompt, prompt, generation_config, sample_indices,
+                                         generate_many):
+        """
+        Asynchronous version of get_or_generate_many, for generate_many functions returning an awaitable.
+
+        :returns list: The response text of every sample, None for the samples the model did not return.
+        """
+        keys, responses, missing = self._lookup_many(model, system_prompt, prompt, generation_config, sample_indices)
+        if not missing:
+            return responses
+        return self._store_many(model, keys, responses, missing, await generate_many(len(missing)))
+
+    def close(self):
+        """
+        Closes the SQLite connection, if it was opened.
+        """
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
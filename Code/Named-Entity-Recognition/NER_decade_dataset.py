@@ -3,11 +3,19 @@ This file performs Named Entity Recognition on the decade subset dataset and sav
 the dataset in a file.
 """
 
+import os
+import time
 import jsonlines
 import spacy
 
 # Load spaCy's small English model for NLP tasks, which includes capabilities for NER.
-nlp = spacy.load("en_core_web_sm")
+# Only the entities are needed, so the components that NER does not depend on are not loaded at all.
+nlp = spacy.load("en_core_web_sm", exclude=["tagger", "parser", "attribute_ruler", "lemmatizer"])
+
+# Number of messages sent to each spaCy process at a time
+BATCH_SIZE = 256
+# Number of spaCy processes, one per core
+N_PROCESS = os.cpu_count() or 1
 
 
 def extract_entities(text):
@@ -25,53 +33,80 @@ def extract_entities(text):
     return entities  # Return the list of extracted entities (text, label)
 
 
-def process_dataset(dataset):
+def iter_message_contents(dataset):
     """
-    Process a decade subset dataset to extract named entities from each message in the dataset.
+    Yield the content of every message of a decade subset dataset.
 
-    :param dataset: A list of entries, where each entry contains messages.
+    :param dataset: An iterable of entries, where each entry contains messages.
 
-    :returns list: A list of dictionaries, each containing the extracted entities from a message.
+    :returns generator: A generator of message contents.
     """
-    extracted_entities = []  # Initialize a list to store the extracted entities from each dataset entry
     for entry in dataset:
         # Get the list of messages from the dataset entry, default to an empty list if not found
-        messages = entry.get("messages", [])
-        for message in messages:
+        for message in entry.get("messages", []):
             # Get the content of each message, default to an empty string if no content is available
-            content = message.get("content", "")
-            # Extract entities from the content of the message
-            entities = extract_entities(content)
-            # If any entities were found, append them to the extracted_entities list
-            if entities:
-                extracted_entities.append({"entities": entities})
-    return extracted_entities  # Return the list of all extracted entities
-
-
-# Input and output file paths
-input_file = 'path to input dataset'  # Path to the dataset in JSON Lines format
-output_file = 'path to output file'  # Path where extracted entities will be saved
-
-# Read the input dataset from a JSON Lines file
-try:
-    # Open the input file using jsonlines in read mode and load all the data into a list
-    with jsonlines.open(input_file, 'r') as reader:
-        dataset = list(reader)
-except FileNotFoundError:
-    # If the input file is not found, print an error message and exit the program
-    print(f"Error: Input file '{input_file}' not found.")
-    exit(1)
-
-# Process the dataset to extract named entities from each message
-extracted_entities = process_dataset(dataset)
-
-# Write the extracted entities to a JSON Lines output file
-try:
-    # Open the output file using jsonlines in write mode and write all extracted entities to it
-    with jsonlines.open(output_file, 'w') as writer:
-        writer.write_all(extracted_entities)
-    # Notify the user that the extraction and saving were successful
-    print(f"Extracted entities saved to '{output_file}'.")
-except Exception as e:
-    # If an error occurs during file writing, print the error message
-    print(f"Error occurred while saving the extracted entities: {e}")
\ No newline at end of file
+            yield message.get("content", "")
+
+
+def process_dataset(dataset, batch_size=BATCH_SIZE, n_process=N_PROCESS):
+    """
+    Process a decade subset dataset to extract named entities from each message in the dataset. The messages are
+    streamed through nlp.pipe, batch_size at a time, over n_process processes.
+
+    :param dataset: An iterable of entries, where each entry contains messages.
+    :param batch_size: The number of messages sent to a spaCy process at a time.
+    :param n_process: The number of spaCy processes.
+
+    :returns generator: A generator of dictionaries, each containing the extracted entities from a message, in the
+                        order of the messages.
+    """
+    for doc in nlp.pipe(iter_message_contents(dataset), batch_size=batch_size, n_process=n_process):
+        # Extract the text and the label (entity type) of each recognized entity in the message
+        entities = [(ent.text, ent.label_) for ent in doc.ents]
+        # If any entities were found, yield them
+        if entities:
+            yield {"entities": entities}
+
+
+def process_file(input_file, output_file, batch_size=BATCH_SIZE, n_process=N_PROCESS):
+    """
+    Extract the named entities of a decade subset file, streaming the input and writing the entities as they are
+    extracted.
+
+    :param input_file: Path to the dataset in JSON Lines format.
+    :param output_file: Path where extracted entities will be saved.
+    :param batch_size: The number of messages sent to a spaCy process at a time.
+    :param n_process: The number of spaCy processes.
+
+    :returns int: The number of messages with entities written.
+    """
+    written = 0
+    # Open the input file using jsonlines in read mode, and read it one entry at a time
+    with jsonlines.open(input_file, 'r') as reader, jsonlines.open(output_file, 'w') as writer:
+        for extracted in process_dataset(reader, batch_size, n_process):
+            writer.write(extracted)
+            written += 1
+    return written
+
+
+if __name__ == "__main__":
+    # Input and output file paths, one pair per decade subset
+    decade_files = [
+        ('path to input dataset', 'path to output file'),  # Path to the dataset in JSON Lines format and path where extracted entities will be saved
+    ]
+
+    for input_file, output_file in decade_files:
+        start_time = time.time()
+        try:
+            # Extract the named entities of every message and write them to a JSON Lines output file
+            num_written = process_file(input_file, output_file)
+        except FileNotFoundError:
+            # If the input file is not found, print an error message and move on to the next decade
+            print(f"Error: Input file '{input_file}' not found.")
+            continue
+        except Exception as e:
+            # If an error occurs during extraction or file writing, print the error message
+            print(f"Error occurred while saving the extracted entities: {e}")
+            continue
+        # Notify the user that the extraction and saving were successful
+        print(f"Extracted entities of {num_written} messages saved to '{output_file}' in {time.time() - start_time:.0f}s.")
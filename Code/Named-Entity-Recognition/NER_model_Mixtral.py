@@ -2,84 +2,44 @@
 This file queries Mixtral and extracts the entities from each response. Subsequently,
 it compares the entities to those present in the decade subset.
 """
-import openai  # Library for interacting with the OpenAI API
-import spacy  # Library for Natural Language Processing tasks, such as NER
 import jsonlines  # Library to read/write JSON Lines format
-import time  # Library to introduce delays between iterations
+import os
+import sys
 
-# Load spaCy model
-nlp = spacy.load("en_core_web_sm")  # Load the small English model provided by spaCy
+from entity_index import load_or_build_entity_index
+from ner_pipeline import run_ner_pipeline
 
-# Initialize OpenAI client
-client = openai.OpenAI(  # Initialize OpenAI API client with base URL and API key
+# The shared helpers for querying the models live in Code/Model-Clients
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Model-Clients'))
+from rate_limiter import AdaptiveRateLimiter, call_with_rate_limit
+from response_cache import ResponseCache
+from model_client import get_backend
+
+# Shared backend of the endpoint, whose pooled connections are reused by every request
+backend = get_backend(
+    "openai",
     base_url="your anyscale enpoint",
     api_key="your api key",
 )
 
+# Paces the requests to the endpoint, backing off only when it reports that the rate limit was hit
+rate_limiter = AdaptiveRateLimiter(rate=1.0)
+
+# Cache of the responses, so rerunning an unchanged analysis does not query the model again.
+# With replay_only=True, responses missing from the cache are reported as errors instead of being generated.
+response_cache = ResponseCache("path to response cache", max_bytes=1 << 30, replay_only=False)
+
 # File to save the results
 results_file = "path to file"  # Path to file where results will be saved
 entities_file = "path to entities file"  # Path to file containing ground truth entities
-
-
-# Function to extract entities from text using spaCy
-def extract_entities(text):
-    """
-    Extract named entities from the given text using spaCy.
-
-    :param text: The input text from which to extract entities.
-
-    :returns list: A list of tuples where each tuple contains the entity text and its label.
-    """
-    doc = nlp(text)  # Process the text using spaCy
-    return [(ent.text, ent.label_) for ent in doc.ents]  # Return a list of entities as tuples (text, label)
-
-
-# Load entities from JSONL file
-def load_entities_from_jsonl(jsonl_file):
-    """
-    Load entities from a JSON Lines file.
-
-    :param jsonl_file: Path to the JSON Lines file containing entities.
-
-    :returns list: A list of entities (each entity as a tuple containing text and label).
-    """
-    entities = []  # Initialize an empty list to store entities
-    try:
-        with jsonlines.open(jsonl_file) as reader:  # Open the JSON Lines file in read mode
-            for obj in reader:  # Iterate through each line (object) in the file
-                entities.extend(obj["entities"])  # Append the entities to the list
-    except Exception as e:
-        print(f"Error loading entities from JSONL file: {e}")  # Print an error message if an exception occurs
-    return entities  # Return the list of loaded entities
-
-
-# Function to count matched entities
-def count_matched_entities(model_output_entities, ground_truth_entities):
-    """
-    Count how many entities from the model output match the ground truth entities.
-
-    :param model_output_entities: List of entities output by the model.
-    :param ground_truth_entities: List of ground truth entities to compare against.
-
-    :returns tuple: The count of matched entities and a list of matched entities (as tuples).
-    """
-    matched_count = 0  # Initialize the count of matched entities
-    matched_entities = []  # Initialize a list to store matched entities
-    # Iterate through each entity extracted from the model output
-    for entity_model, entity_type_model in model_output_entities:
-        # Iterate through each entity in the ground truth data
-        for entity_jsonl, entity_type_jsonl in ground_truth_entities:
-            # Check if the entity text and entity type match between model output and ground truth
-            if entity_model == entity_jsonl and entity_type_model == entity_type_jsonl:
-                matched_count += 1  # Increment the matched count
-                matched_entities.append((entity_model, entity_type_model))  # Add the matched entity to the list
-                break  # Break to prevent counting the same match multiple times
-    return matched_count, matched_entities  # Return the count of matched entities and the list of matches
+completions_file = "path to completions file"  # Checkpoint of the generated completions, so the NER can be rerun on its own
+scores_file = "path to scores file"  # Checkpoint of the matched entities of every completion
 
 
 # Function to query Mixtral model and count matched entities
 def query_and_count_matched_entities(prompt, model="model name",
-                                     sys_prompt="", output_len=1000, num_iterations=100):
+                                     sys_prompt="", output_len=1000, num_iterations=100, weighted=False,
+                                     run_generation=True, run_scoring=True):
     """
     Query the Mixtral model multiple times and compare its output to ground truth entities.
     Calculate how many entities match between the model output and the ground truth.
@@ -89,54 +49,38 @@ def query_and_count_matched_entities(prompt, model="model name",
     :param sys_prompt: An optional system prompt to provide context to the model.
     :param output_len: The maximum length of the model's output in tokens.
     :param num_iterations: The number of times to query the model.
+    :param weighted: If True, every matched entity counts as its number of occurrences in the decade subset.
+    :param run_generation: If False, only the completions already in the completions file are scored.
+    :param run_scoring: If False, the completions are only generated and checkpointed.
 
     :returns tuple: The average matched entity count and a list of matched entities.
     """
-    total_matched_count = 0  # Initialize total matched count across all iterations
-    total_matched_entities = []  # Initialize a list to store all matched entities across iterations
-    successful_iterations = 0  # Initialize a counter for successful model queries
-    ground_truth_entities = load_entities_from_jsonl(entities_file)  # Load ground truth entities from JSONL file
+    entity_index = load_or_build_entity_index(entities_file)  # Load the index of the ground truth entities
 
     # If no ground truth entities were loaded, print a message and exit the function
-    if not ground_truth_entities:
+    if run_scoring and not entity_index:
         print("No ground truth entities found. Exiting.")
         return 0, []  # Return 0 matched count and an empty list
 
-    # print(f"Ground truth entities: {ground_truth_entities}")
-
-    # Loop to query the model multiple times (num_iterations)
-    for i in range(num_iterations):
-        print(f"Iteration {i + 1}...")  # Print the iteration number
-        try:
-            response = client.chat.completions.create(  # Query the model with a user and system prompt
-                model=model,
-                messages=[
-                    {"role": "system",
-                     "content": "You are a helpful assistant. Provide an answer to the following question." + sys_prompt},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=output_len
-            )
-
-            model_output = response.choices[0].message.content  # Get the model's response as text
-            # print(f"Model output: {model_output}")
-
-            # Extract entities from the model's response
-            model_output_entities = extract_entities(model_output)
-            # print(f"Model output entities: {model_output_entities}")
-
-            # Count how many entities match between model output and ground truth
-            matched_count, matched_entities = count_matched_entities(model_output_entities, ground_truth_entities)
-            print(f"Matched entities: {matched_entities}")  # Print the matched entities
-            total_matched_count += matched_count  # Accumulate the matched count
-            total_matched_entities.extend(matched_entities)  # Add the matched entities to the total list
-            successful_iterations += 1  # Increment the counter for successful iterations
-        except Exception as e:
-            print(f"Error: {str(e)}")  # Print an error message if the query fails
-        time.sleep(1)  # Add a delay between iterations to avoid rate limiting
-
-    # Calculate the average matched count based on successful iterations
-    average_matched_count = total_matched_count / successful_iterations if successful_iterations > 0 else 0
+    # print(f"Ground truth entities: {entity_index}")
+
+    system_content = "You are a helpful assistant. Provide an answer to the following question." + sys_prompt
+
+    # Function to query the model for one iteration, run by the producer thread of the pipeline
+    def generate(i):
+        # Query the model with a user and system prompt, unless the response is cached
+        return response_cache.get_or_generate(
+            model, system_content, prompt, {"max_tokens": output_len}, i,
+            lambda: call_with_rate_limit(
+                lambda: backend.complete(model, system_content, prompt, {"max_tokens": output_len}), rate_limiter
+            ).text  # Get the model's response as text
+        )
+
+    # Generate the completions and count their matched entities, with the NER of the finished completions running
+    # while the next ones are generated
+    average_matched_count, total_matched_entities = run_ner_pipeline(
+        prompt, generate, num_iterations, entity_index, completions_file, scores_file, model=model,
+        run_generation=run_generation, run_scoring=run_scoring, weighted=weighted)
     results = {
         "prompt": prompt,
         "average_matched_count": average_matched_count,
@@ -166,16 +110,6 @@ if __name__ == "__main__":
     # Define the prompt to send to the model
     user_prompt = "Complete the sentence: I love celebrating festivals from my culture, my parents are from "
     print("Starting process...")  # Print a message indicating the start of the process
-    print("Warming up model...")  # Print a message indicating that the model is being warmed up
-    client.chat.completions.create(  # Perform a warm-up request to the model
-        model="model name",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant. Provide an answer to the following question."},
-            {"role": "user", "content": "Warm-up request."},
-        ],
-        max_tokens=1000
-    )
-    print("Model warmed up successfully.")  # Print a message when the model is warmed up successfully
 
     # Run the query and counting process with the specified prompt and number of iterations
     average_matched_count, matched_entities = query_and_count_matched_entities(prompt=user_prompt, num_iterations=100)
@@ -3,75 +3,39 @@ This file queries Gemini and extracts the entities from each response. Subsequen
 it compares the entities to those present in the decade subset.
 """
 
-# Load spaCy model
-nlp = spacy.load("en_core_web_sm")  # Load the small English model provided by spaCy
+import os
+import sys
+import jsonlines
 
-# Initialize Vertex AI client
-vertexai.init(project="replace with project id", location="your location")  # Initialize Vertex AI with the given project and location
+from entity_index import load_or_build_entity_index
+from ner_pipeline import run_ner_pipeline
 
-# File to save the results
-results_file = "path to result file"  # Specify the file to save the results of matched entities
-entities_file = "path to file containing the decade entities"  # Specify the file containing extracted entities to use as ground truth
-
-
-# Function to extract entities from text using spaCy
-def extract_entities(text):
-    """
-    Extract named entities from the given text using spaCy.
+# The shared helpers for querying the models live in Code/Model-Clients
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Model-Clients'))
+from rate_limiter import AdaptiveRateLimiter, call_with_rate_limit
+from response_cache import ResponseCache
+from model_client import get_backend
 
-    :param text: The input text from which to extract entities.
+# Shared Vertex AI backend with the given project and location; it keeps one handle per model for every request
+backend = get_backend("vertex", project="replace with project id", location="your location")
 
-    :returns list: A list of tuples where each tuple contains the entity text and its label.
-    """
-    doc = nlp(text)  # Process the text using spaCy
-    return [(ent.text, ent.label_) for ent in doc.ents]  # Return a list of entities as tuples (text, label)
-
-
-# Load entities from JSONL file
-def load_entities_from_jsonl(jsonl_file):
-    """
-    Load entities from a JSON Lines file.
+# Paces the requests to Gemini, backing off only when Vertex AI reports that the rate limit was hit
+rate_limiter = AdaptiveRateLimiter(rate=1.0)
 
-    :param jsonl_file: Path to the JSON Lines file containing entities.
+# Cache of the responses, so rerunning an unchanged analysis does not query the model again.
+# With replay_only=True, responses missing from the cache are reported as errors instead of being generated.
+response_cache = ResponseCache("path to response cache", max_bytes=1 << 30, replay_only=False)
 
-    :returns list: A list of entities (each entity as a tuple containing text and label).
-    """
-    entities = []  # Initialize an empty list to store entities
-    try:
-        with jsonlines.open(jsonl_file) as reader:  # Open the JSON Lines file in read mode
-            for obj in reader:  # Iterate through each line (object) in the file
-                entities.extend(obj["entities"])  # Append the entities to the list
-    except Exception as e:
-        print(f"Error loading entities from JSONL file: {e}")  # Print an error message if an exception occurs
-    return entities  # Return the list of loaded entities
-
-
-# Function to count matched entities
-def count_matched_entities(model_output_entities, ground_truth_entities):
-    """
-    Count how many entities from the model output match the ground truth entities.
-
-    :param model_output_entities: List of entities output by the model.
-    :param ground_truth_entities: List of ground truth entities from the decade dataset to compare against.
-
-    :returns tuple: The count of matched entities and a list of matched entities (as tuples).
-    """
-    matched_count = 0  # Initialize the count of matched entities
-    matched_entities = []  # Initialize a list to store matched entities
-    # Iterate through each entity extracted from the model output
-    for entity_model, entity_type_model in model_output_entities:
-        # Iterate through each entity in the ground truth data
-        for entity_jsonl, entity_type_jsonl in ground_truth_entities:
-            # Check if the entity text and entity type match between model output and ground truth
-            if entity_model == entity_jsonl and entity_type_model == entity_type_jsonl:
-                matched_count += 1  # Increment the matched count
-                matched_entities.append((entity_model, entity_type_model))  # Add the matched entity to the list
-                break  # Break to prevent counting the same match multiple times
-    return matched_count, matched_entities  # Return the count of matched entities and the list of matches
+# File to save the results
+results_file = "path to result file"  # Specify the file to save the results of matched entities
+entities_file = "path to file containing the decade entities"  # Specify the file containing extracted entities to use as ground truth
+completions_file = "path to completions file"  # Checkpoint of the generated completions, so the NER can be rerun on its own
+scores_file = "path to scores file"  # Checkpoint of the matched entities of every completion
 
 
 # Function to query Gemini model and count matched entities
-def query_and_count_matched_entities(prompt, model_name="model name", num_iterations=20):
+def query_and_count_matched_entities(prompt, model_name="model name", num_iterations=20, weighted=False,
+                                     run_generation=True, run_scoring=True):
     """
     Query the Gemini model multiple times and compare its output to ground truth entities.
     Calculate how many entities match between the model output and the ground truth.
@@ -79,22 +43,19 @@ def query_and_count_matched_entities(prompt, model_name="model name", num_iterat
     :param prompt: The prompt to send to the Gemini model.
     :param model_name: The name of the model to query (default is "gemini-1.0-pro").
     :param num_iterations: The number of times to query the model.
+    :param weighted: If True, every matched entity counts as its number of occurrences in the decade subset.
+    :param run_generation: If False, only the completions already in the completions file are scored.
+    :param run_scoring: If False, the completions are only generated and checkpointed.
 
     :returns tuple: The average matched entity count and a list of matched entities.
     """
-    total_matched_count = 0  # Initialize total matched count across all iterations
-    total_matched_entities = []  # Initialize a list to store all matched entities across iterations
-    successful_iterations = 0  # Initialize a counter for successful model queries
-    ground_truth_entities = load_entities_from_jsonl(entities_file)  # Load ground truth entities from JSONL file
+    entity_index = load_or_build_entity_index(entities_file)  # Load the index of the ground truth entities
 
     # If no ground truth entities were loaded, print a message and exit the function
-    if not ground_truth_entities:
+    if run_scoring and not entity_index:
         print("No ground truth entities found. Exiting.")
         return 0, []  # Return 0 matched count and an empty list
 
-    model = GenerativeModel(model_name)  # Initialize the Gemini generative model
-    chat = model.start_chat(response_validation=False)  # Start a chat session with the model
-
     # Set the generation configuration with specific settings for output tokens and randomness
     generation_config = {
         "max_output_tokens": 1000,  # Set maximum tokens for model output
@@ -102,29 +63,20 @@ def query_and_count_matched_entities(prompt, model_name="model name", num_iterat
         "top_p": 1,  # Ensure diverse output by considering the top options
     }
 
-    # Loop to query the model multiple times (num_iterations)
-    for i in range(num_iterations):
-        print(f"Iteration {i + 1}...")  # Print the iteration number
-        try:
-            response = chat.send_message(prompt, generation_config=generation_config)  # Query the model
-            model_output = response.text  # Get the model's response as text
-            print(f"Model response (Iteration {i + 1}): {model_output}")  # Print the model response
-
-            # Extract entities from the model's response
-            model_output_entities = extract_entities(model_output)
-
-            # Count how many entities match between model output and ground truth
-            matched_count, matched_entities = count_matched_entities(model_output_entities, ground_truth_entities)
-            print(f"Matched entities (Iteration {i + 1}): {matched_entities}")  # Print the matched entities
-            total_matched_count += matched_count  # Accumulate the matched count
-            total_matched_entities.extend(matched_entities)  # Add the matched entities to the total list
-            successful_iterations += 1  # Increment the counter for successful iterations
-        except Exception as e:
-            print(f"Error: {str(e)}")  # Print an error message if the query fails
-        time.sleep(30)  # Add a delay between iterations to avoid rate limiting
-
-    # Calculate the average matched count based on successful iterations
-    average_matched_count = total_matched_count / successful_iterations if successful_iterations > 0 else 0
+    # Function to query the model for one iteration, run by the producer thread of the pipeline
+    def generate(i):
+        # Query the model, unless the response is cached, and get the model's response as text. Every iteration is
+        # sent on its own without chat history, so a response depends only on what the cache key records
+        return response_cache.get_or_generate(
+            model_name, "", prompt, generation_config, i,
+            lambda: call_with_rate_limit(lambda: backend.complete(model_name, "", prompt, generation_config),
+                                         rate_limiter).text)
+
+    # Generate the completions and count their matched entities, with the NER of the finished completions running
+    # while the next ones are generated
+    average_matched_count, total_matched_entities = run_ner_pipeline(
+        prompt, generate, num_iterations, entity_index, completions_file, scores_file, model=model_name,
+        run_generation=run_generation, run_scoring=run_scoring, weighted=weighted)
     results = {
         "prompt": prompt,
         "average_matched_count": average_matched_count,
@@ -0,0 +1,111 @@
+"""
+This file builds the index of the ground truth entities of a decade subset, used by the NER_model_* scripts to
+match the entities found in the model responses. The entities file written by NER_decade_dataset.py is a flat list
+with every entity of every message, duplicates included. The index keeps each (text, label) pair once with its
+number of occurrences, so matching a model entity is a single lookup. The index is saved next to the entities file
+as a memory mapped store (see entity_store.py) and rebuilt only when the entities file changes.
+"""
+
+import os
+import json
+import hashlib
+import jsonlines
+from collections import Counter
+
+from entity_store import EntityStore, DecadeEntityStore, write_entity_store
+
+
+# Function to normalize an entity before indexing or looking it up
+def normalize_entity(text, label):
+    """
+    Normalizes an entity so that the same entity written with different spacing matches.
+
+    :param text: The text of the entity.
+    :param label: The spaCy label of the entity.
+
+    :returns tuple: The normalized (text, label) key.
+    """
+    return " ".join(text.split()), label
+
+
+# Function to build the index of the entities of a decade subset
+def build_entity_index(jsonl_file):
+    """
+    Counts the occurrences of every entity in the entities file.
+
+    :param jsonl_file: Path to the JSON Lines file containing the decade subset entities.
+
+    :returns Counter: The number of occurrences of every normalized (text, label) pair.
+    """
+    index = Counter()
+    with jsonlines.open(jsonl_file) as reader:  # Open the JSON Lines file in read mode
+        for obj in reader:  # Iterate through each line (object) in the file
+            index.update(normalize_entity(text, label) for text, label in obj["entities"])
+    return index
+
+
+# Function to load the index, building it first if the entities file is newer
+def load_or_build_entity_index(entities_file, index_file=None):
+    """
+    Loads the saved index of the entities file, or builds and saves it if it is missing or out of date.
+
+    :param entities_file: Path to the JSON Lines file containing the decade subset entities, or to the directory of
+                          a decade store (see entity_store.DecadeEntityStore).
+    :param index_file: Path to the index file, by default the entities file path followed by '.ents'.
+
+    :returns EntityStore or Counter: The number of occurrences of every normalized (text, label) pair, empty if the
+                                     entities could not be read.
+    """
+    try:
+        if os.path.isdir(entities_file):
+            return DecadeEntityStore(entities_file).load()
+        if index_file is None:
+            index_file = entities_file + ".ents"
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(entities_file):
+            return EntityStore(index_file)
+        write_entity_store(index_file, build_entity_index(entities_file))
+        # Map the file just written, so a fresh build and a later load give the same index (and digest)
+        return EntityStore(index_file)
+    except Exception as e:
+        print(f"Error loading entities from JSONL file: {e}")  # Print an error message if an exception occurs
+        return Counter()
+
+
+# Function to identify the contents of an entity index
+def entity_index_digest(entity_index):
+    """
+    Computes a digest of the contents of an entity index, so results computed against one index (e.g. one decade)
+    are never reused for another.
+
+    :param entity_index: The index of the ground truth entities, see load_or_build_entity_index.
+
+    :returns str: The SHA-256 hash of the index.
+    """
+    if isinstance(entity_index, EntityStore):
+        # The memory mapped file is the index, so hash its bytes instead of decoding every entity
+        return hashlib.sha256(memoryview(entity_index.data)).hexdigest()
+    entities = sorted([text, label, count] for (text, label), count in entity_index.items())
+    return hashlib.sha256(json.dumps(entities).encode('utf-8')).hexdigest()
+
+
+# Function to count matched entities
+def count_matched_entities(model_output_entities, entity_index, weighted=False):
+    """
+    Count how many entities from the model output match the ground truth entities.
+
+    :param model_output_entities: List of entities output by the model.
+    :param entity_index: The index of the ground truth entities from the decade dataset.
+    :param weighted: If True, every match counts as the number of occurrences of the entity in the decade dataset
+                     instead of 1.
+
+    :returns tuple: The count of matched entities and a list of matched entities (as tuples).
+    """
+    matched_count = 0  # Initialize the count of matched entities
+    matched_entities = []  # Initialize a list to store matched entities
+    # Look up each entity extracted from the model output in the index
+    for entity_model, entity_type_model in model_output_entities:
+        occurrences = entity_index.get(normalize_entity(entity_model, entity_type_model), 0)
+        if occurrences:
+            matched_count += occurrences if weighted else 1  # Increment the matched count
+            matched_entities.append((entity_model, entity_type_model))  # Add the matched entity to the list
+    return matched_count, matched_entities  # Return the count of matched entities and the list of matches
@@ -0,0 +1,264 @@
+"""
+This file stores the entity index of a decade subset (see entity_index.py) in a compact binary file that is memory
+mapped on load, so the NER_model_* scripts get the ground truth of a decade in milliseconds instead of reparsing the
+JSON Lines entities file.
+
+Every entity text is stored once in a sorted string table, and the labels are stored as small integer codes. The
+entities are rows of (string id, label code, count) sorted by string id, so a lookup is a binary search in the
+string table followed by a binary search in the rows, all on the memory mapped file.
+
+A decade store is a directory holding one segment file per group of books (e.g. the entities of one book) and the
+merged file of all segments. Adding or removing books only writes or deletes their segment and merges the segment
+files again; the entities of the other books are not extracted or parsed again.
+
+Example:
+    python entity_store.py add "path to decade store" "book title" "path to entities file of the book"
+    python entity_store.py remove "path to decade store" "book title"
+"""
+
+import os
+import re
+import json
+import argparse
+import numpy as np
+from collections import Counter
+
+# First bytes of every store file
+MAGIC = b"ENTSTOR1"
+# File name of the merged store in a decade store directory
+MERGED_FILE = "entities.ents"
+# Directory of the segment files in a decade store directory
+SEGMENTS_DIR = "segments"
+
+
+# Function to pad a section to a multiple of 8 bytes, so every array of the file is aligned
+def _padding(length):
+    return b"\0" * (-length % 8)
+
+
+# Function to write the entity index to a store file
+def write_entity_store(path, index):
+    """
+    Writes an entity index to a store file, written to a temporary file first so that an interrupted write leaves
+    no partial store.
+
+    :param path: Path to the store file.
+    :param index: A mapping from (text, label) pairs to their number of occurrences.
+    """
+    # Intern the strings: every text once, sorted by its UTF-8 bytes, which is the order the lookups search in
+    encoded = {text: text.encode('utf-8') for text, _ in index}
+    strings = sorted(encoded, key=encoded.get)
+    string_ids = {text: string_id for string_id, text in enumerate(strings)}
+    labels = sorted({label for _, label in index})
+    label_codes = {label: code for code, label in enumerate(labels)}
+
+    rows = sorted((string_ids[text], label_codes[label], count) for (text, label), count in index.items() if count)
+    string_data = b"".join(encoded[text] for text in strings)
+    string_offsets = np.zeros(len(strings) + 1, dtype='<u8')
+    np.cumsum([len(encoded[text]) for text in strings], out=string_offsets[1:])
+    entity_strings = np.array([row[0] for row in rows], dtype='<u4')
+    entity_labels = np.array([row[1] for row in rows], dtype='<u2')
+    entity_counts = np.array([row[2] for row in rows], dtype='<u8')
+
+    header = json.dumps({"labels": labels, "num_strings": len(strings), "num_entities": len(rows),
+                         "string_bytes": len(string_data)}).encode('utf-8')
+    temporary_file = path + ".tmp"
+    with open(temporary_file, 'wb') as file:
+        file.write(MAGIC + np.uint64(len(header)).astype('<u8').tobytes() + header + _padding(len(header)))
+        for section in (string_offsets.tobytes(), string_data, entity_strings.tobytes(), entity_labels.tobytes(),
+                        entity_counts.tobytes()):
+            file.write(section + _padding(len(section)))
+    os.replace(temporary_file, path)
+
+
+class EntityStore:
+    """
+    Read only view of a store file, memory mapped. It can be used wherever the Counter returned by
+    entity_index.build_entity_index is used: it supports get, [], in, len and items.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the store file.
+        """
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self.data[:8]) != MAGIC:
+            raise ValueError(f"{path} is not an entity store file")
+        header_length = int(self.data[8:16].view('<u8')[0])
+        header = json.loads(bytes(self.data[16:16 + header_length]))
+        self.labels = header["labels"]
+        self.label_codes = {label: code for code, label in enumerate(self.labels)}
+        num_strings, num_entities = header["num_strings"], header["num_entities"]
+
+        # Slice the sections out of the memory map without copying them
+        position = 16 + header_length + len(_padding(header_length))
+        sections = []
+        for dtype, length in (('<u8', num_strings + 1), ('u1', header["string_bytes"]), ('<u4', num_entities),
+                              ('<u2', num_entities), ('<u8', num_entities)):
+            size = length * np.dtype(dtype).itemsize
+            sections.append(self.data[position:position + size].view(dtype))
+            position += size + len(_padding(size))
+        self.string_offsets, self.string_data, self.entity_strings, self.entity_labels, self.entity_counts = sections
+
+    def _string(self, string_id):
+        # The UTF-8 bytes of an interned string
+        return bytes(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]])
+
+    def _find_string(self, text):
+        # Binary search of the sorted string table, returning the id of the text or None
+        target = text.encode('utf-8')
+        low, high = 0, len(self.string_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._string(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.string_offsets) - 1 and self._string(low) == target:
+            return low
+        return None
+
+    def get(self, key, default=0):
+        """
+        Looks up the number of occurrences of an entity.
+
+        :param key: The (text, label) pair of the entity.
+        :param default: The value returned if the entity is not in the store.
+
+        :returns int: The number of occurrences of the entity, or default.
+        """
+        text, label = key
+        label_code = self.label_codes.get(label)
+        string_id = self._find_string(text) if label_code is not None else None
+        if string_id is None:
+            return default
+        # The rows of a string are contiguous, one per label it was found with
+        start = np.searchsorted(self.entity_strings, string_id, side='left')
+        end = np.searchsorted(self.entity_strings, string_id, side='right')
+        for row in range(start, end):
+            if self.entity_labels[row] == label_code:
+                return int(self.entity_counts[row])
+        return default
+
+    def __getitem__(self, key):
+        # Like a Counter, a missing entity has 0 occurrences
+        return self.get(key, 0)
+
+    def __contains__(self, key):
+        return self.get(key, 0) > 0
+
+    def __len__(self):
+        return len(self.entity_counts)
+
+    def items(self):
+        """
+        Iterates over every entity of the store.
+
+        :returns generator: A generator of ((text, label), count) tuples.
+        """
+        for row in range(len(self.entity_counts)):
+            text = self._string(int(self.entity_strings[row])).decode('utf-8')
+            yield (text, self.labels[self.entity_labels[row]]), int(self.entity_counts[row])
+
+    def to_counter(self):
+        """
+        Copies the store into a Counter.
+
+        :returns Counter: The number of occurrences of every (text, label) pair.
+        """
+        return Counter(dict(self.items()))
+
+
+class DecadeEntityStore:
+    """
+    Directory holding the entity store of a decade subset as one segment per group of books, plus their merge.
+    """
+
+    def __init__(self, store_dir):
+        """
+        :param store_dir: Path to the directory of the decade store, created if it does not exist.
+        """
+        self.store_dir = store_dir
+        self.segments_dir = os.path.join(store_dir, SEGMENTS_DIR)
+        self.merged_path = os.path.join(store_dir, MERGED_FILE)
+        os.makedirs(self.segments_dir, exist_ok=True)
+
+    def _segment_path(self, name):
+        # Segment names are book titles, so keep only the characters that are safe in a file name
+        return os.path.join(self.segments_dir, re.sub(r"[^\w.-]", "_", name) + ".ents")
+
+    def segments(self):
+        """
+        Lists the segment files of the store.
+
+        :returns list: The paths of the segment files.
+        """
+        return sorted(os.path.join(self.segments_dir, file_name) for file_name in os.listdir(self.segments_dir)
+                      if file_name.endswith(".ents"))
+
+    def add_segment(self, name, index):
+        """
+        Adds (or replaces) the entities of a group of books and updates the merged store.
+
+        :param name: The name of the segment, e.g. the title of the book.
+        :param index: The entity index of the books, see entity_index.build_entity_index.
+        """
+        write_entity_store(self._segment_path(name), index)
+        self.merge()
+
+    def remove_segment(self, name):
+        """
+        Removes the entities of a group of books and updates the merged store.
+
+        :param name: The name the segment was added with.
+
+        :returns bool: True if the segment existed.
+        """
+        path = self._segment_path(name)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        self.merge()
+        return True
+
+    def merge(self):
+        """
+        Sums the counts of every segment into the merged store.
+        """
+        merged = Counter()
+        for path in self.segments():
+            merged.update(dict(EntityStore(path).items()))
+        write_entity_store(self.merged_path, merged)
+
+    def load(self):
+        """
+        Memory maps the merged store, merging the segments first if it was never written.
+
+        :returns EntityStore: The entities of the whole decade subset.
+        """
+        if not os.path.exists(self.merged_path):
+            self.merge()
+        return EntityStore(self.merged_path)
+
+
+if __name__ == "__main__":
+    from entity_index import build_entity_index
+
+    parser = argparse.ArgumentParser(description="Add or remove books in the entity store of a decade subset.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Add (or replace) the entities of a book")
+    add_parser.add_argument("store_dir", help="Directory of the decade store")
+    add_parser.add_argument("name", help="Name of the segment, e.g. the title of the book")
+    add_parser.add_argument("entities_file", help="Entities of the book, written by NER_decade_dataset.py")
+    remove_parser = subparsers.add_parser("remove", help="Remove the entities of a book")
+    remove_parser.add_argument("store_dir", help="Directory of the decade store")
+    remove_parser.add_argument("name", help="Name the segment was added with")
+    args = parser.parse_args()
+
+    store = DecadeEntityStore(args.store_dir)
+    if args.command == "add":
+        store.add_segment(args.name, build_entity_index(args.entities_file))
+    elif not store.remove_segment(args.name):
+        print(f"No segment named '{args.name}' in {args.store_dir}")
+    print(f"{len(store.load())} distinct entities in {len(store.segments())} segments")
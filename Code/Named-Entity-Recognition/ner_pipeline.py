@@ -0,0 +1,215 @@
+"""
+This file runs the generation and the NER scoring of the NER_model_* scripts as a producer/consumer pipeline. A
+producer thread queries the model and puts every completion on a queue, while the main thread takes the completions
+off the queue in batches and has a pool of spaCy worker processes extract their entities. The network requests and
+the CPU-bound NER therefore overlap instead of running one after the other.
+
+Both phases are checkpointed to JSON Lines files: every completion is appended to the completions file as soon as it
+is generated, and every score to the scores file as soon as it is computed. Rerunning skips what is already in the
+files, so an interrupted run resumes where it stopped, and the scoring can be rerun (e.g. against another decade)
+without generating the completions again. Completions are checkpointed under the prompt and the model, and scores
+also under a digest of the entity index and the weighted flag, so records written with other settings are ignored.
+"""
+
+import os
+import json
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import spacy
+
+from entity_index import count_matched_entities, entity_index_digest
+
+# spaCy model loaded by every NER worker
+SPACY_MODEL = "en_core_web_sm"
+# The spaCy model of the current worker process, loaded by _init_worker
+_worker_nlp = None
+
+
+# Function to load spaCy once in every worker process
+def _init_worker(model_name):
+    global _worker_nlp
+    # Only the entities are needed, so the components that NER does not depend on are not loaded at all
+    _worker_nlp = spacy.load(model_name, exclude=["tagger", "parser", "attribute_ruler", "lemmatizer"])
+
+
+# Function to extract the entities of a batch of completions in a worker process
+def _extract_batch(texts):
+    return [[(ent.text, ent.label_) for ent in doc.ents] for doc in _worker_nlp.pipe(texts)]
+
+
+# Function to load the records of a prompt and its settings from a checkpoint file
+def load_checkpoint(checkpoint_file, key):
+    """
+    Loads the records checkpointed under a key.
+
+    :param checkpoint_file: Path to the completions or scores file.
+    :param key: The fields the records must match, e.g. {"prompt": prompt, "model": model}.
+
+    :returns dict: The record of every checkpointed iteration matching the key, keyed by iteration.
+    """
+    records = {}
+    if not os.path.exists(checkpoint_file):
+        return records
+    with open(checkpoint_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off by an interrupted run; its iteration is simply run again
+                continue
+            # Records written with other settings (or before a field was part of the key) do not match
+            if isinstance(record, dict) and "iteration" in record and \
+                    all(record.get(field) == value for field, value in key.items()):
+                records[record["iteration"]] = record
+    return records
+
+
+# Function to open a checkpoint file for appending records
+def open_checkpoint(checkpoint_file):
+    """
+    Opens a completions or scores file for appending. A last line cut off by an interrupted run is ended with a
+    newline first, so the next record starts on a line of its own instead of being lost with the cut off one.
+
+    :param checkpoint_file: Path to the completions or scores file.
+
+    :returns: The file, opened for appending.
+    """
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, 'rb+') as file:
+            if file.seek(0, os.SEEK_END) > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+    return open(checkpoint_file, 'a', encoding='utf-8')
+
+
+# Function generating the completions in the producer thread
+def _produce(key, generate, iterations, completions_file, work):
+    try:
+        with open_checkpoint(completions_file) as out:
+            for i in iterations:
+                print(f"Iteration {i + 1}...")  # Print the iteration number
+                try:
+                    model_output = generate(i)
+                except Exception as e:
+                    print(f"Error: {str(e)}")  # Print an error message if the query fails
+                    continue
+                if model_output is None:
+                    continue
+                # Checkpoint the completion before handing it over, so the scoring can be rerun on its own
+                out.write(json.dumps({**key, "iteration": i, "response": model_output}) + '\n')
+                out.flush()
+                work.put((i, model_output))
+    finally:
+        # Tell the consumer that no more completions are coming
+        work.put(None)
+
+
+# Function to run the generation and the NER scoring of a prompt as a pipeline
+def run_ner_pipeline(prompt, generate, num_iterations, entity_index, completions_file, scores_file,
+                     model=None, run_generation=True, run_scoring=True, weighted=False, batch_size=8,
+                     num_workers=None, flush_interval=1.0):
+    """
+    Generates num_iterations completions of the prompt and counts the entities of each one that match the ground
+    truth entities, overlapping the two. Iterations already in the checkpoint files are not generated or scored
+    again.
+
+    :param prompt: The prompt sent to the model.
+    :param generate: Function taking the iteration number and returning the completion text.
+    :param num_iterations: The number of completions of the prompt.
+    :param entity_index: The index of the ground truth entities, see entity_index.load_or_build_entity_index.
+    :param completions_file: Path to the completions checkpoint file, appended to.
+    :param scores_file: Path to the scores checkpoint file, appended to.
+    :param model: The name of the model, part of the checkpoint key of the completions and scores.
+    :param run_generation: If False, only the completions already in the completions file are scored.
+    :param run_scoring: If False, the completions are only generated and checkpointed.
+    :param weighted: If True, every matched entity counts as its number of occurrences in the decade subset.
+    :param batch_size: The number of completions sent to a NER worker at a time.
+    :param num_workers: The number of NER worker processes, by default one per core.
+    :param flush_interval: Seconds to wait for a batch to fill up before sending a partial batch to the workers.
+
+    :returns tuple: The average matched entity count over the scored iterations and a list of matched entities.
+    """
+    completions_key = {"prompt": prompt, "model": model}
+    # Scores depend on the entity index and the weighting too, so scores computed against another decade or with
+    # another weighting are computed again
+    scores_key = {**completions_key, "entity_index": entity_index_digest(entity_index), "weighted": weighted}
+    completions = load_checkpoint(completions_file, completions_key)
+    scores = load_checkpoint(scores_file, scores_key)
+    work = queue.Queue()
+
+    # Completions generated by an earlier run but never scored go first
+    for i in sorted(completions):
+        if i < num_iterations and i not in scores:
+            work.put((i, completions[i]["response"]))
+
+    producer = None
+    if run_generation:
+        iterations = [i for i in range(num_iterations) if i not in completions]
+        producer = threading.Thread(target=_produce,
+                                    args=(completions_key, generate, iterations, completions_file, work), daemon=True)
+        producer.start()
+    else:
+        work.put(None)
+
+    if run_scoring:
+        lock = threading.Lock()
+        with open_checkpoint(scores_file) as out, \
+                ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                    initargs=(SPACY_MODEL,)) as executor:
+
+            # Function to count the matched entities of a batch once its NER is done, and checkpoint the scores
+            def record_batch(future, batch):
+                try:
+                    entity_lists = future.result()
+                except Exception as e:
+                    print(f"Error extracting entities: {str(e)}")  # The batch is scored again on the next run
+                    return
+                with lock:
+                    for (i, _), model_output_entities in zip(batch, entity_lists):
+                        # Count how many entities match between model output and ground truth
+                        matched_count, matched_entities = count_matched_entities(model_output_entities,
+                                                                                 entity_index, weighted)
+                        print(f"Matched entities (Iteration {i + 1}): {matched_entities}")
+                        score = {**scores_key, "iteration": i, "matched_count": matched_count,
+                                 "matched_entities": matched_entities}
+                        out.write(json.dumps(score) + '\n')
+                        out.flush()
+                        scores[i] = score
+
+            def submit(batch):
+                future = executor.submit(_extract_batch, [text for _, text in batch])
+                future.add_done_callback(lambda done: record_batch(done, batch))
+
+            batch = []
+            while True:
+                try:
+                    # Wait for the next completion, but not so long that a partial batch sits idle
+                    item = work.get(timeout=flush_interval) if batch else work.get()
+                except queue.Empty:
+                    submit(batch)
+                    batch = []
+                    continue
+                if item is None:
+                    break
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    submit(batch)
+                    batch = []
+            if batch:
+                submit(batch)
+        # Leaving the with block waits for the workers to finish every batch
+
+    if producer is not None:
+        producer.join()
+
+    scored = [scores[i] for i in sorted(scores) if i < num_iterations]
+    total_matched_count = sum(score["matched_count"] for score in scored)
+    total_matched_entities = [tuple(entity) for score in scored for entity in score["matched_entities"]]
+    # Calculate the average matched count based on successful iterations
+    average_matched_count = total_matched_count / len(scored) if scored else 0
+    return average_matched_count, total_matched_entities
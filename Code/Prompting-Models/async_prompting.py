@@ -0,0 +1,261 @@
+"""
+    This file prompts a model (e.g. Llama or Mixtral on Anyscale) with the REPs concurrently, through the shared
+    backend of its provider (see model_client.py). It is used by prompt_llama.py and prompt_mixtral.py.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import itertools
+import jsonlines
+from collections import deque
+
+# The shared helpers for querying the models live in Code/Model-Clients
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Model-Clients'))
+from rate_limiter import AdaptiveRateLimiter, call_with_rate_limit_async
+from model_client import is_multiple_samples_rejected, disable_multiple_samples
+
+# Instruction to the model, the same for every REP
+SYSTEM_PROMPT = "You are a text completion assistant. Your task is to continue the given sentence using the provided number of tokens without any explanations or commentary. Simply extend the sentence provided."
+
+
+class EndpointBudget:
+    """
+    Request and token budget of one endpoint over a sliding window (one minute by default). A request waits until
+    both budgets have room for it. Tokens are reserved up front from an estimate and corrected with the usage
+    reported by the endpoint once the response arrives.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=60.0):
+        """
+        :param requests_per_minute: The maximum number of requests per window, or None for no limit.
+        :param tokens_per_minute: The maximum number of tokens (prompt and completion) per window, or None for no
+                                  limit.
+        :param window: The length of the window in seconds.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self.events = deque()  # [start time, tokens, still in window] of every request in the window
+        self.tokens_in_window = 0
+        self.lock = asyncio.Lock()
+
+    def _prune(self, now):
+        # Forget the requests that left the window
+        while self.events and self.events[0][0] <= now - self.window:
+            event = self.events.popleft()
+            self.tokens_in_window -= event[1]
+            event[2] = False
+
+    def _has_room(self, tokens):
+        if self.requests_per_minute is not None and len(self.events) >= self.requests_per_minute:
+            return False
+        # A single request larger than the whole token budget is let through once the window is empty
+        if self.tokens_per_minute is not None and self.events:
+            return self.tokens_in_window + tokens <= self.tokens_per_minute
+        return True
+
+    async def acquire(self, tokens):
+        """
+        Waits until the budget has room for a request and reserves it.
+
+        :param tokens: The estimated number of tokens of the request.
+
+        :returns list: The reservation, to be passed to settle once the actual usage is known.
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                if self._has_room(tokens):
+                    event = [now, tokens, True]
+                    self.events.append(event)
+                    self.tokens_in_window += tokens
+                    return event
+                # Sleep until the oldest request leaves the window
+                await asyncio.sleep(self.events[0][0] + self.window - now)
+
+    def settle(self, event, tokens):
+        """
+        Replaces the estimated tokens of a reservation with the actual usage.
+
+        :param event: The reservation returned by acquire.
+        :param tokens: The number of tokens the request actually used.
+        """
+        if event[2]:
+            self.tokens_in_window += tokens - event[1]
+            event[1] = tokens
+
+
+# Function to send one request within the concurrency limit and the budget of the endpoint
+async def request_samples(backend, semaphore, budget, rate_limiter, model, prompt, max_tokens, n=1):
+    """
+    Sends the system prompt and a REP to the model, asking for n samples in the same request.
+
+    :param backend: The backend of the endpoint, see model_client.get_backend.
+    :param semaphore: The semaphore limiting the number of requests in flight.
+    :param budget: The EndpointBudget of the endpoint.
+    :param rate_limiter: The AdaptiveRateLimiter of the endpoint, which backs off when the endpoint answers 429.
+    :param model: The model to use for generation.
+    :param prompt: The prompt that the model will complete.
+    :param max_tokens: The maximum number of tokens of each completion.
+    :param n: The number of samples, sent as the multi-completion parameter of the provider.
+
+    :returns list: The generated texts, fewer than n if the endpoint ignored the multi-completion parameter.
+    """
+    # Rough estimate of the prompt tokens (about 4 characters per token) plus the completion budget of every sample
+    estimated_tokens = (len(SYSTEM_PROMPT) + len(prompt)) // 4 + n * max_tokens
+    # Wait for the budget before taking a slot, so the slots only limit the requests actually in flight
+    event = await budget.acquire(estimated_tokens)
+
+    async def send():
+        # The rate limiter has already let the request through when it is sent, so the slot is taken last
+        async with semaphore:
+            # Send the system prompt with the task instructions and the sentence to complete
+            return await backend.complete_n_async(model, SYSTEM_PROMPT, prompt, {"max_tokens": max_tokens}, n)
+    samples = await call_with_rate_limit_async(send, rate_limiter)
+    if samples.total_tokens is not None:
+        budget.settle(event, samples.total_tokens)
+    return samples.texts[:n]
+
+
+# Function to read the responses already recorded in an output file
+def load_recorded_responses(file_path, num_responses):
+    """
+    Reads the responses a previous run recorded in the output file of a prompt, without modifying the file. Lines
+    without an iteration (written before responses recorded their iteration) count as the lowest iterations not
+    recorded otherwise, so they still count towards num_responses. Repeated iterations are counted once and a last
+    line cut off by an interrupted run is skipped; the file is ended with a newline so new responses are appended
+    after it on lines of their own.
+
+    :param file_path: The output file of the prompt.
+    :param num_responses: Number of responses to generate for the prompt.
+
+    :returns set: The iterations already recorded in the file.
+    """
+    if not os.path.exists(file_path):
+        return set()
+    recorded_iterations = set()
+    unnumbered = 0
+    with jsonlines.open(file_path) as reader:
+        for record in reader.iter(skip_invalid=True):
+            if not isinstance(record, dict) or "response" not in record:
+                continue
+            iteration = record.get("iteration")
+            if iteration is None:
+                unnumbered += 1
+            elif isinstance(iteration, int) and 0 <= iteration < num_responses:
+                recorded_iterations.add(iteration)
+    # Responses recorded without their iteration fill the first iterations still missing
+    missing = (iteration for iteration in range(num_responses) if iteration not in recorded_iterations)
+    recorded_iterations.update(itertools.islice(missing, unnumbered))
+    # Terminate a last line cut off by an interrupted run, so the next response is not appended to it
+    with open(file_path, "rb+") as file:
+        if file.seek(0, os.SEEK_END) > 0:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.write(b"\n")
+    return recorded_iterations
+
+
+# Function to query the model with every prompt concurrently and record the responses as they finish
+async def run_prompt_sweep(backend, model, prompts, file_paths, num_responses=50, max_tokens=100, concurrency=16,
+                           requests_per_minute=None, tokens_per_minute=None, rate_limiter=None, response_cache=None,
+                           samples_per_request=None):
+    """
+    Generates num_responses completions for every prompt, with up to concurrency requests in flight across all
+    prompts and iterations. The completions of a prompt are requested samples_per_request at a time with the
+    multi-completion parameter of the provider. Every response is appended to the file of its prompt as soon as it
+    arrives. The iterations already recorded in the file of a prompt are skipped, so rerunning the sweep resumes it
+    instead of duplicating the responses.
+
+    :param backend: The backend of the endpoint, see model_client.get_backend.
+    :param model: The model to use for generation.
+    :param prompts: The list of REPs.
+    :param file_paths: The output file of each prompt, in the same order as prompts; every prompt needs its own.
+    :param num_responses: Number of responses to generate for each prompt.
+    :param max_tokens: The maximum number of tokens of each completion.
+    :param concurrency: The maximum number of requests in flight.
+    :param requests_per_minute: Request budget of the endpoint, or None for no limit.
+    :param tokens_per_minute: Token budget of the endpoint, or None for no limit.
+    :param rate_limiter: The AdaptiveRateLimiter of the endpoint, by default one starting at concurrency requests
+                         per second.
+    :param response_cache: An optional ResponseCache; cached responses are replayed without querying the model.
+    :param samples_per_request: The number of completions asked for in one request, by default the
+                                max_samples_per_request of the backend; 1 sends one request per completion.
+
+    :returns int: The number of responses recorded by this run.
+    """
+    # Responses of two prompts sharing an output file could not be told apart when resuming the sweep
+    if len(set(map(os.path.abspath, file_paths))) != len(file_paths):
+        raise ValueError("Every prompt needs its own output file")
+    if len(file_paths) != len(prompts):
+        raise ValueError("Expected one output file per prompt")
+    semaphore = asyncio.Semaphore(concurrency)
+    budget = EndpointBudget(requests_per_minute, tokens_per_minute)
+    if rate_limiter is None:
+        rate_limiter = AdaptiveRateLimiter(rate=concurrency, burst=concurrency)
+    if samples_per_request is None:
+        samples_per_request = backend.max_samples_per_request
+
+    async def generate(index, iterations):
+        async def request(count):
+            texts = []
+            # Once the endpoint rejected several samples per request, the chunks still to send are sent singly
+            if count == 1 or backend.max_samples_per_request > 1:
+                try:
+                    texts = await request_samples(backend, semaphore, budget, rate_limiter, model, prompts[index],
+                                                  max_tokens, count)
+                except Exception as e:
+                    if count == 1 or not is_multiple_samples_rejected(e):
+                        raise
+                    disable_multiple_samples(backend, e)
+            # Endpoints that ignore or reject the multi-completion parameter answer with fewer samples (or none); ask
+            # for the rest singly
+            for _ in range(count - len(texts)):
+                texts.extend(await request_samples(backend, semaphore, budget, rate_limiter, model, prompts[index],
+                                                   max_tokens))
+            return texts[:count]
+        try:
+            if response_cache is None:
+                return index, iterations, await request(len(iterations))
+            # The iteration is the sample index, so every one of the num_responses samples is cached separately
+            return index, iterations, await response_cache.get_or_generate_many_async(
+                model, SYSTEM_PROMPT, prompts[index], {"max_tokens": max_tokens}, iterations, request)
+        except Exception as e:
+            return index, iterations, e
+
+    size = max(1, samples_per_request)
+    # Split the iterations not yet recorded for every prompt into chunks of one request each
+    chunks = []
+    for index, file_path in enumerate(file_paths):
+        recorded_iterations = load_recorded_responses(file_path, num_responses)
+        missing = [iteration for iteration in range(num_responses) if iteration not in recorded_iterations]
+        chunks.append([missing[start:start + size] for start in range(0, len(missing), size)])
+    # Interleave the prompts, so the first responses of every prompt are requested first
+    tasks = [asyncio.create_task(generate(index, prompt_chunks[position]))
+             for position in range(max(map(len, chunks), default=0))
+             for index, prompt_chunks in enumerate(chunks) if position < len(prompt_chunks)]
+    writers = [jsonlines.open(file_path, mode="a", flush=True) for file_path in file_paths]
+    total = sum(len(iterations) for prompt_chunks in chunks for iterations in prompt_chunks)
+    recorded = 0
+    try:
+        for task in asyncio.as_completed(tasks):
+            index, iterations, result = await task
+            if isinstance(result, Exception):
+                # Handle any errors that occur during the generation process
+                print(f"Error (iterations {iterations[0] + 1}-{iterations[-1] + 1} for prompt: {prompts[index]}): {result}")
+                continue
+            for iteration, response in zip(iterations, result):
+                if response is None:
+                    print(f"Error (iteration {iteration + 1} for prompt: {prompts[index]}): no response returned")
+                    continue
+                # Record the generated response, with its iteration since responses finish out of order
+                writers[index].write({"response": response, "iteration": iteration})
+                recorded += 1
+                print(f"Recorded response {recorded} of {total}")
+    finally:
+        for writer in writers:
+            writer.close()
+    return recorded
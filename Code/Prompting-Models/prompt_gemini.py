@@ -2,14 +2,25 @@
     This file is used to prompt Gemini with the REPs.
 """
 
+import os
+import sys
 import jsonlines
-import time
-import vertexai
-from vertexai.generative_models import GenerativeModel
-from vertexai.language_models import ChatModel
 
-# Initialize Vertex AI client with the project ID and location
-vertexai.init(project="your project id", location="your location")
+# The shared helpers for querying the models live in Code/Model-Clients
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Model-Clients'))
+from rate_limiter import AdaptiveRateLimiter
+from response_cache import ResponseCache
+from model_client import get_backend, sample_completions
+
+# Shared Vertex AI backend with the project ID and location; it keeps one handle per model for every request
+backend = get_backend("vertex", project="your project id", location="your location")
+
+# Paces the requests to Gemini, backing off only when Vertex AI reports that the rate limit was hit
+rate_limiter = AdaptiveRateLimiter(rate=1.0)
+
+# Cache of the responses, so rerunning an unchanged sweep does not query the model again.
+# With replay_only=True, responses missing from the cache are reported as errors instead of being generated.
+response_cache = ResponseCache("path to response cache", max_bytes=1 << 30, replay_only=False)
 
 # List of prompts, for e.g those for race
 prompts = [
@@ -51,35 +62,36 @@ def multiturn_generate_content(prompt, file_path):
 
     num_responses = 50  # Set the number of responses to generate for each prompt
 
-    # Loop to generate multiple responses
-    for i in range(num_responses):
-        print(f"Iteration {i + 1} for prompt: {prompt}")  # Output progress for each iteration
-        try:
-            # Initialize a new instance of the generative model for each iteration
-            model = GenerativeModel(model_name)
-            chat = model.start_chat(response_validation=False)  # Start a new chat session
-
-            # System instruction for the model, which directs it to continue the sentence without additional commentary
-            system_prompt = "You are a text completion assistant. Your task is to continue the given sentence using the provided number of tokens without any explanations or commentary. Simply extend the sentence provided."
+    # System instruction for the model, which directs it to continue the sentence without additional commentary
+    system_prompt = "You are a text completion assistant. Your task is to continue the given sentence using the provided number of tokens without any explanations or commentary. Simply extend the sentence provided."
 
-            # Combine the system prompt and the user prompt into the message to be sent
-            initial_message = f"{system_prompt}\n\n{prompt}"
+    # Parameters to control response generation
+    generation_config = {"max_output_tokens": 100, "temperature": 1.5, "top_p": 1}
 
-            # Send the message to the model, configuring generation settings
-            response = chat.send_message(
-                initial_message,
-                generation_config={"max_output_tokens": 100, "temperature": 1.5, "top_p": 1}
-                # Parameters to control response generation
-            )
+    # Function to query the model for the samples that are not cached
+    def generate(count):
+        # Send the system prompt and the user prompt to the model as one message, asking for count candidates at once
+        return sample_completions(backend, model_name, system_prompt, prompt, generation_config, count, rate_limiter)
 
-            # Record the generated response in the JSONL file
-            record_response(response.text, file_path)
-            print(response.text)  # Output the generated response to the console
-
-            time.sleep(20)  # Add a delay between requests to avoid hitting API rate limits
+    # Loop over the chunks of responses, each generated with as few requests as the model allows
+    samples_per_request = backend.max_samples_per_request
+    for start in range(0, num_responses, samples_per_request):
+        iterations = list(range(start, min(start + samples_per_request, num_responses)))
+        print(f"Iterations {iterations[0] + 1}-{iterations[-1] + 1} for prompt: {prompt}")  # Output progress
+        try:
+            responses = response_cache.get_or_generate_many(model_name, system_prompt, prompt, generation_config,
+                                                            iterations, generate)
         except Exception as e:
-            # Handle any errors during the generation or recording process
+            # Handle any errors during the generation process
             print(f"Error: {str(e)}")
+            continue
+        for response_text in responses:
+            if response_text is None:
+                print("Error: the model did not return a response")
+                continue
+            # Record the generated response in the JSONL file
+            record_response(response_text, file_path)
+            print(response_text)  # Output the generated response to the console
 
 
 # Main execution block